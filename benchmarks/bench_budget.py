@@ -0,0 +1,95 @@
+"""
+Times solving a list of budgets the way /backend/budget/batch does, with
+one model and one pair of scalers shared by every solve, against one
+/backend/budget call per budget, where each call starts from freshly loaded
+model and scaler objects and so recompiles the jitted objective. The model
+is fitted once on small synthetic data.
+
+    python benchmarks/bench_budget.py
+    python benchmarks/bench_budget.py --budgets 8 --n-time-periods 12
+"""
+import argparse
+import copy
+import io
+import os
+import sys
+import time
+
+import jax.numpy as jnp
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "shared"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "docker", "application"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tests"))
+
+from budgetsurface import default_budget_grid, solve_budget  # noqa: E402
+from lightweight_mmm import lightweight_mmm, preprocessing  # noqa: E402
+from test_checkpoint import small_inputs  # noqa: E402
+from util import LightweightMMMSerializer  # noqa: E402
+
+
+def fitted_model(weeks, channels):
+    media, media_prior, target, extra_features = small_inputs(weeks=weeks, channels=channels, geos=1)
+    media_scaler = preprocessing.CustomScaler(divide_operation=jnp.mean)
+    target_scaler = preprocessing.CustomScaler(divide_operation=jnp.mean)
+
+    mmm = lightweight_mmm.LightweightMMM("carryover")
+    mmm.fit(
+        media=media_scaler.fit_transform(100 * media[..., 0]),
+        media_prior=media_prior,
+        target=target_scaler.fit_transform(target[..., 0]),
+        extra_features=extra_features[..., 0],
+        number_warmup=50,
+        number_samples=50,
+        number_chains=1,
+        seed=1,
+    )
+    return mmm, target_scaler, media_scaler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budgets", type=int, default=8)
+    parser.add_argument("--n-time-periods", type=int, default=12)
+    parser.add_argument("--weeks", type=int, default=52)
+    parser.add_argument("--channels", type=int, default=4)
+    args = parser.parse_args()
+
+    mmm, target_scaler, media_scaler = fitted_model(args.weeks, args.channels)
+    budgets = default_budget_grid(mmm, args.n_time_periods, media_scaler, args.budgets)
+    json_str, numpy_bytes = LightweightMMMSerializer.serialize(mmm)
+
+    def load_inputs():
+        numpy_bytes.seek(0)
+        model = LightweightMMMSerializer.deserialize(numpy_bytes, io.StringIO(json_str))
+        return model, copy.deepcopy(target_scaler), copy.deepcopy(media_scaler)
+
+    start = time.perf_counter()
+    single = []
+    for budget in budgets:
+        model, target_scaler_copy, media_scaler_copy = load_inputs()
+        single.append(
+            solve_budget(model, budget, args.n_time_periods, target_scaler_copy, media_scaler_copy)
+        )
+    single_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    model, target_scaler_copy, media_scaler_copy = load_inputs()
+    batch = [
+        solve_budget(model, budget, args.n_time_periods, target_scaler_copy, media_scaler_copy)
+        for budget in budgets
+    ]
+    batch_seconds = time.perf_counter() - start
+
+    for single_solution, batch_solution in zip(single, batch):
+        np.testing.assert_allclose(single_solution.allocation, batch_solution.allocation, rtol=1e-5)
+
+    print(
+        f"budgets={len(budgets)} n_time_periods={args.n_time_periods} "
+        f"single={single_seconds:.2f}s ({single_seconds / len(budgets):.2f}s per budget) "
+        f"batch={batch_seconds:.2f}s ({batch_seconds / len(budgets):.2f}s per budget)"
+    )
+
+
+if __name__ == "__main__":
+    main()
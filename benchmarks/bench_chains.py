@@ -0,0 +1,104 @@
+"""
+Sweeps the numpyro chain methods over chain counts on synthetic data and
+prints warmup plus sampling throughput next to the method plan_chains
+picks for this host. Every fit runs in its own process, since the XLA host
+device count has to be set before JAX starts.
+
+    python benchmarks/bench_chains.py
+    python benchmarks/bench_chains.py --chains 2 4 8 --geos 20
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "shared"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "docker", "application"))
+
+from chainplan import (  # noqa: E402
+    CHAIN_METHODS,
+    detect_cpu_count,
+    detect_memory_bytes,
+    estimate_chain_bytes,
+    plan_chains,
+)
+
+# Fits one model and prints the warmup plus sampling iterations per second
+FIT_SCRIPT = """
+import sys, time
+import numpy as np, numpyro
+
+chains, method, weeks, geos, warmup, samples = sys.argv[1:7]
+chains, weeks, geos, warmup, samples = (int(arg) for arg in (chains, weeks, geos, warmup, samples))
+numpyro.set_host_device_count(chains if method == "parallel" else 1)
+
+from lightweight_mmm import lightweight_mmm
+from sampler import fit_mmm
+
+rng = np.random.default_rng(0)
+media = rng.uniform(0.5, 1.5, (weeks, 3, geos)).astype(np.float32)
+target = rng.uniform(0.5, 1.5, (weeks, geos)).astype(np.float32)
+extra_features = rng.uniform(0.5, 1.5, (weeks, 2, geos)).astype(np.float32)
+
+start = time.perf_counter()
+fit_mmm(
+    lightweight_mmm.LightweightMMM("carryover"), media, np.full(3, 0.15, np.float32),
+    target, extra_features, number_warmup=warmup, number_samples=samples,
+    number_chains=chains, chain_method=method, seed=1, progress_bar=False,
+)
+print(chains * (warmup + samples) / (time.perf_counter() - start))
+"""
+
+
+def samples_per_second(chains, method, weeks, geos, warmup, samples):
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)}
+    output = subprocess.run(
+        [sys.executable, "-c", FIT_SCRIPT, str(chains), method, str(weeks), str(geos), str(warmup), str(samples)],
+        capture_output=True,
+        check=True,
+        text=True,
+        env=env,
+    ).stdout
+    return float(output.split()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chains", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--methods", nargs="+", default=list(CHAIN_METHODS), choices=CHAIN_METHODS)
+    parser.add_argument("--weeks", type=int, default=52)
+    parser.add_argument("--geos", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--samples", type=int, default=100)
+    args = parser.parse_args()
+
+    cpu_count = detect_cpu_count()
+    memory_bytes = detect_memory_bytes()
+    print(f"cpus={cpu_count} memory={memory_bytes / 2**30:.1f}GiB")
+
+    for chains in args.chains:
+        plan = plan_chains(
+            chains,
+            cpu_count=cpu_count,
+            gpu_count=0,
+            memory_bytes=memory_bytes,
+            chain_bytes=estimate_chain_bytes(
+                args.samples, (args.weeks, 3, args.geos), number_extra_features=2
+            ),
+        )
+        rates = {
+            method: samples_per_second(
+                chains, method, args.weeks, args.geos, args.warmup, args.samples
+            )
+            for method in args.methods
+        }
+        best = max(rates, key=rates.get)
+        print(
+            f"chains={chains} "
+            + " ".join(f"{method}={rate:.1f}/s" for method, rate in rates.items())
+            + f" fastest={best} planned={plan.chain_method}"
+        )
+
+
+if __name__ == "__main__":
+    main()
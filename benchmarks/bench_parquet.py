@@ -0,0 +1,83 @@
+"""
+Times read_parquet_table against the frame an Athena `SELECT *` hands back
+for media tables of 100k to 1M rows, each followed by transform_media_data.
+The tables are written to a moto bucket and Glue catalog. Athena is
+stood in for by reading the same files with string keys and every column,
+so its query queue and result paging, which come on top in production, are
+left out. proc_data_latency on the job records has the real numbers.
+
+    python benchmarks/bench_parquet.py
+"""
+import argparse
+import os
+import sys
+import time
+
+import boto3
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "shared"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "docker", "application"))
+
+from bench_tensorbuilder import media_table  # noqa: E402
+
+BUCKET_NAME = "bench-bucket"
+GLUE_DB = "bench_db"
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    args = parser.parse_args()
+
+    for name, value in (
+        ("AWS_ACCESS_KEY_ID", "testing"),
+        ("AWS_SECRET_ACCESS_KEY", "testing"),
+        ("AWS_DEFAULT_REGION", "us-east-1"),
+        ("JAX_CACHE_DIR", ""),
+    ):
+        os.environ[name] = value
+
+    import awswrangler as wr
+    import moto
+
+    with moto.mock_aws():
+        import mainathena
+
+        boto3.client("s3").create_bucket(Bucket=BUCKET_NAME)
+        wr.catalog.create_database(GLUE_DB)
+
+        for rows in args.rows:
+            table_name = f"media_{rows}"
+            df = media_table(rows).assign(campaign="always_on")
+            mainathena.write_data(df, GLUE_DB, table_name, BUCKET_NAME)
+
+            def read_like_athena():
+                return wr.s3.read_parquet(
+                    path=f"s3://{BUCKET_NAME}/masterdata/{table_name}", dataset=True
+                )
+
+            athena_df, athena_read = timed(read_like_athena)
+            athena_tensor, athena_transform = timed(mainathena.transform_media_data, athena_df)
+            parquet_df, parquet_read = timed(
+                mainathena.read_parquet_table, GLUE_DB, table_name, "impressions"
+            )
+            parquet_tensor, parquet_transform = timed(
+                mainathena.transform_media_data, parquet_df
+            )
+            assert np.array_equal(athena_tensor, parquet_tensor)
+
+            print(
+                f"rows={len(df)} athena_frame read={athena_read:.2f}s transform={athena_transform:.2f}s "
+                f"parquet read={parquet_read:.2f}s transform={parquet_transform:.2f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
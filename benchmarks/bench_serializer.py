@@ -0,0 +1,85 @@
+"""
+Times loading a model from the npz artifact against the memory-mapped
+directory format, eagerly and lazily, and the time to a budget-style read of
+a single trace site after each load. The model carries a trace of --samples
+draws on 104 weeks of data, written once per format to a temporary folder.
+
+    python benchmarks/bench_serializer.py
+    python benchmarks/bench_serializer.py --samples 4000 --geos 100
+"""
+import argparse
+import io
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "shared"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tests"))
+
+from test_serializer import assert_same_model, fitted_model  # noqa: E402
+from util import LightweightMMMSerializer  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--weeks", type=int, default=104)
+    parser.add_argument("--channels", type=int, default=6)
+    parser.add_argument("--geos", type=int, default=50)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    model = fitted_model(
+        samples=args.samples, weeks=args.weeks, channels=args.channels, geos=args.geos
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        npz_path = os.path.join(directory, "model.npz")
+        start = time.perf_counter()
+        json_str, numpy_bytes = LightweightMMMSerializer.serialize(model)
+        with open(npz_path, "wb") as f:
+            f.write(numpy_bytes.getbuffer())
+        npz_write = time.perf_counter() - start
+
+        model_directory = os.path.join(directory, "model")
+        start = time.perf_counter()
+        LightweightMMMSerializer.serialize_to_directory(model, model_directory)
+        directory_write = time.perf_counter() - start
+
+        print(
+            f"trace={sum(value.nbytes for value in model.trace.values()) / 2**20:.0f}MiB "
+            f"npz={os.path.getsize(npz_path) / 2**20:.0f}MiB write npz={npz_write:.2f}s directory={directory_write:.2f}s"
+        )
+
+        loaders = {
+            "npz": lambda **options: LightweightMMMSerializer.deserialize(
+                npz_path, io.StringIO(json_str), **options
+            ),
+            "directory": lambda **options: LightweightMMMSerializer.deserialize_from_directory(
+                model_directory, **options
+            ),
+        }
+        for name, load in loaders.items():
+            for lazy in (False, True):
+                load_seconds, read_seconds = [], []
+                for _ in range(args.repeats):
+                    start = time.perf_counter()
+                    loaded = load(lazy=lazy)
+                    load_seconds.append(time.perf_counter() - start)
+
+                    start = time.perf_counter()
+                    np.asarray(loaded.trace["coef_media"]).sum()
+                    read_seconds.append(time.perf_counter() - start)
+                assert_same_model(loaded, model)
+
+                print(
+                    f"format={name} lazy={lazy} load={min(load_seconds):.3f}s "
+                    f"read_coef_media={min(read_seconds):.3f}s"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Times fit_mmm_svi against a NUTS fit of the same synthetic data and compares
+the mean media contribution % by channel, the figure the contribution chart
+shows. SVI runs once per guide and step count.
+
+    python benchmarks/bench_svi.py
+    python benchmarks/bench_svi.py --guides normal low_rank --steps 5000 20000
+"""
+import argparse
+import os
+import sys
+import time
+
+import jax.numpy as jnp
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "shared"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "docker", "application"))
+
+from lightweight_mmm import lightweight_mmm, preprocessing, utils  # noqa: E402
+from posterior import ensure_deterministic_sites  # noqa: E402
+from sampler import SVI_GUIDES, fit_mmm, fit_mmm_svi  # noqa: E402
+
+
+def synthetic_data(weeks, channels, geos, seed=0):
+    np.random.seed(seed)
+    media, extra_features, target, costs = utils.simulate_dummy_data(
+        data_size=weeks, n_media_channels=channels, n_extra_features=2, geos=geos
+    )
+    media_scaler = preprocessing.CustomScaler(divide_operation=jnp.mean)
+    target_scaler = preprocessing.CustomScaler(divide_operation=jnp.mean)
+    extra_features_scaler = preprocessing.CustomScaler(divide_operation=jnp.mean)
+    cost_scaler = preprocessing.CustomScaler(divide_operation=jnp.mean, multiply_by=0.15)
+    return (
+        media_scaler.fit_transform(media),
+        cost_scaler.fit_transform(costs),
+        target_scaler.fit_transform(target),
+        extra_features_scaler.fit_transform(extra_features),
+        target_scaler,
+        cost_scaler,
+    )
+
+
+def contribution_pct(mmm, target_scaler, cost_scaler):
+    ensure_deterministic_sites(mmm)
+    media_contribution, _ = mmm.get_posterior_metrics(
+        target_scaler=target_scaler, cost_scaler=cost_scaler
+    )
+    if media_contribution.ndim == 3:
+        media_contribution = jnp.mean(media_contribution, axis=-1)
+    return np.asarray(media_contribution.mean(axis=0)) * 100
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--weeks", type=int, default=104)
+    parser.add_argument("--channels", type=int, default=4)
+    parser.add_argument("--geos", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=500)
+    parser.add_argument("--samples", type=int, default=500)
+    parser.add_argument("--guides", nargs="+", default=list(SVI_GUIDES), choices=list(SVI_GUIDES))
+    parser.add_argument("--steps", type=int, nargs="+", default=[5000, 20000])
+    args = parser.parse_args()
+
+    media, costs, target, extra_features, target_scaler, cost_scaler = synthetic_data(
+        args.weeks, args.channels, args.geos
+    )
+
+    mmm = lightweight_mmm.LightweightMMM("carryover")
+    start = time.perf_counter()
+    fit_mmm(
+        mmm, media, costs, target, extra_features,
+        number_warmup=args.warmup, number_samples=args.samples, number_chains=1,
+        chain_method="sequential", seed=1, progress_bar=False,
+    )
+    seconds = time.perf_counter() - start
+    nuts = contribution_pct(mmm, target_scaler, cost_scaler)
+    print(f"nuts warmup={args.warmup} time={seconds:.1f}s contribution%={np.round(nuts, 2)}")
+
+    for guide in args.guides:
+        for steps in args.steps:
+            mmm = lightweight_mmm.LightweightMMM("carryover")
+            start = time.perf_counter()
+            fit_mmm_svi(
+                mmm, media, costs, target, extra_features,
+                number_steps=steps, number_samples=args.samples, number_chains=1,
+                guide=guide, seed=1,
+            )
+            seconds = time.perf_counter() - start
+            svi = contribution_pct(mmm, target_scaler, cost_scaler)
+            print(
+                f"svi guide={guide} steps={steps} time={seconds:.1f}s contribution%={np.round(svi, 2)} "
+                f"max_abs_diff={np.max(np.abs(svi - nuts)):.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
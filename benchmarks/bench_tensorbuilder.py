@@ -0,0 +1,71 @@
+"""
+Times build_dense_tensor against the iterrows loop it replaced on media
+tables of 10k to 10M rows. The loop is only timed up to --max-loop-rows,
+beyond that it takes minutes.
+
+    python benchmarks/bench_tensorbuilder.py
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "docker", "application"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tests"))
+
+from tensorbuilder import build_dense_tensor  # noqa: E402
+from test_tensorbuilder import iterrows_tensor  # noqa: E402
+
+CHANNELS = ["Facebook", "TikTok", "Amazon", "Instagram", "Google", "Youtube"]
+WEEKS = 104
+
+
+def media_table(rows, seed=0):
+    geos = max(1, rows // (WEEKS * len(CHANNELS)))
+    week, channel, geo = np.meshgrid(
+        np.arange(WEEKS), np.arange(len(CHANNELS)), np.arange(geos), indexing="ij"
+    )
+    df = pd.DataFrame(
+        {
+            "week_number": pd.Categorical.from_codes(
+                week.ravel(), [f"Week {i + 1}" for i in range(WEEKS)]
+            ).astype(str),
+            "media_channel": np.asarray(CHANNELS)[channel.ravel()],
+            "geography": geo.ravel(),
+            "impressions": np.random.default_rng(seed).random(week.size),
+        }
+    )
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000, 10_000_000])
+    parser.add_argument("--max-loop-rows", type=int, default=100_000)
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        df = media_table(rows)
+
+        start = time.perf_counter()
+        tensor = build_dense_tensor(df, "impressions")
+        vectorized_seconds = time.perf_counter() - start
+
+        loop_seconds = None
+        if len(df) <= args.max_loop_rows:
+            start = time.perf_counter()
+            expected = iterrows_tensor(df, "impressions")
+            loop_seconds = time.perf_counter() - start
+            assert np.array_equal(tensor.values, expected)
+
+        loop = f"{loop_seconds:.2f}s" if loop_seconds is not None else "skipped"
+        print(
+            f"rows={len(df)} shape={tensor.values.shape} vectorized={vectorized_seconds:.3f}s iterrows={loop}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -62,6 +62,7 @@ class CdkComputeStack(Stack):
                 "s3:AbortMultipartUpload",
                 "s3:CreateBucket",
                 "s3:PutObject",
+                "s3:DeleteObject",
             ], 
             resources=[
                 datalake_bucket_arn,
@@ -208,7 +209,19 @@ class CdkComputeStack(Stack):
             container=batch.EcsEc2ContainerDefinition(
                 self, mmm_job_type.job_container_name, **container_def
             ),
-            retry_attempts=1,
+            # Attempts after the first resume sampling from the S3 checkpoint.
+            # Only jobs that lost their host (Spot reclaim or instance
+            # termination, status reason "Host EC2*") are retried, failures
+            # of the job itself would fail again.
+            retry_attempts=3,
+            retry_strategies=[
+                batch.RetryStrategy.of(
+                    batch.Action.RETRY, batch.Reason.SPOT_INSTANCE_RECLAIMED
+                ),
+                batch.RetryStrategy.of(
+                    batch.Action.EXIT, batch.Reason.custom(on_reason="*")
+                ),
+            ],
             timeout=Duration.minutes(timeout),
         )
 
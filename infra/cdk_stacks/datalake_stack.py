@@ -42,6 +42,13 @@ class CdkDataLakeStack(Stack):
             auto_delete_objects=True,
             encryption=s3.BucketEncryption.S3_MANAGED,
             enforce_ssl=True,
+            lifecycle_rules=[
+                # Model uploads from training jobs that were stopped mid-upload
+                s3.LifecycleRule(abort_incomplete_multipart_upload_after=Duration.days(1)),
+                # Shared tier of the training tensor cache, only the local tier
+                # evicts. An expired tensor is rebuilt and uploaded on its next miss.
+                s3.LifecycleRule(prefix="tensor_cache/", expiration=Duration.days(30)),
+            ],
         )
 
         self.cfn_work_group = athena.CfnWorkGroup(
@@ -13,6 +13,7 @@ from aws_cdk import (
     aws_lambda as lambda_,
     aws_apigateway as apigw,
     Duration,
+    Size,
     aws_iam as iam,
     aws_logs as logs,
 )
@@ -223,8 +224,11 @@ class CdkFrontEndWebStack(Stack):
             environment={
                 "S3_BUCKET_NAME": datalake_bucket.bucket_name,
                 "DDB_TABLE_NAME": frontend_ddb_table.table_name,
+                "POWERTOOLS_SERVICE_NAME": "backend_api",
+                "POWERTOOLS_METRICS_NAMESPACE": "MixedMediaModelPortal",
             },
             memory_size=10240,
+            ephemeral_storage_size=Size.gibibytes(10),
             timeout=Duration.minutes(5),
         )
 
@@ -0,0 +1,193 @@
+import os
+import subprocess
+from dataclasses import dataclass
+from typing import List, Optional
+
+CHAIN_METHODS = ("parallel", "vectorized", "sequential")
+
+# Share of the available memory the sampler may plan to use for chain state
+# and samples, the rest is left to XLA buffers and the Python process. Also
+# the XLA_PYTHON_CLIENT_MEM_FRACTION of the training job.
+CHAIN_MEMORY_FRACTION = float(os.environ.get("CHAIN_MEMORY_FRACTION", "0.5"))
+
+# Copies of a chain's samples alive at once, the collected buffer and the
+# arrays get_samples gathers from it
+SAMPLE_COPIES = 2
+# Bytes of model and gradient intermediates per chain, in units of the media
+# tensor (time x channels x geos), an upper bound of CPU measurements
+WORKING_SET_FACTOR = 40
+
+
+@dataclass
+class ChainPlan:
+    chain_method: str
+    host_device_count: int
+    platform: str
+    reason: str
+    chain_groups: List[int]
+
+
+def detect_gpu_count() -> int:
+    """
+    Counts NVIDIA GPUs without initializing a JAX backend, so the host device
+    count can still be set afterwards.
+    """
+    try:
+        return len(os.listdir("/proc/driver/nvidia/gpus"))
+    except FileNotFoundError:
+        return 0
+
+
+def detect_cpu_count() -> int:
+    return len(os.sched_getaffinity(0))
+
+
+def detect_memory_bytes() -> int:
+    """
+    Physical memory, capped by the cgroup limit when the container has one.
+    """
+    memory_bytes = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+    for limit_path in (
+        "/sys/fs/cgroup/memory.max",
+        "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+    ):
+        try:
+            with open(limit_path) as f:
+                limit = f.read().strip()
+        except (FileNotFoundError, PermissionError):
+            continue
+        if limit.isdigit():
+            memory_bytes = min(memory_bytes, int(limit))
+        break
+
+    return memory_bytes
+
+
+def detect_gpu_memory_bytes() -> int:
+    """
+    Memory of the smallest GPU from nvidia-smi, 0 when there is none.
+    """
+    try:
+        output = subprocess.run(
+            ["nvidia-smi", "--query-gpu=memory.total", "--format=csv,noheader,nounits"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+    except (FileNotFoundError, subprocess.CalledProcessError):
+        return 0
+
+    memory_mib = [int(line) for line in output.split() if line.isdigit()]
+    return min(memory_mib) * 2**20 if memory_mib else 0
+
+
+def estimate_chain_bytes(
+    number_samples,
+    media_shape,
+    dtype_bytes=4,
+    number_extra_features=0,
+    collect_deterministic=True,
+) -> int:
+    """
+    Rough memory one chain needs: the samples it collects, which are copied
+    once when gathered after sampling, and the intermediates of evaluating
+    the model and its gradient, which scale with the media tensor. With
+    collect_deterministic the sites mu (time x geos) and media_transformed
+    (time x channels x geos) dominate the samples.
+    """
+    n_time = media_shape[0]
+    n_channels = media_shape[1]
+    n_geos = media_shape[2] if len(media_shape) == 3 else 1
+
+    # coef_media, intercept, coef_trend, sigma, four seasonality coefficients
+    # and the extra feature coefficients per geo, four parameters per channel
+    per_sample = n_geos * (n_channels + 7 + number_extra_features) + 4 * n_channels
+    if collect_deterministic:
+        per_sample += n_time * n_geos * (1 + n_channels)
+
+    samples_bytes = SAMPLE_COPIES * number_samples * per_sample * dtype_bytes
+    working_bytes = WORKING_SET_FACTOR * n_time * n_channels * n_geos * dtype_bytes
+    return int(samples_bytes + working_bytes)
+
+
+def plan_chain_groups(number_chains, chain_bytes, memory_bytes) -> List[int]:
+    """
+    Splits the chains into the fewest groups that each fit in the memory
+    budget, with sizes differing by at most one. Groups run one after the
+    other and each group's samples leave the device before the next starts.
+    """
+    budget_bytes = memory_bytes * CHAIN_MEMORY_FRACTION
+    chains_per_group = number_chains
+    if chain_bytes > 0:
+        chains_per_group = max(1, min(number_chains, int(budget_bytes // chain_bytes)))
+
+    number_groups = -(-number_chains // chains_per_group)
+    return [
+        number_chains // number_groups + (1 if group < number_chains % number_groups else 0)
+        for group in range(number_groups)
+    ]
+
+
+def plan_chains(
+    number_chains,
+    cpu_count,
+    gpu_count,
+    memory_bytes,
+    chain_bytes=0,
+    override: Optional[str] = None,
+) -> ChainPlan:
+    """
+    Picks how numpyro maps chains onto devices and how many chains run at
+    once. memory_bytes is the host memory on CPU and one GPU's memory on GPU.
+
+    - parallel runs one chain per device. On CPU the host is split into one
+      XLA device per chain, which needs at least a core per chain.
+    - vectorized runs all chains in one program on a single device, which
+      suits more chains than cores or GPUs.
+    - sequential runs chains one after the other and needs the least memory.
+
+    Chains that do not fit the memory budget together run in chain_groups,
+    one group after the other, see plan_chain_groups.
+    """
+    platform = "gpu" if gpu_count > 0 else "cpu"
+    devices = gpu_count if gpu_count > 0 else cpu_count
+    chain_groups = plan_chain_groups(number_chains, chain_bytes, memory_bytes)
+
+    if override is not None:
+        if override not in CHAIN_METHODS:
+            raise ValueError(
+                f"Unknown chain method '{override}', expected one of {CHAIN_METHODS}"
+            )
+        chain_method = override
+        reason = "requested in job record"
+    elif number_chains == 1:
+        chain_method = "sequential"
+        reason = "single chain"
+    elif number_chains <= devices:
+        chain_method = "parallel"
+        reason = f"{number_chains} chains fit on {devices} {platform} devices"
+    elif chain_groups[0] > 1:
+        chain_method = "vectorized"
+        reason = f"{number_chains} chains exceed {devices} {platform} devices"
+    else:
+        chain_method = "sequential"
+        reason = f"one chain of {chain_bytes} bytes at a time fits the memory budget"
+
+    # Parallel chains on GPU each have a device of their own
+    if platform == "gpu" and chain_method == "parallel":
+        chain_groups = [number_chains]
+    if len(chain_groups) > 1:
+        reason += f", {number_chains} chains need {chain_bytes * number_chains} bytes and run in groups of {chain_groups}"
+
+    host_device_count = 1
+    if platform == "cpu" and chain_method == "parallel":
+        host_device_count = chain_groups[0]
+
+    return ChainPlan(
+        chain_method=chain_method,
+        host_device_count=host_device_count,
+        platform=platform,
+        reason=reason,
+        chain_groups=chain_groups,
+    )
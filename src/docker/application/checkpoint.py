@@ -0,0 +1,175 @@
+import json
+import os
+import pickle
+import shutil
+from io import BytesIO
+from typing import Any, Dict, List, Optional
+
+import jax
+import numpy as np
+from botocore.exceptions import ClientError
+
+# Bump when the checkpoint layout written by save_checkpoint changes
+CHECKPOINT_VERSION = 1
+MANIFEST_NAME = "checkpoint.json"
+
+
+class LocalCheckpointStore:
+    """
+    Checkpoint files in a local directory. Stands in for S3 in local runs.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def read(self, name) -> Optional[bytes]:
+        try:
+            with open(os.path.join(self.directory, name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, name, data: bytes):
+        path = os.path.join(self.directory, name)
+        with open(f"{path}.part", "wb") as f:
+            f.write(data)
+        os.replace(f"{path}.part", path)
+
+    def delete(self, name):
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                self.delete(name)
+
+    def child(self, name) -> "LocalCheckpointStore":
+        return LocalCheckpointStore(os.path.join(self.directory, name))
+
+
+class S3CheckpointStore:
+    def __init__(self, s3_client, bucket_name, prefix):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+
+    def read(self, name) -> Optional[bytes]:
+        try:
+            return self.s3_client.get_object(
+                Bucket=self.bucket_name, Key=f"{self.prefix}/{name}"
+            )["Body"].read()
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                raise
+            return None
+
+    def write(self, name, data: bytes):
+        self.s3_client.upload_fileobj(
+            Fileobj=BytesIO(data), Bucket=self.bucket_name, Key=f"{self.prefix}/{name}"
+        )
+
+    def delete(self, name):
+        self.s3_client.delete_object(Bucket=self.bucket_name, Key=f"{self.prefix}/{name}")
+
+    def clear(self):
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=f"{self.prefix}/"):
+            for s3_object in page.get("Contents", []):
+                self.s3_client.delete_object(Bucket=self.bucket_name, Key=s3_object["Key"])
+
+    def child(self, name) -> "S3CheckpointStore":
+        return S3CheckpointStore(self.s3_client, self.bucket_name, f"{self.prefix}/{name}")
+
+
+def save_checkpoint(
+    store, config: Dict[str, Any], state, samples_done, segment_files, segment_samples=None
+) -> List[str]:
+    """
+    Persists the sampler after a segment. state is the numpyro HMCState
+    (position, adapted step size and mass matrix, RNG keys) and
+    segment_samples maps each site to the segment's draws grouped by chain.
+    Each segment's draws are written once; the manifest is written last and
+    lists them, so a crash mid-write leaves the previous checkpoint valid.
+    Returns the updated list of segment files.
+    """
+    state_name = f"state-{samples_done}.pkl"
+    store.write(state_name, pickle.dumps(jax.device_get(state)))
+
+    segment_files = list(segment_files)
+    if segment_samples is not None:
+        samples_name = f"samples-{samples_done}.npz"
+        samples_bytes = BytesIO()
+        np.savez(samples_bytes, **jax.device_get(segment_samples))
+        store.write(samples_name, samples_bytes.getvalue())
+        segment_files.append(samples_name)
+
+    previous = store.read(MANIFEST_NAME)
+
+    store.write(
+        MANIFEST_NAME,
+        json.dumps(
+            {
+                "version": CHECKPOINT_VERSION,
+                "config": config,
+                "samples_done": samples_done,
+                "state": state_name,
+                "segments": segment_files,
+            }
+        ).encode("utf-8"),
+    )
+
+    if previous is not None:
+        previous_state = json.loads(previous).get("state")
+        if previous_state != state_name:
+            store.delete(previous_state)
+
+    return segment_files
+
+
+def _matching_manifest(store, config: Dict[str, Any], verbose=True):
+    manifest_bytes = store.read(MANIFEST_NAME)
+    if manifest_bytes is None:
+        return None
+
+    manifest = json.loads(manifest_bytes)
+    if manifest.get("version") != CHECKPOINT_VERSION or manifest["config"] != config:
+        if verbose:
+            print(f"Ignoring checkpoint written for {manifest.get('config')}")
+        return None
+
+    return manifest
+
+
+def has_checkpoint(store, config: Dict[str, Any]) -> bool:
+    """
+    Whether load_checkpoint would resume from store, without reading the
+    state and draws.
+    """
+    return _matching_manifest(store, config, verbose=False) is not None
+
+
+def load_checkpoint(store, config: Dict[str, Any]):
+    """
+    Returns (state, segment_samples, samples_done, segment_files) of the
+    latest checkpoint, or None when there is none or it was written for a
+    different sampler config.
+    """
+    manifest = _matching_manifest(store, config)
+    if manifest is None:
+        return None
+
+    state = pickle.loads(store.read(manifest["state"]))
+
+    segment_samples = []
+    for samples_name in manifest["segments"]:
+        with np.load(BytesIO(store.read(samples_name))) as samples_npz:
+            segment_samples.append({site: samples_npz[site] for site in samples_npz.files})
+
+    return state, segment_samples, manifest["samples_done"], manifest["segments"]
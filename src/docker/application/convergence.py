@@ -0,0 +1,69 @@
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from numpyro.diagnostics import effective_sample_size, split_gelman_rubin
+
+from util import DETERMINISTIC_SITES
+
+# Fewest draws per chain before split R-hat and ESS are trusted to stop sampling
+MIN_CONVERGENCE_SAMPLES = 50
+
+
+def convergence_diagnostics(segments) -> Dict[str, Any]:
+    """
+    Worst split R-hat and smallest bulk ESS over every latent parameter, from
+    draws grouped by chain and collected in segments.
+    """
+    max_rhat = 0.0
+    min_ess = float("inf")
+    worst_site = None
+
+    for site in segments[0]:
+        if site in DETERMINISTIC_SITES:
+            continue
+        draws = np.concatenate([segment[site] for segment in segments], axis=1)
+
+        site_rhat = float(np.nanmax(split_gelman_rubin(draws)))
+        site_ess = float(np.nanmin(effective_sample_size(draws)))
+        if site_rhat > max_rhat:
+            max_rhat = site_rhat
+            worst_site = site
+        min_ess = min(min_ess, site_ess)
+
+    return {
+        "max_rhat": round(max_rhat, 4),
+        "min_ess": round(min_ess, 1),
+        "worst_rhat_site": worst_site,
+    }
+
+
+class ConvergenceMonitor:
+    """
+    on_segment callback for run_segmented that records the diagnostics after
+    every segment and stops sampling once the targets are met. A target left
+    as None is not checked.
+    """
+
+    def __init__(
+        self,
+        target_rhat: Optional[float] = None,
+        target_ess: Optional[float] = None,
+        min_samples=MIN_CONVERGENCE_SAMPLES,
+    ):
+        self.target_rhat = target_rhat
+        self.target_ess = target_ess
+        self.min_samples = min_samples
+        self.trajectory: List[Dict[str, Any]] = []
+
+    def __call__(self, samples_done, segments) -> bool:
+        diagnostics = {"samples": samples_done, **convergence_diagnostics(segments)}
+        self.trajectory.append(diagnostics)
+
+        converged = (
+            samples_done >= self.min_samples
+            and (self.target_rhat is None or diagnostics["max_rhat"] <= self.target_rhat)
+            and (self.target_ess is None or diagnostics["min_ess"] >= self.target_ess)
+        )
+        print(f"Convergence after {samples_done} samples: {diagnostics}, converged={converged}")
+
+        return converged
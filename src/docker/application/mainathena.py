@@ -1,18 +1,33 @@
 from dataclasses import dataclass, asdict
 import os
-import multiprocessing
-import pickle
 import io
 import re
+import json
+import shutil
+import tempfile
 from io import BytesIO
 
-os.environ["XLA_FLAGS"] = "--xla_force_host_platform_device_count={}".format(
-    multiprocessing.cpu_count()
-)
 os.environ["XLA_PYTHON_CLIENT_PREALLOCATE"] = "false"
-os.environ["XLA_PYTHON_CLIENT_MEM_FRACTION"] = ".50"
+# The chain planner budgets the same share of memory, see chainplan
+os.environ["XLA_PYTHON_CLIENT_MEM_FRACTION"] = os.environ.get("CHAIN_MEMORY_FRACTION", ".50")
 os.environ["XLA_PYTHON_CLIENT_ALLOCATOR"] = "platform"
 
+from compilecache import (
+    CompilationCacheSync,
+    cache_prefix,
+    compile_stats,
+    configure_compilation_cache,
+)
+
+# Persistent compilation cache, synced with S3 per platform and model. CPU
+# caching needs the XLA runtime, which cannot compile the sampler's sort in
+# JAX 0.4.23, so it is opt-in; GPU executables are cached natively.
+JAX_CACHE_DIR = os.environ.get("JAX_CACHE_DIR", "/tmp/jax_cache")
+if JAX_CACHE_DIR:
+    configure_compilation_cache(
+        JAX_CACHE_DIR, cpu=os.environ.get("JAX_CACHE_CPU_RUNTIME", "false") == "true"
+    )
+
 import jax.numpy as jnp
 import numpyro
 
@@ -22,95 +37,95 @@ from lightweight_mmm import lightweight_mmm
 from lightweight_mmm import plot
 
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import boto3
 import awswrangler as wr
 
 from numpyro.diagnostics import summary
 from operator import attrgetter
+from functools import partial
 from ec2_metadata import ec2_metadata
 from jax.lib import xla_bridge
 import jax
 from util import LightweightMMMSerializer
+from s3stream import S3MultipartWriter
+from tensorbuilder import build_dense_tensor, reshape_sorted_tensor, scatter_indexed_tensor
+from tensorcache import TensorCache, table_fingerprint
+from pushdown import STRING_TYPES, build_pushdown_query, key_orders
 from jobrecord import JobRecord, JobStatus
-
-c_type = xla_bridge.get_backend().platform
-
-n_cores = len(os.sched_getaffinity(0))
-
-if c_type == "gpu":
-    n_cores = jax.local_device_count()
-
-print(f"Setting host device count to {n_cores}")
-
-numpyro.set_host_device_count(n_cores)
+from scalerstore import ScalerStore
+from budgetsurface import build_budget_surface, default_budget_grid
+from chainplan import (
+    detect_cpu_count,
+    detect_gpu_count,
+    detect_gpu_memory_bytes,
+    detect_memory_bytes,
+    estimate_chain_bytes,
+    plan_chains,
+)
+from sampler import extend_mmm, fit_mmm, fit_mmm_svi
+from convergence import ConvergenceMonitor
+from posterior import ensure_deterministic_sites
+from checkpoint import LocalCheckpointStore, S3CheckpointStore
+from warmstart import WarmStart
 
 s3_client = boto3.client("s3")
+glue_client = boto3.client("glue")
+
+MODEL_NAME = "carryover"
+# Optimization steps of req_fit_method "svi" when the job does not set them
+SVI_STEPS = 10000
+# Warmup steps a job runs at least when its warm start cannot be used, the
+# default of LightweightMMM.fit
+COLD_START_WARMUP = int(os.environ.get("COLD_START_WARMUP", "1000"))
+# Optimization steps of the MAP search for req_init_method "map"
+MAP_INIT_STEPS = int(os.environ.get("MAP_INIT_STEPS", "2000"))
+# Local directory posterior draws are streamed to, empty keeps them in memory
+SAMPLE_DIR = os.environ.get("SAMPLE_DIR", "")
+# Multipart upload of the model npz, parts in flight use up to
+# (UPLOAD_MAX_CONCURRENCY + 1) * UPLOAD_PART_SIZE bytes of memory
+UPLOAD_PART_SIZE = int(os.environ.get("UPLOAD_PART_SIZE", 8 * 1024**2))
+UPLOAD_MAX_CONCURRENCY = int(os.environ.get("UPLOAD_MAX_CONCURRENCY", "10"))
+
+def create_multi_dim_array(df, value_column, duplicates="last"):
+    index_columns = df.attrs.get("index_columns")
+
+    if index_columns:
+        values = reshape_sorted_tensor(df, value_column, index_columns)
+        if values is not None:
+            return values
+        print(
+            f"Column {value_column}: pushed down result is not a complete grid, scattering instead"
+        )
+        # The ranks are the axis positions, whichever cells are missing
+        tensor = scatter_indexed_tensor(
+            df, value_column, index_columns, duplicates=duplicates
+        )
+    else:
+        tensor = build_dense_tensor(df, value_column, duplicates=duplicates)
 
-def create_multi_dim_array(df, value_column):
-    index_mapping = {}
-    for column in df.columns:
-        if column != value_column:
-            unique_values = df[column].unique()
-            index_mapping[column] = {
-                label: idx for idx, label in enumerate(unique_values)
-            }
-
-    shape = [
-        len(index_mapping[column]) for column in df.columns if column != value_column
-    ]
-
-    multi_dim_array = np.zeros(shape, dtype=np.float32)
-
-    for _, row in df.iterrows():
-        indices = tuple(
-            index_mapping[column][row[column]]
-            for column in df.columns
-            if column != value_column
+    if tensor.missing_cells or tensor.duplicate_cells:
+        print(
+            f"Column {value_column}: {tensor.missing_cells} missing cells, {tensor.duplicate_cells} duplicate cells ({duplicates})"
         )
-        value = row[value_column]
-        multi_dim_array[indices] = value
 
-    return multi_dim_array
+    return tensor.values
 
 
 def transform_media_data(input_data):
-    weeks = input_data["week_number"].unique()
-    channels = input_data["media_channel"].unique()
-    week_to_index = {week: i for i, week in enumerate(weeks)}
-    channel_to_index = {channel: i for i, channel in enumerate(channels)}
-
-    num_weeks = len(weeks)
-    num_channels = len(channels)
-    num_geographies = input_data["geography"].nunique()
-
-    multi_dim_array = np.zeros(
-        (num_weeks, num_channels, num_geographies), dtype=np.float32
-    )
-
-    for _, row in input_data.iterrows():
-        week_idx = week_to_index[row["week_number"]]
-        channel_idx = channel_to_index[row["media_channel"]]
-        geo_idx = row["geography"]
-        impression = row["impressions"]
-        multi_dim_array[week_idx, channel_idx, geo_idx] = impression
-
-    return multi_dim_array
+    # Geos are indexed by their value, weeks and channels by first appearance
+    return build_dense_tensor(
+        input_data,
+        "impressions",
+        key_columns=["week_number", "media_channel", "geography"],
+        sorted_columns=["geography"],
+    ).values
 
 
 def transform_cost_data(input_data):
-    channels = input_data["media_channel"].unique()
-    channel_to_index = {channel: i for i, channel in enumerate(channels)}
-
-    num_channels = len(channels)
-
-    multi_dim_array = np.zeros((num_channels), dtype=np.float32)
-
-    for _, row in input_data.iterrows():
-        channel_idx = channel_to_index[row["media_channel"]]
-        cost = row["avg_cost_per_unit"]
-        multi_dim_array[channel_idx] = cost
-
-    return multi_dim_array
+    return build_dense_tensor(
+        input_data, "avg_cost_per_unit", key_columns=["media_channel"]
+    ).values
 
 def sanitize_table_name(table_name):
     pattern = re.compile(r"^[a-zA-Z0-9_]+$")
@@ -121,68 +136,255 @@ def sanitize_table_name(table_name):
             "Table name contains invalid characters. Only alphanumeric characters and underscores are allowed."
         )
 
-def get_data(
-    glue_db,
-    media_train_table,
-    cost_train_table,
-    target_train_table,
-    extra_features_train_table,
-):
-    media_data_df = wr.athena.read_sql_query(
-        sql=f"SELECT * FROM {sanitize_table_name(media_train_table)}",
+# Key columns of the training tables written by the data generator, in schema order
+TABLE_KEY_COLUMNS = {
+    "impressions": ["week_number", "media_channel", "geography"],
+    "avg_cost_per_unit": ["media_channel"],
+    "kpi": ["week_number", "geography"],
+    "feature_value": ["week_number", "feature", "geography"],
+}
+
+
+def read_athena_table(glue_db, table_name, value_column):
+    # A session per call keeps awswrangler thread safe when tables are fetched concurrently
+    return wr.athena.read_sql_query(
+        sql=f"SELECT * FROM {sanitize_table_name(table_name)}",
         database=glue_db,
         encryption="SSE_S3",
         data_source="HpcBlogDataLakeAthenaCatalog",
         workgroup="HpcBlogDataLakeAthenaWorkGroup",
         ctas_approach=False,
+        boto3_session=boto3.Session(),
     )
 
-    media_data_train = create_multi_dim_array(media_data_df, "impressions")
-    print(
-        f"Media data summary: Data Size#{len(media_data_train)} Media Channels#{len(media_data_train[0])} Geos#{len(media_data_train[0][0])}"
+
+def read_parquet_table(glue_db, table_name, value_column):
+    """
+    Reads a training table straight from its Parquet files, skipping the
+    Athena query queue. Columns come back in Glue schema order, like
+    `SELECT *`, projected to the known layout for the value column when the
+    table has it. String columns are read as categoricals.
+    """
+    session = boto3.Session()
+    table_name = sanitize_table_name(table_name)
+
+    location = wr.catalog.get_table_location(
+        database=glue_db, table=table_name, boto3_session=session
+    )
+    column_types = wr.catalog.get_table_types(
+        database=glue_db, table=table_name, boto3_session=session
     )
 
-    cost_data_df = wr.athena.read_sql_query(
-        sql=f"SELECT * FROM {sanitize_table_name(cost_train_table)}",
-        database=glue_db,
-        encryption="SSE_S3",
-        data_source="HpcBlogDataLakeAthenaCatalog",
-        workgroup="HpcBlogDataLakeAthenaWorkGroup",
-        ctas_approach=False,
+    wanted_columns = set(TABLE_KEY_COLUMNS.get(value_column, [])) | {value_column}
+    if wanted_columns.issubset(column_types):
+        columns = [column for column in column_types if column in wanted_columns]
+    else:
+        columns = list(column_types)
+
+    categorical_columns = [
+        column
+        for column in columns
+        if column != value_column and column_types[column] in ("string", "varchar")
+    ]
+
+    return wr.s3.read_parquet(
+        path=location,
+        dataset=True,
+        columns=columns,
+        # awswrangler's default types_mapper would turn the categories back into strings
+        pyarrow_additional_kwargs={"categories": categorical_columns, "types_mapper": None},
+        boto3_session=session,
+    )[columns]
+
+
+def read_key_orders(glue_db, table_name, columns):
+    """
+    Reads only the given key columns from the table's Parquet files and
+    returns their labels in order of first appearance. The columns are
+    dictionary encoded, so this moves a fraction of the table.
+    """
+    session = boto3.Session()
+    location = wr.catalog.get_table_location(
+        database=glue_db, table=sanitize_table_name(table_name), boto3_session=session
+    )
+    df = wr.s3.read_parquet(
+        path=location,
+        dataset=True,
+        columns=list(columns),
+        pyarrow_additional_kwargs={"categories": list(columns), "types_mapper": None},
+        boto3_session=session,
     )
 
-    cost_data_train = create_multi_dim_array(cost_data_df, "avg_cost_per_unit")
-    print(f"Cost data summary: Media Channels#{len(cost_data_train)}")
+    return key_orders(df, columns)
 
-    target_data_df = wr.athena.read_sql_query(
-        sql=f"SELECT * FROM {sanitize_table_name(target_train_table)}",
-        database=glue_db,
-        encryption="SSE_S3",
-        data_source="HpcBlogDataLakeAthenaCatalog",
-        workgroup="HpcBlogDataLakeAthenaWorkGroup",
-        ctas_approach=False,
+
+def read_athena_pushdown_table(glue_db, table_name, value_column):
+    session = boto3.Session()
+    column_types = wr.catalog.get_table_types(
+        database=glue_db, table=sanitize_table_name(table_name), boto3_session=session
+    )
+    column_types = {
+        sanitize_table_name(column): column_type
+        for column, column_type in column_types.items()
+    }
+
+    # String keys follow their order in the data, as with the other sources,
+    # which is the order the data generator fitted the scalers in
+    string_columns = [
+        column
+        for column, column_type in column_types.items()
+        if column != value_column and column_type in STRING_TYPES
+    ]
+    label_orders = (
+        read_key_orders(glue_db, table_name, string_columns) if string_columns else {}
     )
 
-    target_data_train = create_multi_dim_array(target_data_df, "kpi")
-    print(
-        f"Target KPI data summary: Data Size#{len(target_data_train)} Geos#{len(target_data_train[0])}"
+    sql, index_columns = build_pushdown_query(
+        sanitize_table_name(table_name),
+        sanitize_table_name(value_column),
+        column_types,
+        label_orders,
     )
 
-    extra_feature_df = wr.athena.read_sql_query(
-        sql=f"SELECT * FROM {sanitize_table_name(extra_features_train_table)}",
+    df = wr.athena.read_sql_query(
+        sql=sql,
         database=glue_db,
         encryption="SSE_S3",
         data_source="HpcBlogDataLakeAthenaCatalog",
         workgroup="HpcBlogDataLakeAthenaWorkGroup",
         ctas_approach=False,
+        boto3_session=session,
     )
+    # Tells create_multi_dim_array the rows are already in tensor order
+    df.attrs["index_columns"] = index_columns
+
+    return df
+
+
+# Selectable per job through JobRecord.req_data_source
+DATA_SOURCES = {
+    "athena": read_athena_table,
+    "parquet": read_parquet_table,
+    "athena_pushdown": read_athena_pushdown_table,
+}
+
+# Axis label order each source produces, part of the tensor cache key
+TENSOR_LAYOUTS = {
+    "athena": "appearance",
+    "parquet": "appearance",
+    # String keys by appearance, numeric keys by value
+    "athena_pushdown": "appearance_numeric_sorted",
+}
+
+
+def get_data(
+    glue_db,
+    media_train_table,
+    cost_train_table,
+    target_train_table,
+    extra_features_train_table,
+    concurrent=True,
+    query_fn=read_athena_table,
+    tensor_cache=None,
+    fingerprint_fn=None,
+    tensor_layout="appearance",
+):
+    """
+    Fetches the four training tables and builds their tensors. In concurrent
+    mode all queries are in flight at once and each tensor is built as soon as
+    its query returns. When a tensor cache is given it is consulted first,
+    keyed by the table fingerprint. Returns the tensors and the per-table
+    latencies.
+    """
+    tables = {
+        "media": (media_train_table, "impressions"),
+        "cost": (cost_train_table, "avg_cost_per_unit"),
+        "kpi": (target_train_table, "kpi"),
+        "extra_features": (extra_features_train_table, "feature_value"),
+    }
+
+    def fetch_table(name):
+        table_name, value_column = tables[name]
+
+        cache_key = None
+        if tensor_cache is not None:
+            lookup_start_time = datetime.now()
+            cache_key = tensor_cache.key(
+                table_name, value_column, fingerprint_fn(table_name), tensor_layout
+            )
+            cached_tensor = tensor_cache.get(cache_key) if cache_key else None
+
+            if cached_tensor is not None:
+                latency = {
+                    "table": table_name,
+                    "cache": "hit",
+                    "lookup_seconds": (datetime.now() - lookup_start_time).total_seconds(),
+                    "bytes_saved": cached_tensor.nbytes,
+                }
+                print(f"Tensor cache hit for {name} table {table_name}: {latency}")
+                return cached_tensor, latency
+
+            print(f"Tensor cache miss for {name} table {table_name}")
+
+        query_start_time = datetime.now()
+        df = query_fn(glue_db, table_name, value_column)
+        build_start_time = datetime.now()
+        tensor = create_multi_dim_array(df, value_column)
+        build_end_time = datetime.now()
+
+        latency = {
+            "table": table_name,
+            "query_seconds": (build_start_time - query_start_time).total_seconds(),
+            "build_seconds": (build_end_time - build_start_time).total_seconds(),
+        }
 
-    extra_features_train = create_multi_dim_array(extra_feature_df, "feature_value")
+        if cache_key:
+            latency["cache"] = "miss"
+            tensor_cache.put(cache_key, tensor)
+        print(f"Fetched {name} table {table_name}: {latency}")
+
+        return tensor, latency
+
+    tensors = {}
+    latencies = {}
+
+    if concurrent:
+        with ThreadPoolExecutor(max_workers=len(tables)) as executor:
+            futures = {executor.submit(fetch_table, name): name for name in tables}
+            for future in as_completed(futures):
+                name = futures[future]
+                tensors[name], latencies[name] = future.result()
+    else:
+        for name in tables:
+            tensors[name], latencies[name] = fetch_table(name)
+
+    bytes_saved = sum(latency.get("bytes_saved", 0) for latency in latencies.values())
+    if tensor_cache is not None:
+        print(f"Tensor cache saved {bytes_saved} bytes of table data")
+
+    media_data_train = tensors["media"]
+    cost_data_train = tensors["cost"]
+    target_data_train = tensors["kpi"]
+    extra_features_train = tensors["extra_features"]
+
+    print(
+        f"Media data summary: Data Size#{len(media_data_train)} Media Channels#{len(media_data_train[0])} Geos#{len(media_data_train[0][0])}"
+    )
+    print(f"Cost data summary: Media Channels#{len(cost_data_train)}")
+    print(
+        f"Target KPI data summary: Data Size#{len(target_data_train)} Geos#{len(target_data_train[0])}"
+    )
     print(
         f"Media data summary: Data Size#{len(extra_features_train)} Extra Features#{len(extra_features_train[0])} Geos#{len(extra_features_train[0][0])}"
     )
 
-    return media_data_train, cost_data_train, target_data_train, extra_features_train
+    return (
+        media_data_train,
+        cost_data_train,
+        target_data_train,
+        extra_features_train,
+        latencies,
+    )
 
 
 def write_data(df, glue_db_name, table_name, bucket_name):
@@ -202,7 +404,19 @@ def save_model_to_s3(bucket_name, job_id, model):
     json_bucket_key = f"saved_models/{job_id}_media_mix_model.json"
     numpy_bucket_key = f"saved_models/{job_id}_media_mix_model.npz"
 
-    json_str, numpy_bytes_obj = LightweightMMMSerializer.serialize(model)
+    # The npz is compressed array by array straight into a multipart upload,
+    # parts are uploaded while the next ones are compressed
+    with S3MultipartWriter(
+        s3_client,
+        bucket_name,
+        numpy_bucket_key,
+        part_size=UPLOAD_PART_SIZE,
+        max_concurrency=UPLOAD_MAX_CONCURRENCY,
+    ) as numpy_file:
+        json_str, _ = LightweightMMMSerializer.serialize(model, numpy_file)
+    numpy_size = numpy_file.size
+
+    print(f"numpy binary data was saved to bucket#{bucket_name} key#{numpy_bucket_key}")
 
     json_file_obj = BytesIO(json_str.encode("utf-8"))
 
@@ -212,11 +426,12 @@ def save_model_to_s3(bucket_name, job_id, model):
 
     print(f"json metadata was saved to bucket#{bucket_name} key#{json_bucket_key}")
 
-    s3_client.upload_fileobj(
-        Fileobj=numpy_bytes_obj, Bucket=bucket_name, Key=numpy_bucket_key
-    )
+    save_warm_start_to_s3(bucket_name, job_id, model)
 
-    print(f"numpy binary data was saved to bucket#{bucket_name} key#{numpy_bucket_key}")
+    bundle_size = save_inference_bundle_to_s3(bucket_name, job_id, model)
+    print(
+        f"Model artifact sizes: full npz {numpy_size} bytes, inference bundle {bundle_size} bytes"
+    )
 
     end_time = datetime.now()
     transfer_time = end_time - start_time
@@ -226,7 +441,139 @@ def save_model_to_s3(bucket_name, job_id, model):
     return numpy_bucket_key
 
 
+def load_model_from_s3(bucket_name, job_id):
+    json_bucket_key = f"saved_models/{job_id}_media_mix_model.json"
+    numpy_bucket_key = f"saved_models/{job_id}_media_mix_model.npz"
+
+    json_bytes = BytesIO(
+        s3_client.get_object(Bucket=bucket_name, Key=json_bucket_key)["Body"].read()
+    )
+    numpy_bytes = BytesIO(
+        s3_client.get_object(Bucket=bucket_name, Key=numpy_bucket_key)["Body"].read()
+    )
+
+    model = LightweightMMMSerializer.deserialize(numpy_bytes, json_bytes)
+    print(
+        f"Loaded model of job {job_id} with {model._number_samples} samples x {model._number_chains} chains"
+    )
+
+    return model
+
+
+def save_warm_start_to_s3(bucket_name, job_id, model):
+    """
+    Stores the sampler adaptation of the fit so later jobs on the same tables
+    can warm start from it, see req_warm_start_job_id.
+    """
+    if getattr(model, "_mcmc", None) is None or model._mcmc.last_state is None:
+        print("No sampler state to save for warm starts")
+        return
+
+    warm_start = WarmStart.from_state(
+        model._mcmc.last_state, model._number_chains, model.media.shape
+    )
+    warm_start_bucket_key = f"saved_models/{job_id}_warm_start.npz"
+    s3_client.upload_fileobj(
+        Fileobj=warm_start.serialize(), Bucket=bucket_name, Key=warm_start_bucket_key
+    )
+
+    print(f"Warm start state was saved to bucket#{bucket_name} key#{warm_start_bucket_key}")
+
+
+def get_warm_start(bucket_name, job_id, media_shape):
+    """
+    Loads the warm start saved by job_id. Returns None, so the job runs at
+    least COLD_START_WARMUP warmup steps, when it is missing or was fitted on
+    differently shaped data.
+    """
+    warm_start_bucket_key = f"saved_models/{job_id}_warm_start.npz"
+    try:
+        response = s3_client.get_object(Bucket=bucket_name, Key=warm_start_bucket_key)
+    except s3_client.exceptions.NoSuchKey:
+        print(f"No warm start state found for job {job_id}")
+        return None
+
+    warm_start = WarmStart.deserialize(BytesIO(response["Body"].read()))
+    if list(warm_start.media_shape) != list(media_shape):
+        print(
+            f"Ignoring warm start from job {job_id}: media shape {warm_start.media_shape} does not match {list(media_shape)}"
+        )
+        return None
+
+    print(f"Warm starting from job {job_id} with step size {warm_start.step_size:.3g}")
+    return warm_start
+
+
+def save_inference_bundle_to_s3(bucket_name, job_id, model):
+    """
+    Uploads the predict-only directory bundle used by the backend API. The
+    manifest goes last so readers never see a partially uploaded bundle.
+    """
+    bundle_prefix = f"saved_models/{job_id}_inference"
+    num_draws = int(os.environ.get("INFERENCE_BUNDLE_DRAWS", "0")) or None
+    dtype = os.environ.get("INFERENCE_BUNDLE_DTYPE") or None
+
+    with tempfile.TemporaryDirectory() as bundle_dir:
+        manifest_path = LightweightMMMSerializer.serialize_inference_bundle(
+            model, bundle_dir, num_draws=num_draws, dtype=dtype
+        )
+        manifest_name = os.path.basename(manifest_path)
+
+        bundle_size = 0
+        file_names = sorted(os.listdir(bundle_dir))
+        file_names.remove(manifest_name)
+        for file_name in file_names + [manifest_name]:
+            file_path = os.path.join(bundle_dir, file_name)
+            bundle_size += os.path.getsize(file_path)
+            s3_client.upload_file(
+                Filename=file_path,
+                Bucket=bucket_name,
+                Key=f"{bundle_prefix}/{file_name}",
+            )
+
+    print(
+        f"Inference bundle (draws={num_draws or 'all'}, dtype={dtype or 'native'}) was saved to bucket#{bucket_name} prefix#{bundle_prefix}"
+    )
+
+    return bundle_size
+
+
+def save_budget_surface_to_s3(bucket_name, job_id, model, target_scaler, media_scaler):
+    """
+    Solves the budget optimization over a grid of budgets so the backend can
+    answer most budget requests by interpolation. BUDGET_SURFACE_POINTS=0
+    disables the stage.
+    """
+    points = int(os.environ.get("BUDGET_SURFACE_POINTS", "21"))
+    n_time_periods = int(os.environ.get("BUDGET_SURFACE_TIME_PERIODS", "12"))
+
+    if points < 2:
+        print("Budget surface disabled")
+        return
+
+    start_time = datetime.now()
+
+    budgets = default_budget_grid(model, n_time_periods, media_scaler, points)
+    surface = build_budget_surface(
+        model, budgets, n_time_periods, target_scaler, media_scaler
+    )
+
+    surface_bucket_key = f"saved_models/{job_id}_budget_surface.npz"
+    s3_client.upload_fileobj(
+        Fileobj=surface.serialize(), Bucket=bucket_name, Key=surface_bucket_key
+    )
+
+    print(
+        f"Budget surface with {points} budgets between {budgets[0]:.0f} and {budgets[-1]:.0f} was saved to bucket#{bucket_name} key#{surface_bucket_key}"
+    )
+    print(
+        f"Budget surface leave-one-out error: allocation {surface.allocation_error:.4%} of budget, KPI {surface.kpi_error:.4%}"
+    )
+    print("Budget Surface Time: %s" % (datetime.now() - start_time))
+
+
 def get_contribution_graph_data(target_scaler, model):
+    ensure_deterministic_sites(model)
     channel_names = None
     contribution_df = plot.create_media_baseline_contribution_df(
         media_mix_model=model, target_scaler=target_scaler, channel_names=channel_names
@@ -247,6 +594,7 @@ def get_contribution_graph_data(target_scaler, model):
 def get_contribution_percentage_with_error_graph_data(
     target_scaler, cost_scaler, model
 ):
+    ensure_deterministic_sites(model)
     interval_mid_range: float = 0.9
     media_contribution, roi_hat = model.get_posterior_metrics(
         target_scaler=target_scaler, cost_scaler=cost_scaler
@@ -280,17 +628,6 @@ def get_contribution_percentage_with_error_graph_data(
     return contribution_percentage_df
 
 
-def get_scaler(bucket_name, table_name):
-    scaler_key = f"saved_scaler/{table_name}_scaler.pkl"
-
-    pickled_scaler = s3_client.get_object(Bucket=bucket_name, Key=scaler_key)[
-        "Body"
-    ].read()
-
-    loaded_scaler = pickle.loads(pickled_scaler)
-
-    return loaded_scaler
-
 def do_tripple_m(
     media_data_train,
     costs,
@@ -298,16 +635,26 @@ def do_tripple_m(
     extra_features_train,
     number_warmup,
     number_samples,
-    number_chains
+    number_chains,
+    chain_method="parallel",
+    segment_size=None,
+    checkpoint_store=None,
+    warm_start=None,
+    convergence_monitor=None,
+    collect_deterministic=True,
+    map_init_steps=0,
+    chain_groups=None,
+    sample_dir=None,
 ):
     start_time = datetime.now()
-    print(f"Starting Tripple M Training")
+    print(f"Starting Tripple M Training with {chain_method} chains")
 
     SEED = 105
 
-    mmm = lightweight_mmm.LightweightMMM(model_name="carryover")
+    mmm = lightweight_mmm.LightweightMMM(model_name=MODEL_NAME)
 
-    mmm.fit(
+    mcmc = fit_mmm(
+        mmm,
         media=media_data_train,
         media_prior=costs,
         target=target_train,
@@ -315,12 +662,29 @@ def do_tripple_m(
         number_warmup=number_warmup,
         number_samples=number_samples,
         number_chains=number_chains,
+        chain_method=chain_method,
         seed=SEED,
+        segment_size=segment_size,
+        checkpoint_store=checkpoint_store,
+        warm_start=warm_start,
+        on_segment=convergence_monitor,
+        collect_deterministic=collect_deterministic,
+        map_init_steps=map_init_steps,
+        chain_groups=chain_groups,
+        sample_dir=sample_dir,
     )
 
-    states = mmm._mcmc._states
-    sample_field = mmm._mcmc._sample_field
-    last_state = mmm._mcmc._last_state
+    # Warmup and sampling iterations over all chains, includes compilation.
+    # A convergence monitor may have stopped sampling before number_samples.
+    sampling_seconds = (datetime.now() - start_time).total_seconds()
+    samples_per_second = (
+        (number_warmup + mmm._number_samples) * number_chains / sampling_seconds
+    )
+    print(f"Sampling throughput: {samples_per_second:.1f} samples/second")
+
+    states = mcmc._states
+    sample_field = mcmc._sample_field
+    last_state = mcmc._last_state
 
     sites = states[sample_field]
     if isinstance(sites, dict):
@@ -337,7 +701,80 @@ def do_tripple_m(
 
     print("MMM Training Time: %s" % execution_time)
 
-    return mmm, execution_time
+    return mmm, execution_time, samples_per_second
+
+
+def do_svi(
+    media_data_train,
+    costs,
+    target_train,
+    extra_features_train,
+    number_steps,
+    number_samples,
+    number_chains,
+    collect_deterministic=True,
+):
+    start_time = datetime.now()
+    guide = os.environ.get("SVI_GUIDE", "normal")
+    learning_rate = float(os.environ.get("SVI_LEARNING_RATE", "0.01"))
+    print(f"Starting Tripple M SVI Training with {guide} guide for {number_steps} steps")
+
+    SEED = 105
+
+    mmm = lightweight_mmm.LightweightMMM(model_name=MODEL_NAME)
+
+    svi_result = fit_mmm_svi(
+        mmm,
+        media=media_data_train,
+        media_prior=costs,
+        target=target_train,
+        extra_features=extra_features_train,
+        number_steps=number_steps,
+        number_samples=number_samples,
+        number_chains=number_chains,
+        guide=guide,
+        learning_rate=learning_rate,
+        seed=SEED,
+        collect_deterministic=collect_deterministic,
+    )
+    final_loss = float(svi_result.losses[-1])
+    print(f"SVI final ELBO loss: {final_loss:.2f}")
+
+    execution_time = datetime.now() - start_time
+    # Posterior draws produced per second, comparable with the NUTS figure
+    samples_per_second = (
+        number_samples * number_chains / execution_time.total_seconds()
+    )
+    print("MMM SVI Training Time: %s" % execution_time)
+
+    return mmm, execution_time, samples_per_second, final_loss
+
+
+def do_extend(model, warm_start, number_samples, chain_method="parallel"):
+    start_time = datetime.now()
+    print(
+        f"Extending posterior of {model._number_samples} samples per chain by {number_samples} with {chain_method} chains"
+    )
+
+    SEED = 105
+
+    extend_mmm(
+        model,
+        warm_start,
+        number_samples,
+        chain_method=chain_method,
+        # Differs from the fit seed so the extension does not replay its draws
+        seed=SEED + model._number_samples,
+    )
+
+    execution_time = datetime.now() - start_time
+    samples_per_second = (
+        number_samples * model._number_chains / execution_time.total_seconds()
+    )
+    print(f"Sampling throughput: {samples_per_second:.1f} samples/second")
+    print("MMM Extension Time: %s" % execution_time)
+
+    return model, execution_time, samples_per_second
 
 
 def get_mandatory_env(name):
@@ -377,34 +814,208 @@ def main():
     number_samples = job_item.req_number_samples
     number_chains = job_item.req_number_chains
 
-    start_time = datetime.now()
-    print(f"Get data from Athena")
-    media_data_train, costs, target_train, extra_features_train = get_data(
-        glue_db,
-        job_item.req_media_table,
-        job_item.req_cost_table,
-        job_item.req_kpi_table,
-        job_item.req_feature_table,
-    )
+    job_type = job_item.req_job_type if job_item.req_job_type not in (None, "None") else "fit"
+    source_model = None
 
-    end_time = datetime.now()
-    data_retrieval_time = end_time - start_time
-    print("Get data from Athena: %s" % data_retrieval_time)
+    if job_type == "extend":
+        # The source model carries its training tensors, so extending skips Athena
+        source_model = load_model_from_s3(bucket_name, job_item.req_source_job_id)
+        media_data_train = source_model.media
+        extra_features_train = source_model._extra_features
+        number_chains = source_model._number_chains
+        data_latencies = {}
+    else:
+        tensor_cache = None
+        tensor_cache_max_bytes = int(
+            os.environ.get("TENSOR_CACHE_MAX_BYTES", str(20 * 1024**3))
+        )
+        if tensor_cache_max_bytes > 0:
+            tensor_cache = TensorCache(
+                cache_dir=os.environ.get("TENSOR_CACHE_DIR", "/tmp/tensor_cache"),
+                max_bytes=tensor_cache_max_bytes,
+                s3_client=s3_client,
+                bucket_name=bucket_name,
+            )
+
+        data_source = job_item.req_data_source or "athena"
+
+        start_time = datetime.now()
+        print(f"Get data from {data_source}")
+        (
+            media_data_train,
+            costs,
+            target_train,
+            extra_features_train,
+            data_latencies,
+        ) = get_data(
+            glue_db,
+            job_item.req_media_table,
+            job_item.req_cost_table,
+            job_item.req_kpi_table,
+            job_item.req_feature_table,
+            query_fn=DATA_SOURCES[data_source],
+            tensor_cache=tensor_cache,
+            fingerprint_fn=partial(table_fingerprint, glue_client, s3_client, glue_db),
+            tensor_layout=TENSOR_LAYOUTS[data_source],
+        )
 
-    model, execution_time = do_tripple_m(
-        media_data_train,
-        costs,
-        target_train,
-        extra_features_train,
-        int(job_item.req_number_warmup),
-        int(job_item.req_number_samples),
-        int(job_item.req_number_chains)
+        end_time = datetime.now()
+        data_retrieval_time = end_time - start_time
+        print("Get data from Athena: %s" % data_retrieval_time)
+
+    fit_method = job_item.req_fit_method if job_item.req_fit_method not in (None, "None") else "nuts"
+    collect_deterministic = job_item.req_trace_sites != "latent"
+
+    # Devices are configured here, before the first JAX computation
+    # initializes the backend, since the plan depends on the job
+    gpu_count = detect_gpu_count()
+    chain_plan = plan_chains(
+        int(number_chains),
+        cpu_count=detect_cpu_count(),
+        gpu_count=gpu_count,
+        memory_bytes=detect_gpu_memory_bytes() if gpu_count > 0 else detect_memory_bytes(),
+        chain_bytes=estimate_chain_bytes(
+            int(number_samples),
+            media_data_train.shape,
+            number_extra_features=0
+            if extra_features_train is None
+            else extra_features_train.shape[1],
+            collect_deterministic=collect_deterministic,
+        ),
+        override=None
+        if job_item.req_chain_method in (None, "auto")
+        else job_item.req_chain_method,
     )
+    print(f"Chain plan: {chain_plan}")
+    numpyro.set_host_device_count(chain_plan.host_device_count)
+
+    jax_cache_sync = None
+    if JAX_CACHE_DIR:
+        start_time = datetime.now()
+        jax_cache_sync = CompilationCacheSync(
+            JAX_CACHE_DIR, s3_client, bucket_name, cache_prefix(MODEL_NAME, chain_plan.platform)
+        )
+        downloaded = jax_cache_sync.download()
+        print(
+            f"JAX compilation cache: downloaded {downloaded} entries, {len(jax_cache_sync.entries())} local, in {datetime.now() - start_time}"
+        )
+
+    checkpoint_store = None
+    sample_dir = None
+
+    if job_type == "extend":
+        warm_start = get_warm_start(
+            bucket_name, job_item.req_source_job_id, media_data_train.shape
+        )
+        if warm_start is None:
+            raise Exception(
+                f"Job {job_item.req_source_job_id} has no sampler state to extend"
+            )
+
+        model, execution_time, samples_per_second = do_extend(
+            source_model, warm_start, int(number_samples), chain_plan.chain_method
+        )
+    elif fit_method == "svi":
+        svi_steps = job_item.req_svi_steps
+        model, execution_time, samples_per_second, svi_loss = do_svi(
+            media_data_train,
+            costs,
+            target_train,
+            extra_features_train,
+            int(svi_steps) if svi_steps not in (None, "None") else SVI_STEPS,
+            int(number_samples),
+            int(number_chains),
+            collect_deterministic=collect_deterministic,
+        )
+        job_item.proc_svi_loss = f"{svi_loss:.2f}"
+        # SVI underestimates the media contributions against NUTS, so the
+        # job is flagged for the UI to show its results as approximate
+        job_item.proc_approximate = "true"
+    else:
+        # Sampling is checkpointed after every segment, so a retried Batch job
+        # with the same JOB_ID resumes where the previous attempt stopped.
+        # CHECKPOINT_SEGMENTS=0 disables segmenting.
+        checkpoint_segments = int(os.environ.get("CHECKPOINT_SEGMENTS", "10"))
+        segment_size = None
+        if checkpoint_segments > 1:
+            segment_size = -(-int(number_samples) // checkpoint_segments)
+            checkpoint_dir = os.environ.get("CHECKPOINT_DIR")
+            if checkpoint_dir:
+                checkpoint_store = LocalCheckpointStore(os.path.join(checkpoint_dir, job_id))
+            else:
+                checkpoint_store = S3CheckpointStore(
+                    s3_client, bucket_name, f"checkpoints/{job_id}"
+                )
+
+        # With convergence targets req_number_samples caps the samples and
+        # sampling stops at the first segment that meets the targets
+        convergence_monitor = None
+        target_rhat = job_item.req_target_rhat
+        target_ess = job_item.req_target_ess
+        if target_rhat not in (None, "None") or target_ess not in (None, "None"):
+            convergence_monitor = ConvergenceMonitor(
+                target_rhat=None if target_rhat in (None, "None") else float(target_rhat),
+                target_ess=None if target_ess in (None, "None") else float(target_ess),
+            )
+            if segment_size is None:
+                segment_size = -(-int(number_samples) // 10)
+
+        # With SAMPLE_DIR the draws are streamed to files there as they are
+        # sampled and the trace is memory-mapped from them. Only a segment's
+        # draws are in memory at once, so streaming needs segments too.
+        if SAMPLE_DIR:
+            sample_dir = os.path.join(SAMPLE_DIR, job_id)
+            if segment_size is None:
+                segment_size = -(-int(number_samples) // 10)
+
+        number_warmup = int(job_item.req_number_warmup)
+        warm_start = None
+        if job_item.req_warm_start_job_id not in (None, "", "None"):
+            warm_start = get_warm_start(
+                bucket_name, job_item.req_warm_start_job_id, media_data_train.shape
+            )
+            # A warmup shortened for a warm start under-adapts a cold chain
+            if warm_start is None and number_warmup < COLD_START_WARMUP:
+                print(
+                    f"Warm start unavailable, running the full warmup of {COLD_START_WARMUP} instead of {number_warmup}"
+                )
+                number_warmup = COLD_START_WARMUP
+
+        model, execution_time, samples_per_second = do_tripple_m(
+            media_data_train,
+            costs,
+            target_train,
+            extra_features_train,
+            number_warmup,
+            int(job_item.req_number_samples),
+            int(number_chains),
+            chain_plan.chain_method,
+            segment_size=segment_size,
+            checkpoint_store=checkpoint_store,
+            warm_start=warm_start,
+            convergence_monitor=convergence_monitor,
+            # "latent" leaves mu and media_transformed out of the trace and the
+            # model artifact, they are recomputed for the contribution data
+            collect_deterministic=collect_deterministic,
+            # "map" starts the chains near the MAP point, so a shorter
+            # req_number_warmup suffices on large geo counts
+            map_init_steps=MAP_INIT_STEPS if job_item.req_init_method == "map" else 0,
+            chain_groups=chain_plan.chain_groups,
+            sample_dir=sample_dir,
+        )
+
+        if convergence_monitor is not None:
+            job_item.proc_convergence = json.dumps(convergence_monitor.trajectory)
 
     model_save_path = save_model_to_s3(bucket_name, job_id, model)
 
-    target_scaler = get_scaler(bucket_name, job_item.req_kpi_table)
-    cost_scaler = get_scaler(bucket_name, job_item.req_cost_table)
+    target_scaler, cost_scaler, media_scaler = ScalerStore(
+        s3_client, bucket_name
+    ).get_many(
+        [job_item.req_kpi_table, job_item.req_cost_table, job_item.req_media_table]
+    )
+
+    save_budget_surface_to_s3(bucket_name, job_id, model, target_scaler, media_scaler)
 
     contribution_graph_df = get_contribution_graph_data(target_scaler, model)
     contribution_graph_df.insert(0, "job_id", job_id)
@@ -418,6 +1029,12 @@ def main():
         contribution_percentage_df, glue_db, "contribution_percentage_data", bucket_name
     )
 
+    compile_summary = compile_stats.summary()
+    print(f"JAX compilation: {compile_summary}")
+    if jax_cache_sync is not None:
+        uploaded = jax_cache_sync.upload()
+        print(f"JAX compilation cache: uploaded {uploaded} new entries")
+
     compute_type = xla_bridge.get_backend().platform
 
     compute_cores = os.cpu_count()
@@ -432,11 +1049,21 @@ def main():
     job_item.proc_compute_cores = compute_cores
     job_item.proc_compute_type = (compute_type).upper()
     job_item.execution_time = execution_time
+    job_item.proc_data_latency = json.dumps(data_latencies)
+    job_item.proc_compile_stats = json.dumps(compile_summary)
+    job_item.proc_chain_method = chain_plan.chain_method
+    job_item.proc_samples_per_second = f"{samples_per_second:.2f}"
+    job_item.proc_number_samples = model._number_samples
     job_item.model_uri = model_save_path
     job_item.job_status = JobStatus.COMPLETED.value
 
     ddb_table.put_item(Item=job_item.dict())
 
+    if checkpoint_store is not None:
+        checkpoint_store.clear()
+    if sample_dir is not None:
+        shutil.rmtree(sample_dir, ignore_errors=True)
+
 
 if __name__ == "__main__":
     main()
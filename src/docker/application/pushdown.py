@@ -0,0 +1,66 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+# Athena types whose keys are labels rather than numbers
+STRING_TYPES = ("string", "varchar")
+
+
+def key_orders(df: pd.DataFrame, columns: Sequence[str]) -> Dict[str, List[str]]:
+    """
+    The labels of each column in order of first appearance, the axis order
+    build_dense_tensor gives the other sources and the data generator fitted
+    the scalers in.
+    """
+    return {column: [str(label) for label in df[column].unique()] for column in columns}
+
+
+def _quote(label) -> str:
+    return "'" + str(label).replace("'", "''") + "'"
+
+
+def build_pushdown_query(
+    table_name,
+    value_column,
+    column_types: Dict[str, str],
+    label_orders: Optional[Dict[str, Sequence[str]]] = None,
+) -> Tuple[str, List[str]]:
+    """
+    Builds a query that returns only the key indices and the value column,
+    with every key replaced by its zero-based axis position and the rows
+    sorted by those positions, so the result can be reshaped straight into a
+    tensor. Identifiers must already be validated.
+
+    Keys in label_orders are placed at the position of their label in it,
+    and labels missing from it get -1. Other string keys rank numerically on
+    their digits first ("Week 2" before "Week 10") and then lexically, and
+    numeric keys rank by value.
+    """
+    label_orders = label_orders or {}
+    key_columns = [column for column in column_types if column != value_column]
+
+    index_selects = []
+    index_columns = []
+    for column in key_columns:
+        if column in label_orders:
+            cases = " ".join(
+                f"WHEN {_quote(label)} THEN {position}"
+                for position, label in enumerate(label_orders[column])
+            )
+            index_select = f"CASE {column} {cases} ELSE -1 END"
+        else:
+            if column_types[column] in STRING_TYPES:
+                order_by = f"try_cast(regexp_extract({column}, '[0-9]+') AS bigint), {column}"
+            else:
+                order_by = column
+            index_select = f"dense_rank() OVER (ORDER BY {order_by}) - 1"
+        index_selects.append(f"{index_select} AS {column}_idx")
+        index_columns.append(f"{column}_idx")
+
+    sql = (
+        f"SELECT {', '.join(index_selects)}, CAST({value_column} AS real) AS {value_column} "
+        f"FROM {table_name} "
+        f"ORDER BY {', '.join(index_columns)}"
+    )
+
+    return sql, index_columns
@@ -0,0 +1,94 @@
+import os
+import shutil
+from typing import Dict
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+
+class SampleFiles:
+    """
+    Posterior draws written to one .npy file per site as sampling proceeds,
+    laid out like the flattened trace, chain after chain. Only the segment
+    being written is held in memory and the trace is memory-mapped from the
+    files afterwards, so the serializer can copy them as they are.
+    """
+
+    def __init__(self, directory, number_chains, number_samples):
+        self.directory = directory
+        self.number_chains = number_chains
+        self.number_samples = number_samples
+        self.sites = []
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, site):
+        return os.path.join(self.directory, f"{site}.npy")
+
+    def write(self, segment_samples, first_chain=0, first_sample=0):
+        """
+        Writes a segment's draws, grouped by chain, for the chains from
+        first_chain on and the samples from first_sample on.
+        """
+        for site, value in segment_samples.items():
+            value = np.asarray(value)
+            if site not in self.sites:
+                open_memmap(
+                    self._path(site),
+                    mode="w+",
+                    dtype=value.dtype,
+                    shape=(self.number_chains * self.number_samples,) + value.shape[2:],
+                )
+                self.sites.append(site)
+
+            # Mapped for this write only, so the written pages do not stay
+            # in the resident set
+            samples = open_memmap(self._path(site), mode="r+")
+            for chain, chain_value in enumerate(value):
+                start = (first_chain + chain) * self.number_samples + first_sample
+                samples[start : start + len(chain_value)] = chain_value
+            samples.flush()
+            del samples
+
+    def grouped(self, first_chain, number_chains, number_samples) -> Dict[str, np.ndarray]:
+        """
+        Read-only views of the first number_samples draws of number_chains
+        chains from first_chain, grouped by chain.
+        """
+        views = {}
+        for site in self.sites:
+            samples = np.load(self._path(site), mmap_mode="r")
+            by_chain = samples.reshape(
+                (self.number_chains, self.number_samples) + samples.shape[1:]
+            )
+            views[site] = by_chain[first_chain : first_chain + number_chains, :number_samples]
+        return views
+
+    def trace(self, number_samples) -> Dict[str, np.ndarray]:
+        """
+        The flattened trace of number_samples draws per chain, memory-mapped
+        from the files. After sampling stopped early the files are compacted
+        first, one chain at a time.
+        """
+        if number_samples < self.number_samples:
+            for site in self.sites:
+                samples = np.load(self._path(site), mmap_mode="r")
+                compacted = open_memmap(
+                    f"{self._path(site)}.part",
+                    mode="w+",
+                    dtype=samples.dtype,
+                    shape=(self.number_chains * number_samples,) + samples.shape[1:],
+                )
+                for chain in range(self.number_chains):
+                    start = chain * self.number_samples
+                    compacted[chain * number_samples : (chain + 1) * number_samples] = samples[
+                        start : start + number_samples
+                    ]
+                compacted.flush()
+                del samples, compacted
+                os.replace(f"{self._path(site)}.part", self._path(site))
+            self.number_samples = number_samples
+
+        return {site: np.load(self._path(site), mmap_mode="r") for site in self.sites}
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
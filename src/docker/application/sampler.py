@@ -0,0 +1,645 @@
+from datetime import datetime
+from functools import partial
+from typing import Any, Dict, Optional
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+import numpyro
+from lightweight_mmm import lightweight_mmm
+from numpyro.infer import autoguide
+from numpyro.infer.util import constrain_fn, unconstrain_fn
+
+from checkpoint import has_checkpoint, load_checkpoint, save_checkpoint
+from posterior import ensure_deterministic_sites, model_kwargs
+from samplefiles import SampleFiles
+from util import DETERMINISTIC_SITES
+
+# Autoguides selectable for fit_mmm_svi
+SVI_GUIDES = {
+    "normal": autoguide.AutoNormal,
+    "multivariate_normal": autoguide.AutoMultivariateNormal,
+    "low_rank": autoguide.AutoLowRankMultivariateNormal,
+}
+
+
+def latent_postprocess_fn(mmm: lightweight_mmm.LightweightMMM, kwargs):
+    """
+    MCMC postprocess_fn that constrains the latent sites without computing
+    the deterministic ones, so they are neither collected nor kept on the
+    device during sampling.
+    """
+    return partial(
+        constrain_fn, mmm._model_function, (), kwargs, return_deterministic=False
+    )
+
+
+def build_mcmc(
+    mmm: lightweight_mmm.LightweightMMM,
+    number_warmup,
+    number_samples,
+    number_chains,
+    chain_method="parallel",
+    target_accept_prob=0.85,
+    init_strategy=numpyro.infer.init_to_median,
+    kernel_options: Optional[Dict[str, Any]] = None,
+    kwargs: Optional[Dict[str, Any]] = None,
+    **mcmc_options,
+) -> numpyro.infer.MCMC:
+    """
+    kwargs, the model arguments, are bound to the model function, so the
+    mcmc is run without them. numpyro cannot hash them to cache the compiled
+    sampler and would otherwise compile it again on every run.
+    """
+    kernel = numpyro.infer.NUTS(
+        model=mmm._model_function
+        if kwargs is None
+        else partial(mmm._model_function, **kwargs),
+        target_accept_prob=target_accept_prob,
+        init_strategy=init_strategy,
+        **(kernel_options or {}),
+    )
+
+    return numpyro.infer.MCMC(
+        sampler=kernel,
+        num_warmup=number_warmup,
+        num_samples=number_samples,
+        num_chains=number_chains,
+        chain_method=chain_method,
+        **mcmc_options,
+    )
+
+
+def set_fitted_state(
+    mmm: lightweight_mmm.LightweightMMM,
+    trace,
+    media,
+    media_prior,
+    target,
+    extra_features,
+    number_warmup,
+    number_samples,
+    number_chains,
+    degrees_seasonality=2,
+    seasonality_frequency=52,
+    weekday_seasonality=False,
+    mcmc: Optional[numpyro.infer.MCMC] = None,
+):
+    """
+    Sets the attributes LightweightMMM.fit sets, so predict, the optimizer,
+    plots and the serializer work on a model fitted outside of fit.
+    """
+    mmm.custom_priors = {}
+    mmm.media_names = [f"channel_{i}" for i in range(media.shape[1])]
+    mmm.n_media_channels = media.shape[1]
+    mmm.n_geos = media.shape[2] if media.ndim == 3 else 1
+    mmm._media_prior = media_prior
+    mmm.trace = trace
+    mmm._number_warmup = number_warmup
+    mmm._number_samples = number_samples
+    mmm._number_chains = number_chains
+    mmm._target = target
+    mmm._train_media_size = media.shape[0]
+    mmm._degrees_seasonality = degrees_seasonality
+    mmm._seasonality_frequency = seasonality_frequency
+    mmm._weekday_seasonality = weekday_seasonality
+    mmm.media = media
+    mmm._extra_features = (
+        jnp.array(extra_features) if extra_features is not None else None
+    )
+    mmm._mcmc = mcmc
+
+
+def run_segmented(
+    mcmc: numpyro.infer.MCMC,
+    rng_key,
+    number_samples,
+    segment_size,
+    checkpoint_store=None,
+    checkpoint_config=None,
+    init_params=None,
+    on_segment=None,
+    sample_files=None,
+    first_chain=0,
+):
+    """
+    Runs warmup and then draws the samples in segments of segment_size,
+    continuing each segment from the previous one's last state. With a
+    checkpoint store the state and draws are persisted after warmup and after
+    every segment, and a matching checkpoint is resumed instead of starting
+    over. on_segment(samples_done, segments) is called with the draws so far
+    after every segment and stops sampling early by returning True. Leaves
+    the mcmc as if it had drawn all samples in one run.
+
+    With sample_files the draws are written to them, as the chains from
+    first_chain on, instead of being kept, and the caller sets the samples
+    of the mcmc.
+    """
+    checkpoint = None
+    if checkpoint_store is not None:
+        checkpoint = load_checkpoint(checkpoint_store, checkpoint_config)
+
+    if checkpoint is not None:
+        state, segments, samples_done, segment_files = checkpoint
+        print(f"Resuming sampling from checkpoint after {samples_done} samples")
+        if sample_files is not None:
+            first_sample = 0
+            for segment_samples in segments:
+                sample_files.write(segment_samples, first_chain, first_sample)
+                first_sample += len(next(iter(segment_samples.values()))[0])
+    else:
+        # Warmup allocates and postprocesses a buffer of num_samples draws,
+        # sized like a segment it compiles the program the segments reuse
+        mcmc.num_samples = min(segment_size, number_samples)
+        mcmc.warmup(rng_key, collect_warmup=False, init_params=init_params)
+        state = mcmc.post_warmup_state
+        segments, samples_done, segment_files = [], 0, []
+        if checkpoint_store is not None:
+            segment_files = save_checkpoint(
+                checkpoint_store, checkpoint_config, state, 0, segment_files
+            )
+
+    def draws_so_far():
+        if sample_files is None:
+            return segments
+        return [sample_files.grouped(first_chain, mcmc.num_chains, samples_done)]
+
+    stop = samples_done > 0 and on_segment is not None and on_segment(samples_done, draws_so_far())
+
+    while samples_done < number_samples and not stop:
+        mcmc.num_samples = min(segment_size, number_samples - samples_done)
+        mcmc.post_warmup_state = state
+        # The state carries the per chain keys, so segments continue the chains
+        # exactly as they would after a restart from the checkpoint
+        mcmc.run(state.rng_key)
+
+        state = mcmc.last_state
+        segment_samples = jax.device_get(mcmc.get_samples(group_by_chain=True))
+        if sample_files is None:
+            segments.append(segment_samples)
+        else:
+            sample_files.write(segment_samples, first_chain, samples_done)
+        samples_done += mcmc.num_samples
+
+        if checkpoint_store is not None:
+            segment_files = save_checkpoint(
+                checkpoint_store,
+                checkpoint_config,
+                state,
+                samples_done,
+                segment_files,
+                segment_samples,
+            )
+        print(f"Sampled {samples_done}/{number_samples} samples")
+
+        if on_segment is not None:
+            stop = on_segment(samples_done, draws_so_far())
+
+    mcmc.num_samples = samples_done
+    mcmc.post_warmup_state = state
+    mcmc._last_state = state
+    if sample_files is None:
+        set_mcmc_samples(
+            mcmc,
+            {
+                site: jnp.asarray(np.concatenate([segment[site] for segment in segments], axis=1))
+                for site in segments[0]
+            },
+        )
+
+
+def chain_group_params(init_params, first_chain, group_chains, number_chains):
+    """
+    The init_params of number_chains chains for the group of group_chains
+    chains starting at first_chain.
+    """
+    if init_params is None or number_chains == 1:
+        return init_params
+    if group_chains == 1:
+        return {site: value[first_chain] for site, value in init_params.items()}
+    return {
+        site: value[first_chain : first_chain + group_chains]
+        for site, value in init_params.items()
+    }
+
+
+def set_mcmc_samples(mcmc: numpyro.infer.MCMC, grouped, group_states=None, chain_groups=None):
+    """
+    Sets the draws of the mcmc to grouped, samples grouped by chain, as if
+    it had drawn them in one run. With the last states of several chain
+    groups, the mcmc of the last group also gets the chains of the others
+    and their states stacked along the chain axis, on the host.
+    """
+    if group_states is not None and len(chain_groups) > 1:
+
+        def by_chain(group_chains):
+            return lambda value: np.asarray(value)[np.newaxis] if group_chains == 1 else value
+
+        states = [
+            jax.tree_util.tree_map(by_chain(group_chains), state)
+            for group_chains, state in zip(chain_groups, group_states)
+        ]
+        mcmc.num_chains = sum(chain_groups)
+        mcmc._last_state = jax.tree_util.tree_map(
+            lambda *values: np.concatenate(values), *states
+        )
+
+    mcmc._states = {mcmc._sample_field: grouped}
+    mcmc._states_flat = {
+        mcmc._sample_field: {
+            site: value.reshape((-1,) + value.shape[2:]) for site, value in grouped.items()
+        }
+    }
+
+
+def check_inputs(media, media_prior):
+    """
+    Validates the inputs like LightweightMMM.fit and returns the media prior,
+    with a geo axis added for geo models.
+    """
+    if media.ndim not in (2, 3):
+        raise ValueError(
+            "Media data must have either 2 dims for national model or 3 for geo models."
+        )
+    if media.ndim == 3 and media_prior.ndim == 1:
+        media_prior = jnp.expand_dims(media_prior, axis=-1)
+
+    if media.shape[1] != len(media_prior):
+        raise ValueError(
+            "The number of data channels provided must match the number of cost values."
+        )
+    if media.min() < 0:
+        raise ValueError("Media values must be greater or equal to zero.")
+
+    return media_prior
+
+
+def map_init_params(
+    mmm: lightweight_mmm.LightweightMMM,
+    kwargs,
+    number_chains,
+    number_steps=2000,
+    learning_rate=0.01,
+    jitter=0.1,
+    seed=None,
+):
+    """
+    Finds the MAP point of the model, optimizing a point mass guide with a
+    jitted SVI loop, and returns NUTS init_params placing every chain at it
+    with independent normal jitter of scale jitter in unconstrained space.
+    """
+    rng_key = jax.random.PRNGKey(seed if seed is not None else 0)
+    rng_key_fit, rng_key_jitter = jax.random.split(rng_key)
+
+    start_time = datetime.now()
+    map_guide = autoguide.AutoDelta(
+        mmm._model_function, init_loc_fn=numpyro.infer.init_to_median
+    )
+    svi = numpyro.infer.SVI(
+        mmm._model_function,
+        map_guide,
+        numpyro.optim.Adam(learning_rate),
+        numpyro.infer.Trace_ELBO(),
+    )
+    svi_result = svi.run(
+        rng_key_fit, number_steps, progress_bar=False, stable_update=True, **kwargs
+    )
+    map_point = unconstrain_fn(
+        mmm._model_function, (), kwargs, map_guide.median(svi_result.params)
+    )
+    print(
+        f"MAP init after {number_steps} steps in {datetime.now() - start_time}, loss {float(svi_result.losses[-1]):.2f}"
+    )
+
+    chain_shape = (number_chains,) if number_chains > 1 else ()
+    init_params = {}
+    for site_key, (site, value) in zip(
+        jax.random.split(rng_key_jitter, len(map_point)), sorted(map_point.items())
+    ):
+        init_params[site] = value + jitter * jax.random.normal(
+            site_key, chain_shape + jnp.shape(value)
+        )
+
+    return init_params
+
+
+def fit_mmm(
+    mmm: lightweight_mmm.LightweightMMM,
+    media,
+    media_prior,
+    target,
+    extra_features=None,
+    number_warmup=1000,
+    number_samples=1000,
+    number_chains=2,
+    chain_method="parallel",
+    seed=None,
+    segment_size=None,
+    checkpoint_store=None,
+    warm_start=None,
+    on_segment=None,
+    collect_deterministic=True,
+    map_init_steps=0,
+    chain_groups=None,
+    sample_dir=None,
+    **mcmc_options,
+) -> numpyro.infer.MCMC:
+    """
+    Equivalent of LightweightMMM.fit with the default seasonality, priors and
+    NUTS settings, which also lets the caller pick the numpyro chain method
+    and pass further MCMC options. With a segment_size, sampling runs in
+    segments that are checkpointed to checkpoint_store and may stop before
+    number_samples when on_segment says so, see run_segmented.
+
+    A warm_start from a previous fit on data of the same shape initializes
+    the chains at its last positions with its step size and mass matrix. The
+    mass matrix is kept fixed, so the warmup only retunes the step size and
+    can be much shorter.
+
+    Otherwise map_init_steps > 0 starts the chains near the MAP point, see
+    map_init_params, instead of at the prior median. Chains that resume from
+    a checkpoint skip the search.
+
+    With collect_deterministic=False the trace only holds the latent sites,
+    posterior.ensure_deterministic_sites recomputes the others on demand.
+
+    chain_groups splits the chains into groups that run one after the other,
+    see chainplan.plan_chain_groups, and are merged into one trace. Several
+    groups draw all number_samples, on_segment is only called once with the
+    merged chains and cannot stop them early.
+
+    With a sample_dir every segment's draws are written to SampleFiles there
+    instead of being kept in memory, and the trace is memory-mapped from
+    them. The files must outlive the model.
+    """
+    media_prior = check_inputs(media, media_prior)
+
+    kwargs = model_kwargs(mmm, media, media_prior, target, extra_features)
+    if not collect_deterministic:
+        mcmc_options["postprocess_fn"] = latent_postprocess_fn(mmm, kwargs)
+
+    kernel_options = None
+    init_params = None
+    if warm_start is not None:
+        if list(warm_start.media_shape) != list(media.shape):
+            raise ValueError(
+                f"Warm start was fitted on media of shape {warm_start.media_shape}, not {list(media.shape)}"
+            )
+        kernel_options = {
+            "step_size": warm_start.step_size,
+            "inverse_mass_matrix": warm_start.inverse_mass_matrix,
+            "adapt_mass_matrix": False,
+        }
+        init_params = warm_start.init_params(number_chains)
+
+    chain_groups = chain_groups or [number_chains]
+    if sum(chain_groups) != number_chains:
+        raise ValueError(f"Chain groups {chain_groups} do not add up to {number_chains} chains")
+
+    rng_key = jax.random.PRNGKey(seed if seed is not None else 0)
+    checkpoint_config = {
+        "number_warmup": number_warmup,
+        "number_samples": number_samples,
+        "number_chains": number_chains,
+        "seed": seed,
+        "media_shape": list(media.shape),
+        "warm_start": warm_start is not None,
+        "map_init_steps": map_init_steps,
+        "chain_groups": chain_groups,
+    }
+
+    sample_files = None
+    if sample_dir is not None:
+        sample_files = SampleFiles(sample_dir, number_chains, number_samples)
+        segment_size = segment_size or number_samples
+
+    # Convergence is judged over all chains, which several groups only have
+    # together after the last one. They draw number_samples each, and
+    # on_segment sees the merged chains once at the end.
+    group_on_segment = on_segment
+    if on_segment is not None and len(chain_groups) > 1:
+        print(f"Early stopping is off with chain groups {chain_groups}")
+        group_on_segment = None
+
+    group_samples, group_states = [], []
+    first_chain = 0
+    for group, group_chains in enumerate(chain_groups):
+        if len(chain_groups) > 1:
+            print(f"Sampling chains {first_chain} to {first_chain + group_chains - 1} of {number_chains}")
+
+        mcmc = build_mcmc(
+            mmm,
+            number_warmup,
+            number_samples,
+            group_chains,
+            chain_method=chain_method,
+            kernel_options=kernel_options,
+            kwargs=kwargs,
+            **mcmc_options,
+        )
+        group_checkpoint_store = (
+            checkpoint_store
+            if checkpoint_store is None or len(chain_groups) == 1
+            else checkpoint_store.child(f"group-{group}")
+        )
+        group_checkpoint_config = {**checkpoint_config, "group": group}
+
+        # Chains resuming from a checkpoint are past warmup and need no MAP
+        # point, so the search only runs for the first group that starts over
+        resuming = (
+            segment_size
+            and group_checkpoint_store is not None
+            and has_checkpoint(group_checkpoint_store, group_checkpoint_config)
+        )
+        if map_init_steps and warm_start is None and init_params is None and not resuming:
+            init_params = map_init_params(
+                mmm, kwargs, number_chains, number_steps=map_init_steps, seed=seed
+            )
+
+        group_init_params = chain_group_params(
+            init_params, first_chain, group_chains, number_chains
+        )
+        group_rng_key = rng_key if len(chain_groups) == 1 else jax.random.fold_in(rng_key, group)
+
+        if segment_size:
+            run_segmented(
+                mcmc,
+                group_rng_key,
+                number_samples,
+                segment_size,
+                checkpoint_store=group_checkpoint_store,
+                checkpoint_config=group_checkpoint_config,
+                init_params=group_init_params,
+                on_segment=group_on_segment,
+                sample_files=sample_files,
+                first_chain=first_chain,
+            )
+        else:
+            mcmc.run(group_rng_key, init_params=group_init_params)
+
+        if len(chain_groups) > 1:
+            if sample_files is None:
+                group_samples.append(jax.device_get(mcmc.get_samples(group_by_chain=True)))
+            group_states.append(jax.device_get(mcmc.last_state))
+            number_samples = mcmc.num_samples
+        first_chain += group_chains
+
+    grouped = None
+    if sample_files is not None:
+        grouped = {
+            site: value.reshape((number_chains, -1) + value.shape[1:])
+            for site, value in sample_files.trace(mcmc.num_samples).items()
+        }
+    elif len(chain_groups) > 1:
+        grouped = {
+            site: np.concatenate([samples[site] for samples in group_samples])
+            for site in group_samples[0]
+        }
+    if grouped is not None:
+        set_mcmc_samples(mcmc, grouped, group_states, chain_groups)
+
+    if on_segment is not None and len(chain_groups) > 1:
+        on_segment(mcmc.num_samples, [grouped])
+
+    set_fitted_state(
+        mmm,
+        mcmc.get_samples(),
+        media,
+        media_prior,
+        target,
+        extra_features,
+        number_warmup,
+        mcmc.num_samples,
+        number_chains,
+        mcmc=mcmc,
+    )
+
+    return mcmc
+
+
+def extend_mmm(
+    mmm: lightweight_mmm.LightweightMMM,
+    warm_start,
+    number_samples,
+    chain_method="parallel",
+    seed=None,
+    **mcmc_options,
+) -> numpyro.infer.MCMC:
+    """
+    Draws number_samples more samples per chain for a fitted model and merges
+    them into its trace. Each chain continues from its last position with the
+    step size and mass matrix the fit adapted, without a warmup.
+    """
+    number_chains = mmm._number_chains
+    kwargs = model_kwargs(
+        mmm,
+        mmm.media,
+        mmm._media_prior,
+        mmm._target,
+        mmm._extra_features,
+        degrees_seasonality=mmm._degrees_seasonality,
+        seasonality_frequency=mmm._seasonality_frequency,
+        weekday_seasonality=mmm._weekday_seasonality,
+    )
+    # Draws the same sites the trace already has
+    if not any(site in mmm.trace for site in DETERMINISTIC_SITES):
+        mcmc_options["postprocess_fn"] = latent_postprocess_fn(mmm, kwargs)
+
+    mcmc = build_mcmc(
+        mmm,
+        0,
+        number_samples,
+        number_chains,
+        chain_method=chain_method,
+        kernel_options={
+            "step_size": warm_start.step_size,
+            "inverse_mass_matrix": warm_start.inverse_mass_matrix,
+            "adapt_step_size": False,
+            "adapt_mass_matrix": False,
+        },
+        **mcmc_options,
+    )
+    mcmc.run(
+        jax.random.PRNGKey(seed if seed is not None else 0),
+        init_params=warm_start.init_params(number_chains),
+        **kwargs,
+    )
+
+    # Traces are flattened chain by chain, so the new draws are appended per
+    # chain to keep each chain contiguous
+    new_samples = mcmc.get_samples(group_by_chain=True)
+    trace = {}
+    for site, value in new_samples.items():
+        previous = jnp.reshape(
+            jnp.asarray(mmm.trace[site]), (number_chains, -1) + value.shape[2:]
+        )
+        merged = jnp.concatenate([previous, value.astype(previous.dtype)], axis=1)
+        trace[site] = jnp.reshape(merged, (-1,) + value.shape[2:])
+
+    mmm.trace = trace
+    mmm._number_samples = mmm._number_samples + number_samples
+    mmm._mcmc = mcmc
+
+    return mcmc
+
+
+def fit_mmm_svi(
+    mmm: lightweight_mmm.LightweightMMM,
+    media,
+    media_prior,
+    target,
+    extra_features=None,
+    number_steps=10000,
+    number_samples=1000,
+    number_chains=2,
+    guide="normal",
+    learning_rate=0.01,
+    seed=None,
+    collect_deterministic=True,
+):
+    """
+    Fits the same model with stochastic variational inference instead of
+    NUTS and fills the trace with number_chains x number_samples draws from
+    the fitted guide, so the result looks like an MCMC fit to predict, the
+    serializer and the contribution plots. Returns the SVI run result.
+    """
+    media_prior = check_inputs(media, media_prior)
+    kwargs = model_kwargs(mmm, media, media_prior, target, extra_features)
+
+    rng_key = jax.random.PRNGKey(seed if seed is not None else 0)
+    rng_key_fit, rng_key_draws = jax.random.split(rng_key)
+
+    svi_guide = SVI_GUIDES[guide](
+        mmm._model_function, init_loc_fn=numpyro.infer.init_to_median
+    )
+    svi = numpyro.infer.SVI(
+        mmm._model_function,
+        svi_guide,
+        numpyro.optim.Adam(learning_rate),
+        numpyro.infer.Trace_ELBO(),
+    )
+    svi_result = svi.run(
+        rng_key_fit, number_steps, progress_bar=False, stable_update=True, **kwargs
+    )
+
+    draws = svi_guide.sample_posterior(
+        rng_key_draws,
+        svi_result.params,
+        sample_shape=(number_chains * number_samples,),
+    )
+
+    set_fitted_state(
+        mmm,
+        {site: value for site, value in draws.items() if site not in DETERMINISTIC_SITES},
+        media,
+        media_prior,
+        target,
+        extra_features,
+        0,
+        number_samples,
+        number_chains,
+    )
+    if collect_deterministic:
+        ensure_deterministic_sites(mmm)
+
+    return svi_result
@@ -0,0 +1,177 @@
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# How to resolve rows that map to the same tensor cell
+DUPLICATE_POLICIES = ("last", "sum", "mean", "error")
+
+
+@dataclass
+class DenseTensor:
+    values: np.ndarray
+    labels: List[np.ndarray]
+    missing_cells: int
+    duplicate_cells: int
+
+
+def _scatter(df, value_column, key_columns, codes, shape, duplicates, dtype):
+    """
+    Scatters the value column into an array of shape at the integer codes of
+    the key columns. Returns it with the missing and duplicate cell counts.
+    """
+    if duplicates not in DUPLICATE_POLICIES:
+        raise ValueError(
+            f"Unknown duplicate policy '{duplicates}', expected one of {DUPLICATE_POLICIES}"
+        )
+
+    size = int(np.prod(shape, dtype=np.int64))
+    values = df[value_column].to_numpy(dtype=dtype)
+
+    if codes:
+        flat_index = np.ravel_multi_index(codes, shape)
+    else:
+        flat_index = np.zeros(len(df), dtype=np.intp)
+
+    counts = np.bincount(flat_index, minlength=size)
+    duplicate_cells = int(np.count_nonzero(counts > 1))
+    missing_cells = int(size - np.count_nonzero(counts))
+
+    dense = np.zeros(size, dtype=dtype)
+
+    if duplicate_cells == 0:
+        dense[flat_index] = values
+    elif duplicates == "error":
+        raise ValueError(
+            f"Column '{value_column}' has {duplicate_cells} cells with duplicate keys {list(key_columns)}"
+        )
+    elif duplicates == "last":
+        # NumPy does not define which write wins for repeated fancy indices, so
+        # pick the last occurrence of every cell explicitly.
+        reversed_index = flat_index[::-1]
+        cells, first_in_reversed = np.unique(reversed_index, return_index=True)
+        dense[cells] = values[::-1][first_in_reversed]
+    else:
+        sums = np.bincount(flat_index, weights=values, minlength=size)
+        if duplicates == "mean":
+            sums = sums / np.maximum(counts, 1)
+        dense[:] = sums
+
+    return dense.reshape(shape), missing_cells, duplicate_cells
+
+
+def _index_codes(df, index_columns):
+    """
+    The zero-based integer index columns as int64 arrays. awswrangler reads
+    them as nullable Int64, which older pandas turns into object arrays.
+    Negative indices mark labels the query could not place and are rejected.
+    """
+    codes = []
+    for column in index_columns:
+        if df[column].isna().any():
+            raise ValueError(f"Index column '{column}' has null values")
+        column_codes = df[column].to_numpy(dtype=np.int64)
+        if len(column_codes) and column_codes.min() < 0:
+            raise ValueError(f"Index column '{column}' has labels without a position")
+        codes.append(column_codes)
+    return codes
+
+
+def build_dense_tensor(
+    df: pd.DataFrame,
+    value_column: str,
+    key_columns: Optional[Sequence[str]] = None,
+    duplicates: str = "last",
+    dtype=np.float32,
+    sorted_columns: Sequence[str] = (),
+) -> DenseTensor:
+    """
+    Scatters a long-format dataframe into a dense tensor with one axis per key
+    column. Axis labels keep their order of first appearance, the same order
+    `Series.unique()` returns, except for sorted_columns whose labels are
+    sorted. Cells without a row are left at zero and counted in
+    `missing_cells`.
+    """
+    if key_columns is None:
+        key_columns = [column for column in df.columns if column != value_column]
+
+    codes = []
+    labels = []
+    for column in key_columns:
+        column_codes, column_labels = pd.factorize(
+            df[column], sort=column in sorted_columns, use_na_sentinel=False
+        )
+        codes.append(column_codes)
+        labels.append(np.asarray(column_labels))
+
+    shape = tuple(len(column_labels) for column_labels in labels)
+    dense, missing_cells, duplicate_cells = _scatter(
+        df, value_column, key_columns, codes, shape, duplicates, dtype
+    )
+
+    return DenseTensor(
+        values=dense,
+        labels=labels,
+        missing_cells=missing_cells,
+        duplicate_cells=duplicate_cells,
+    )
+
+
+def reshape_sorted_tensor(
+    df: pd.DataFrame,
+    value_column: str,
+    index_columns: Sequence[str],
+    dtype=np.float32,
+) -> Optional[np.ndarray]:
+    """
+    Reshapes the value column of a frame whose rows already arrive sorted by
+    dense, zero-based integer index columns. Returns None when the rows do not
+    form the complete grid, in which case the caller should scatter instead.
+    """
+    codes = _index_codes(df, index_columns)
+    shape = tuple(
+        int(column_codes.max()) + 1 if len(column_codes) else 0
+        for column_codes in codes
+    )
+    size = int(np.prod(shape, dtype=np.int64))
+
+    if len(df) != size:
+        return None
+
+    if size and not np.array_equal(
+        np.ravel_multi_index(codes, shape), np.arange(size)
+    ):
+        return None
+
+    return df[value_column].to_numpy(dtype=dtype).reshape(shape)
+
+
+def scatter_indexed_tensor(
+    df: pd.DataFrame,
+    value_column: str,
+    index_columns: Sequence[str],
+    duplicates: str = "last",
+    dtype=np.float32,
+) -> DenseTensor:
+    """
+    Scatters the value column of a frame with zero-based integer index
+    columns at those indices, for rows that do not form the complete grid
+    reshape_sorted_tensor needs. Each axis is sized by its largest index, so
+    positions follow the indices whichever rows are missing.
+    """
+    codes = _index_codes(df, index_columns)
+    shape = tuple(
+        int(column_codes.max()) + 1 if len(column_codes) else 0
+        for column_codes in codes
+    )
+    dense, missing_cells, duplicate_cells = _scatter(
+        df, value_column, index_columns, codes, shape, duplicates, dtype
+    )
+
+    return DenseTensor(
+        values=dense,
+        labels=[np.arange(length) for length in shape],
+        missing_cells=missing_cells,
+        duplicate_cells=duplicate_cells,
+    )
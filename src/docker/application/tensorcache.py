@@ -0,0 +1,144 @@
+import hashlib
+import os
+import threading
+import uuid
+from typing import Optional
+
+import numpy as np
+from botocore.exceptions import ClientError
+
+# Bump when the tensor layout produced by the builder changes
+CACHE_FORMAT_VERSION = 1
+
+
+def table_fingerprint(glue_client, s3_client, glue_db, table_name):
+    """
+    Fingerprints a Glue table from its version and the ETags of the objects
+    under its S3 location. Returns None for tables without an S3 location
+    (e.g. Athena views), which cannot be cached safely.
+    """
+    table = glue_client.get_table(DatabaseName=glue_db, Name=table_name)["Table"]
+    location = table.get("StorageDescriptor", {}).get("Location", "")
+
+    if not location.startswith("s3://"):
+        return None
+
+    digest = hashlib.sha256()
+    digest.update(f"{table.get('VersionId')}|{location}".encode("utf-8"))
+
+    bucket, _, prefix = location[len("s3://") :].partition("/")
+    prefix = prefix.rstrip("/") + "/" if prefix else ""
+
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for s3_object in page.get("Contents", []):
+            digest.update(f"{s3_object['Key']}|{s3_object['ETag']}".encode("utf-8"))
+
+    return digest.hexdigest()
+
+
+class TensorCache:
+    """
+    Size-bounded LRU cache of built tensors stored as uncompressed .npy files,
+    memory-mapped on hit. An optional S3 prefix acts as a shared second tier
+    so fresh containers can reuse tensors built by earlier jobs. That tier is
+    not evicted here, the data lake bucket expires the default prefix.
+    """
+
+    def __init__(
+        self,
+        cache_dir,
+        max_bytes,
+        s3_client=None,
+        bucket_name=None,
+        prefix="tensor_cache",
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self._lock = threading.Lock()
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(table_name, value_column, fingerprint, layout="appearance") -> Optional[str]:
+        if fingerprint is None:
+            return None
+
+        digest = hashlib.sha256(
+            f"{CACHE_FORMAT_VERSION}|{table_name}|{value_column}|{layout}|{fingerprint}".encode(
+                "utf-8"
+            )
+        ).hexdigest()
+
+        return f"{table_name}-{digest[:32]}"
+
+    def _local_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def _s3_key(self, key):
+        return f"{self.prefix}/{key}.npy"
+
+    def get(self, key) -> Optional[np.ndarray]:
+        path = self._local_path(key)
+
+        if not os.path.exists(path) and self.s3_client is not None:
+            download_path = f"{path}.{uuid.uuid4().hex}.part"
+            try:
+                self.s3_client.download_file(
+                    Bucket=self.bucket_name, Key=self._s3_key(key), Filename=download_path
+                )
+                os.replace(download_path, path)
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                    raise
+                return None
+
+            self.evict()
+
+        try:
+            # Touch the file so eviction sees it as recently used
+            os.utime(path)
+            return np.load(path, mmap_mode="r")
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, array):
+        path = self._local_path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.part"
+
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.ascontiguousarray(array), allow_pickle=False)
+        os.replace(tmp_path, path)
+
+        if self.s3_client is not None:
+            self.s3_client.upload_file(
+                Filename=path, Bucket=self.bucket_name, Key=self._s3_key(key)
+            )
+
+        self.evict()
+
+    def evict(self):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(".npy"):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+            total_bytes = sum(size for _, size, _ in entries)
+
+            for _, size, path in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                # Open memory maps keep their pages, unlinking only drops the name
+                os.remove(path)
+                total_bytes -= size
+                print(f"Tensor cache evicted {os.path.basename(path)} ({size} bytes)")
@@ -0,0 +1,107 @@
+import json
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Dict, List
+
+import jax
+import numpy as np
+
+# Version of the archive written by WarmStart.serialize
+WARM_START_VERSION = 1
+
+
+@dataclass
+class WarmStart:
+    """
+    NUTS adaptation of a finished job: the adapted step size, the diagonal
+    inverse mass matrix per block of sites and each chain's last position in
+    unconstrained space. A new job on data of the same shape starts from it
+    and only needs a short warmup to retune the step size.
+    """
+
+    media_shape: List[int]
+    step_size: float
+    inverse_mass_matrix: Dict[tuple, np.ndarray]
+    positions: Dict[str, np.ndarray]
+
+    @staticmethod
+    def from_state(state, number_chains, media_shape) -> "WarmStart":
+        """
+        Builds the warm start from the last HMCState of an MCMC run. Chains
+        share one step size and mass matrix in NUTS, so per chain adaptations
+        are combined (median step size, mean inverse mass matrix).
+        """
+        state = jax.device_get(state)
+        adapt_state = state.adapt_state
+
+        def by_chain(value):
+            value = np.asarray(value)
+            return value[np.newaxis] if number_chains == 1 else value
+
+        return WarmStart(
+            media_shape=list(media_shape),
+            step_size=float(np.median(by_chain(adapt_state.step_size))),
+            inverse_mass_matrix={
+                tuple(sites): by_chain(matrix).mean(axis=0)
+                for sites, matrix in adapt_state.inverse_mass_matrix.items()
+            },
+            positions={site: by_chain(value) for site, value in state.z.items()},
+        )
+
+    def init_params(self, number_chains):
+        """
+        Initial positions for number_chains chains, reusing the saved chains
+        in turn when the new job runs more chains than the previous one.
+        """
+        chain_index = np.arange(number_chains) % len(next(iter(self.positions.values())))
+
+        if number_chains == 1:
+            return {site: value[0] for site, value in self.positions.items()}
+        return {site: value[chain_index] for site, value in self.positions.items()}
+
+    def serialize(self) -> BytesIO:
+        blocks = list(self.inverse_mass_matrix)
+        metadata = {
+            "version": WARM_START_VERSION,
+            "media_shape": self.media_shape,
+            "step_size": self.step_size,
+            "mass_matrix_blocks": [list(sites) for sites in blocks],
+        }
+
+        bytes_ = BytesIO()
+        np.savez(
+            bytes_,
+            metadata=np.array(json.dumps(metadata)),
+            **{
+                f"inverse_mass_matrix_{i}": self.inverse_mass_matrix[sites]
+                for i, sites in enumerate(blocks)
+            },
+            **{f"position_{site}": value for site, value in self.positions.items()},
+        )
+        bytes_.seek(0)
+
+        return bytes_
+
+    @staticmethod
+    def deserialize(warm_start_bytes) -> "WarmStart":
+        arrays = np.load(warm_start_bytes, allow_pickle=False)
+        metadata = json.loads(str(arrays["metadata"]))
+
+        if metadata.get("version") != WARM_START_VERSION:
+            raise ValueError(
+                f"Unsupported warm start version {metadata.get('version')}, expected {WARM_START_VERSION}"
+            )
+
+        return WarmStart(
+            media_shape=metadata["media_shape"],
+            step_size=metadata["step_size"],
+            inverse_mass_matrix={
+                tuple(sites): arrays[f"inverse_mass_matrix_{i}"]
+                for i, sites in enumerate(metadata["mass_matrix_blocks"])
+            },
+            positions={
+                name[len("position_") :]: arrays[name]
+                for name in arrays.files
+                if name.startswith("position_")
+            },
+        )
@@ -21,6 +21,17 @@ export default function JobDetails({ selectedItem }: JobDetailsProps) {
         <Heading as="h2" size="md" mb={3}>
           {selectedItem.job_name}
         </Heading>
+        {selectedItem.proc_approximate === "true" && (
+          <Box>
+            <Text fontWeight="bold" textTransform="uppercase" color="orange.400">
+              Approximate Fit:
+            </Text>
+            <Text color="orange.400">
+              Fitted with variational inference. Media contributions can be
+              underestimated compared with a NUTS fit.
+            </Text>
+          </Box>
+        )}
         <Box>
           <Text fontWeight="bold" textTransform="uppercase">
             Job Status:
@@ -51,6 +62,18 @@ export default function JobDetails({ selectedItem }: JobDetailsProps) {
           </Text>
           <Text>{selectedItem.req_feature_table}</Text>
         </Box>
+        <Box>
+          <Text fontWeight="bold" textTransform="uppercase">
+            Fit Method:
+          </Text>
+          <Text>{selectedItem.req_fit_method ?? "nuts"}</Text>
+        </Box>
+        <Box>
+          <Text fontWeight="bold" textTransform="uppercase">
+            SVI Final Loss:
+          </Text>
+          <Text>{selectedItem.proc_svi_loss ?? "N/A"}</Text>
+        </Box>
         <Box>
           <Text fontWeight="bold" textTransform="uppercase">
             Warmup Cycles:
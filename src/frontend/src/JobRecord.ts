@@ -11,6 +11,7 @@ export interface JobRecord {
   req_compute_type: string;
   req_compute_cores: string;
   job_status: string;
+  req_fit_method?: string | null;
   batch_job_id?: string | null;
   batch_job_status?: string | null;
   batch_job_status_time?: string | null;
@@ -22,4 +23,6 @@ export interface JobRecord {
   proc_compute_cores?: string | null;
   proc_instance_type?: string | null;
   execution_time?: string | null;
+  proc_svi_loss?: string | null;
+  proc_approximate?: string | null;
 }
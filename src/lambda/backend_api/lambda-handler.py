@@ -1,21 +1,33 @@
 from decimal import Decimal
 import os
-import jax.numpy as jnp
-import pickle
-from lightweight_mmm import optimize_media
+import numpy as np
 from datetime import datetime
 import json
 import boto3
-from aws_lambda_powertools import Logger, Tracer
+from aws_lambda_powertools import Logger, Metrics, Tracer
 from aws_lambda_powertools.event_handler import APIGatewayRestResolver, CORSConfig
+from aws_lambda_powertools.event_handler.exceptions import BadRequestError, NotFoundError
+from aws_lambda_powertools.metrics import MetricUnit
 from aws_lambda_powertools.logging import correlation_paths
 from aws_lambda_powertools.utilities.typing import LambdaContext
 from io import BytesIO
 from typing import Optional
-from util import LightweightMMMSerializer
+from botocore.exceptions import ClientError
+from util import LightweightMMMSerializer, LATENT_SITES, MANIFEST_FILE_NAME
+from modelcache import ModelCache, prune_model_dir
+from scalerstore import ScalerStore
+from s3stream import download_files
+from budgetsurface import BudgetSolution, BudgetSurface, solve_budget
+from compilecache import (
+    CompilationCacheSync,
+    cache_prefix,
+    compile_stats,
+    configure_compilation_cache,
+)
 
 tracer = Tracer()
 logger = Logger()
+metrics = Metrics()
 cors_config = CORSConfig(allow_origin="*", max_age=300)
 app = APIGatewayRestResolver(cors=cors_config, enable_validation=True)
 
@@ -31,6 +43,40 @@ dynamodb = boto3.resource("dynamodb")
 ddb_table = dynamodb.Table(ddb_table_name)
 s3_client = boto3.client("s3")
 
+# Local copies of model artifacts, one directory per job and ETag
+MODEL_DIR = os.environ.get("MODEL_DIR", "/tmp/models")
+MODEL_DIR_MAX_BYTES = int(os.environ.get("MODEL_DIR_MAX_BYTES", 8 * 1024**3))
+# File written last into a model directory, its presence means the download completed
+MODEL_DIR_MARKERS = {"bundle": MANIFEST_FILE_NAME, "npz": "media_mix_model.json"}
+# Model files are downloaded as byte ranges of DOWNLOAD_PART_SIZE bytes,
+# DOWNLOAD_MAX_CONCURRENCY at a time across all files of the model
+DOWNLOAD_PART_SIZE = int(os.environ.get("DOWNLOAD_PART_SIZE", 8 * 1024**2))
+DOWNLOAD_MAX_CONCURRENCY = int(os.environ.get("DOWNLOAD_MAX_CONCURRENCY", 10))
+
+# Persistent compilation cache for the budget objective, synced with S3 per
+# model. Predict compiles under the CPU XLA runtime that caching requires.
+JAX_CACHE_DIR = os.environ.get("JAX_CACHE_DIR", "/tmp/jax_cache")
+if JAX_CACHE_DIR:
+    configure_compilation_cache(
+        JAX_CACHE_DIR, cpu=os.environ.get("JAX_CACHE_CPU_RUNTIME", "true") == "true"
+    )
+jax_cache_syncs = {}
+
+# Forecast horizon used when a request does not set n_time_periods
+DEFAULT_TIME_PERIODS = 12
+MAX_BATCH_BUDGETS = int(os.environ.get("MAX_BATCH_BUDGETS", 50))
+
+# Budget surfaces precomputed by the batch job, keyed by job id with their ETag
+budget_surfaces = {}
+
+# Scalers are cached across invocations and revalidated by ETag
+scaler_store = ScalerStore(s3_client, bucket_name)
+
+# Deserialized models kept by a warm container across invocations
+model_cache = ModelCache(
+    max_bytes=int(os.environ.get("MODEL_CACHE_MAX_BYTES", 4 * 1024**3))
+)
+
 
 # Helper class to encode dynamodb response type Decimal
 class DecimalEncoder(json.JSONEncoder):
@@ -43,11 +89,120 @@ class DecimalEncoder(json.JSONEncoder):
 
 @app.get("/backend/budget")
 @tracer.capture_method
-def get_optimized_budget(job_id: str, budget: int):
+def get_optimized_budget(job_id: str, budget: int, exact: bool = False):
     logger.info(f"Running inference [Budget] for job {job_id}")
+
+    (graph_data,) = get_budget_graphs(job_id, [budget], DEFAULT_TIME_PERIODS, exact)
+
+    return json.dumps(graph_data)
+
+
+@app.get("/backend/budget/batch")
+@tracer.capture_method
+def get_optimized_budgets(
+    job_id: str, budgets: str, n_time_periods: int = DEFAULT_TIME_PERIODS, exact: bool = False
+):
+    """
+    Solves a comma separated list of budgets in one invocation. All budgets
+    share the loaded model and scalers, and with them the compiled objective.
+    """
+    try:
+        budget_values = [int(budget) for budget in budgets.split(",") if budget.strip()]
+    except ValueError:
+        raise BadRequestError("budgets must be a comma separated list of integers")
+
+    if not budget_values or len(budget_values) > MAX_BATCH_BUDGETS:
+        raise BadRequestError(f"Between 1 and {MAX_BATCH_BUDGETS} budgets are allowed")
+    if n_time_periods < 1:
+        raise BadRequestError("n_time_periods must be positive")
+
+    logger.info(f"Running inference [Budget batch] for job {job_id}: {budget_values}")
+
+    results = [
+        {"budget": budget, **graph_data}
+        for budget, graph_data in zip(
+            budget_values,
+            get_budget_graphs(job_id, budget_values, n_time_periods, exact),
+        )
+    ]
+
+    return json.dumps({"n_time_periods": n_time_periods, "results": results})
+
+
+def get_budget_graphs(job_id, budgets, n_time_periods, exact):
+    """
+    Answers budgets inside the precomputed surface by interpolation and only
+    loads the model to solve the rest, or all of them when exact is set.
+    """
+    surface = None if exact else get_budget_surface(job_id)
+    budget_inputs = None
+    touched_before = None
+
+    results = []
+    for budget in budgets:
+        start_time = datetime.now()
+
+        if surface is not None and surface.covers(budget, n_time_periods):
+            method = "interpolated"
+            channel_names = surface.channel_names
+            solution = surface.interpolate(budget)
+        else:
+            method = "solved"
+            if budget_inputs is None:
+                budget_inputs = get_budget_inputs(job_id)
+                # The trace lives on the cached model and remembers the sites
+                # read by earlier requests
+                touched_before = set(budget_inputs[0].trace.touched)
+            model, target_scaler, media_scaler = budget_inputs
+            channel_names = model.media_names
+            solution = solve_budget(
+                model, budget, n_time_periods, target_scaler, media_scaler
+            )
+
+        logger.info(f"Budget {budget} for job {job_id} {method} in {datetime.now() - start_time}")
+        results.append(get_budget_graph_data(channel_names, solution))
+
+    if budget_inputs is not None:
+        touched = budget_inputs[0].trace.touched
+        logger.info(
+            f"Trace sites read for job {job_id}",
+            extra={
+                "read_sites": [site for site in touched if site not in touched_before],
+                "loaded_sites": len(touched),
+            },
+        )
+        upload_compilation_cache(budget_inputs[0].model_name)
+
+    return results
+
+
+def get_budget_surface(job_id) -> Optional[BudgetSurface]:
+    surface_key = f"saved_models/{job_id}_budget_surface.npz"
+    cached = budget_surfaces.get(job_id)
+
+    request = {"Bucket": bucket_name, "Key": surface_key}
+    if cached is not None:
+        request["IfNoneMatch"] = cached[0]
+
+    try:
+        response = s3_client.get_object(**request)
+    except ClientError as e:
+        code = e.response["Error"]["Code"]
+        if code in ("304", "NotModified"):
+            return cached[1]
+        if code in ("404", "NoSuchKey"):
+            return None
+        raise
+
+    surface = BudgetSurface.deserialize(BytesIO(response["Body"].read()))
+    budget_surfaces[job_id] = (response["ETag"], surface)
+
+    return surface
+
+
+def get_budget_inputs(job_id):
     model = get_model(job_id)
     logger.info(f"Model downloading for job {job_id} complete")
-    default_fig_size = (5, 5)
 
     logger.info(f"Getting data for job {job_id}")
 
@@ -55,41 +210,64 @@ def get_optimized_budget(job_id: str, budget: int):
 
     job_details = response["Item"]
 
-    prices = jnp.ones(model.n_media_channels)
-    SEED = 105
-    n_time_periods = 12
-    target_scaler = get_scaler(job_details["req_kpi_table"])
-    extra_features_scaler = get_scaler(job_details["req_feature_table"])
-    media_scaler = get_scaler(job_details["req_media_table"])
-
-    (
-        solution,
-        kpi_without_optim,
-        previous_media_allocation,
-    ) = optimize_media.find_optimal_budgets(
-        n_time_periods=n_time_periods,
-        media_mix_model=model,
-        budget=budget,
-        prices=prices,
-        media_scaler=media_scaler,
-        target_scaler=target_scaler,
-        seed=SEED,
+    # The cached model and scaler objects are static arguments of the jitted
+    # objective, reusing them lets JAX reuse the compiled function.
+    target_scaler, media_scaler = scaler_store.get_many(
+        [job_details["req_kpi_table"], job_details["req_media_table"]]
+    )
+
+    download_compilation_cache(model.model_name)
+
+    return model, target_scaler, media_scaler
+
+
+def download_compilation_cache(model_name):
+    """
+    Fetches the executables other containers compiled for this model once per
+    container, before the first solve.
+    """
+    if not JAX_CACHE_DIR or model_name in jax_cache_syncs:
+        return
+
+    start_time = datetime.now()
+    jax_cache_sync = CompilationCacheSync(
+        JAX_CACHE_DIR, s3_client, bucket_name, cache_prefix(model_name, "cpu")
+    )
+    downloaded = jax_cache_sync.download()
+    jax_cache_syncs[model_name] = jax_cache_sync
+
+    logger.info(
+        f"JAX compilation cache for {model_name}: downloaded {downloaded} entries in {datetime.now() - start_time}",
+        extra={"jax_cache_entries": len(jax_cache_sync.entries())},
     )
 
-    optimal_buget_allocation = prices * solution.x
 
-    previous_budget_allocation = prices * previous_media_allocation
+def upload_compilation_cache(model_name):
+    compile_summary = compile_stats.summary()
+    compile_stats.reset()
+
+    uploaded = 0
+    if model_name in jax_cache_syncs:
+        uploaded = jax_cache_syncs[model_name].upload()
 
-    previous_budget_allocation_pct = previous_budget_allocation / jnp.sum(
+    logger.info(
+        f"JAX compilation for {model_name}: uploaded {uploaded} new cache entries",
+        extra=compile_summary,
+    )
+
+
+def get_budget_graph_data(channel_names, solution: BudgetSolution):
+    optimal_buget_allocation = solution.allocation
+
+    previous_budget_allocation = solution.previous_allocation
+
+    previous_budget_allocation_pct = previous_budget_allocation / np.sum(
     previous_budget_allocation)
-    optimized_budget_allocation_pct = optimal_buget_allocation / jnp.sum(
+    optimized_budget_allocation_pct = optimal_buget_allocation / np.sum(
     optimal_buget_allocation)
 
-    channel_names = model.media_names
-    kpi_with_optim=solution['fun']
-
-    pre_optimizaiton_predicted_target = kpi_without_optim * -1
-    post_optimization_predictiond_target = kpi_with_optim * -1
+    pre_optimizaiton_predicted_target = solution.previous_predicted_kpi
+    post_optimization_predictiond_target = solution.predicted_kpi
     predictions = [
     pre_optimizaiton_predicted_target, post_optimization_predictiond_target
     ]
@@ -136,17 +314,7 @@ def get_optimized_budget(job_id: str, budget: int):
         },
     ]
 
-    graph_data = {"graph1": graph1_data, "graph2": {"data": graph2_data}}
-    return json.dumps(graph_data)
-
-def get_scaler(table_name):
-    scaler_key = f"saved_scaler/{table_name}_scaler.pkl"
-
-    pickled_scaler = s3_client.get_object(Bucket=bucket_name, Key=scaler_key)["Body"].read()
-
-    loaded_scaler = pickle.loads(pickled_scaler)
-
-    return loaded_scaler
+    return {"graph1": graph1_data, "graph2": {"data": graph2_data}}
 
 
 def get_model_size(job_id):
@@ -160,26 +328,162 @@ def get_model_size(job_id):
 
     return model_size_in_gigabytes
 
+def get_model_artifact(job_id):
+    """
+    Returns the kind and ETag of the artifact get_model loads, preferring the
+    inference bundle. A HEAD is enough to revalidate cached copies.
+    """
+    artifact_keys = (
+        ("bundle", f"saved_models/{job_id}_inference/{MANIFEST_FILE_NAME}"),
+        ("npz", f"saved_models/{job_id}_media_mix_model.npz"),
+    )
+    for kind, key in artifact_keys:
+        try:
+            response = s3_client.head_object(Bucket=bucket_name, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                raise
+            continue
+        return kind, response["ETag"].strip('"')
+
+    raise NotFoundError(f"No model found for job {job_id}")
+
+
 def get_model(job_id):
-    json_bucket_key = f"saved_models/{job_id}_media_mix_model.json"
-    numpy_bucket_key = f"saved_models/{job_id}_media_mix_model.npz"
+    start_time = datetime.now()
+    kind, etag = get_model_artifact(job_id)
+
+    loaded_mmm_model = model_cache.get(job_id, etag)
+    if loaded_mmm_model is not None:
+        metrics.add_metric(name="ModelCacheHit", unit=MetricUnit.Count, value=1)
+        logger.info(f"Model cache hit for job {job_id}: {datetime.now() - start_time}")
+        return loaded_mmm_model
+
+    model_dir = os.path.join(MODEL_DIR, f"{job_id}-{etag}")
+    if os.path.exists(os.path.join(model_dir, MODEL_DIR_MARKERS[kind])):
+        metrics.add_metric(name="ModelDiskHit", unit=MetricUnit.Count, value=1)
+        logger.info(f"Model for job {job_id} found in {model_dir}")
+        os.utime(model_dir)
+    else:
+        metrics.add_metric(name="ModelCacheMiss", unit=MetricUnit.Count, value=1)
+        if kind == "bundle":
+            download_inference_bundle(job_id, model_dir)
+        else:
+            download_full_model(job_id, model_dir)
+
+    deserialize_start_time = datetime.now()
+    if kind == "bundle":
+        loaded_mmm_model = LightweightMMMSerializer.deserialize_from_directory(
+            model_dir, lazy=True
+        )
+    else:
+        # Budget optimization only predicts, so the deterministic sites are never read
+        with open(os.path.join(model_dir, MODEL_DIR_MARKERS["npz"]), "rb") as json_bytes:
+            loaded_mmm_model = LightweightMMMSerializer.deserialize(
+                numpy_bytes=os.path.join(model_dir, "media_mix_model.npz"),
+                json_bytes=json_bytes,
+                lazy=True,
+                trace_sites=LATENT_SITES,
+            )
+    logger.info(f"Model deserialize time for job {job_id}: {datetime.now() - deserialize_start_time}")
+
+    evictions = model_cache.evictions
+    model_cache.put(job_id, etag, loaded_mmm_model)
+    if model_cache.evictions > evictions:
+        metrics.add_metric(
+            name="ModelCacheEviction",
+            unit=MetricUnit.Count,
+            value=model_cache.evictions - evictions,
+        )
+
+    # Directories of cached models are still memory-mapped and must stay
+    removed = prune_model_dir(
+        MODEL_DIR,
+        MODEL_DIR_MAX_BYTES,
+        keep={f"{key}-{etag}" for key, etag in model_cache.etags().items()},
+    )
+    if removed:
+        metrics.add_metric(name="ModelDiskEviction", unit=MetricUnit.Count, value=len(removed))
+
+    logger.info(
+        f"Model {kind} load time for job {job_id}: {datetime.now() - start_time}",
+        extra={
+            "model_cache_hits": model_cache.hits,
+            "model_cache_misses": model_cache.misses,
+            "model_cache_evictions": model_cache.evictions,
+            "model_cache_bytes": model_cache.nbytes(),
+            "model_dir_evicted": removed,
+        },
+    )
+
+    return loaded_mmm_model
+
 
-    json_bytes = BytesIO()
-    numpy_bytes = BytesIO()
+def download_full_model(job_id, model_dir):
+    os.makedirs(model_dir, exist_ok=True)
 
-    s3_client.download_fileobj(Bucket=bucket_name, Key=json_bucket_key, Fileobj=json_bytes)
-    s3_client.download_fileobj(Bucket=bucket_name, Key=numpy_bucket_key, Fileobj=numpy_bytes)
+    numpy_path = os.path.join(model_dir, "media_mix_model.npz")
+    json_path = os.path.join(model_dir, MODEL_DIR_MARKERS["npz"])
+    # The JSON downloads alongside the npz under a temporary name and is
+    # renamed last, its name marks the directory as complete
+    model_bytes = download_files(
+        s3_client,
+        bucket_name,
+        {
+            f"saved_models/{job_id}_media_mix_model.npz": numpy_path,
+            f"saved_models/{job_id}_media_mix_model.json": f"{json_path}.part",
+        },
+        part_size=DOWNLOAD_PART_SIZE,
+        max_concurrency=DOWNLOAD_MAX_CONCURRENCY,
+    )
+    os.replace(f"{json_path}.part", json_path)
+
+    logger.info(
+        f"Full model downloaded for job {job_id}",
+        extra={"model_bytes": model_bytes},
+    )
 
-    json_bytes.seek(0)
-    numpy_bytes.seek(0)
 
-    loaded_mmm_model = LightweightMMMSerializer.deserialize(numpy_bytes=numpy_bytes, json_bytes=json_bytes)
+def download_inference_bundle(job_id, model_dir):
+    """
+    Downloads the predict-only bundle written by the batch job so it can be
+    memory-mapped from /tmp.
+    """
+    bundle_prefix = f"saved_models/{job_id}_inference"
 
-    return loaded_mmm_model
+    manifest = json.loads(
+        s3_client.get_object(
+            Bucket=bucket_name, Key=f"{bundle_prefix}/{MANIFEST_FILE_NAME}"
+        )["Body"].read()
+    )
+
+    os.makedirs(model_dir, exist_ok=True)
+
+    bundle_bytes = download_files(
+        s3_client,
+        bucket_name,
+        {
+            f"{bundle_prefix}/{entry['file']}": os.path.join(model_dir, entry["file"])
+            for entry in manifest["arrays"].values()
+            if entry is not None
+        },
+        part_size=DOWNLOAD_PART_SIZE,
+        max_concurrency=DOWNLOAD_MAX_CONCURRENCY,
+    )
+
+    # Written last so a complete manifest on disk means a complete bundle
+    with open(os.path.join(model_dir, MANIFEST_FILE_NAME), "w") as f:
+        json.dump(manifest, f)
+
+    logger.info(
+        f"Inference bundle downloaded for job {job_id}",
+        extra={"model_bytes": bundle_bytes, "num_draws": manifest.get("num_draws")},
+    )
 
 
 @logger.inject_lambda_context(correlation_id_path=correlation_paths.API_GATEWAY_REST)
 @tracer.capture_lambda_handler
+@metrics.log_metrics
 def lambda_handler(event: dict, context: LambdaContext) -> dict:
     logger.debug(f"API request event: {event}")
     return app.resolve(event, context)
@@ -11,6 +11,7 @@ from jax.lib import xla_bridge
 import jax
 import boto3
 import pickle
+from scalerstore import scaler_to_json
 
 CHANNELS = ["Facebook", "TikTok", "Amazon", "Instagram", "Google", "Youtube"]
 FEATURES = ["feature1", "feature2"]
@@ -124,6 +125,12 @@ def save_scaler_object(scaler_object, bucket_name, bucket_key):
     s3_resource = boto3.resource("s3")
     s3_resource.Object(bucket_name, bucket_key).put(Body=scaler_pickle_byte_obj)
 
+    # Pickle-free copy read by ScalerStore, the pickle stays for older readers
+    json_bucket_key = f"{os.path.splitext(bucket_key)[0]}.json"
+    s3_resource.Object(bucket_name, json_bucket_key).put(
+        Body=scaler_to_json(scaler_object).encode("utf-8")
+    )
+
 
 def generate_data(
     bucket_name, data_size, n_media_channels, n_extra_features, n_geos, glue_db_name
@@ -6,6 +6,7 @@ from dataclasses import dataclass, asdict
 from decimal import Decimal
 from datetime import datetime
 from aws_lambda_powertools import Logger, Tracer
+from botocore.exceptions import ClientError
 from aws_lambda_powertools.event_handler import APIGatewayRestResolver, CORSConfig
 from aws_lambda_powertools.logging import correlation_paths
 from aws_lambda_powertools.utilities.typing import LambdaContext
@@ -70,6 +71,63 @@ CPU_JOB_QUEUE_NAME = os.environ.get("CPU_JOB_QUEUE_NAME")
 
 ddb_table = dynamodb.Table(DDB_TABLE_NAME)
 
+# Training input readers supported by the batch job
+DATA_SOURCES = ("athena", "parquet", "athena_pushdown")
+CHAIN_METHODS = ("auto", "parallel", "vectorized", "sequential")
+JOB_TYPES = ("fit", "extend")
+# "latent" fits without collecting the deterministic sites mu and media_transformed
+TRACE_SITE_MODES = ("all", "latent")
+# "svi" fits with variational inference, a fast approximation for exploratory runs
+FIT_METHODS = ("nuts", "svi")
+# "map" starts NUTS chains near the MAP point instead of the prior median
+INIT_METHODS = ("default", "map")
+
+# Fields an extend job takes over from the job whose posterior it extends
+EXTEND_INHERITED_FIELDS = (
+    "req_media_table",
+    "req_kpi_table",
+    "req_cost_table",
+    "req_feature_table",
+    "req_number_chains",
+    "req_data_source",
+)
+
+
+def get_completed_job(job_id, field):
+    job = ddb_table.get_item(Key={"job_id": job_id}).get("Item")
+    if not job or job["job_status"] != JobStatus.COMPLETED.value:
+        raise BadRequestError(f"Field '{field}' must reference a completed job.")
+    return job
+
+
+def has_warm_start(job_id):
+    """
+    Whether the batch job saved the sampler state of job_id that extend and
+    warm start jobs continue from.
+    """
+    try:
+        s3_resource.Object(BUCKET_NAME, f"saved_models/{job_id}_warm_start.npz").load()
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+            raise
+        return False
+    return True
+
+
+def get_sampler_state_job(job_id, field):
+    """
+    The completed job whose sampler state an extend or warm start job
+    continues from. Only NUTS fits leave one.
+    """
+    job = get_completed_job(job_id, field)
+    if job.get("req_fit_method") not in (None, "None", "nuts"):
+        raise BadRequestError(
+            f"Field '{field}' must reference a NUTS fit, not {job['req_fit_method']}."
+        )
+    if not has_warm_start(job_id):
+        raise BadRequestError(f"Field '{field}' must reference a job with a saved sampler state.")
+    return job
+
 
 @app.get("/frontend/tables")
 @tracer.capture_method
@@ -178,6 +236,29 @@ def get_all_jobs():
 def put_job():
     request_body = app.current_event.json_body
 
+    job_type = request_body.get("req_job_type", "fit")
+    if job_type not in JOB_TYPES:
+        raise BadRequestError(
+            f"Field 'req_job_type' must be one of {', '.join(JOB_TYPES)}."
+        )
+
+    source_job_id = None
+    if job_type == "extend":
+        source_job_id = request_body.get("req_source_job_id") or None
+        if source_job_id is None:
+            raise BadRequestError("Field 'req_source_job_id' is required to extend a job.")
+        source_job = get_sampler_state_job(source_job_id, "req_source_job_id")
+        # Extending draws more samples from the source posterior, no warmup
+        request_body = {
+            **request_body,
+            **{
+                field: source_job[field]
+                for field in EXTEND_INHERITED_FIELDS
+                if source_job.get(field) not in (None, "None")
+            },
+            "req_number_warmup": "0",
+        }
+
     required_fields = [
         "req_media_table",
         "req_kpi_table",
@@ -195,6 +276,54 @@ def put_job():
             error_message = f"Field '{field}' is missing or empty in the request body."
             raise BadRequestError(error_message)
 
+    if request_body.get("req_data_source", "athena") not in DATA_SOURCES:
+        raise BadRequestError(
+            f"Field 'req_data_source' must be one of {', '.join(DATA_SOURCES)}."
+        )
+
+    if request_body.get("req_chain_method", "auto") not in CHAIN_METHODS:
+        raise BadRequestError(
+            f"Field 'req_chain_method' must be one of {', '.join(CHAIN_METHODS)}."
+        )
+
+    if request_body.get("req_trace_sites", "all") not in TRACE_SITE_MODES:
+        raise BadRequestError(
+            f"Field 'req_trace_sites' must be one of {', '.join(TRACE_SITE_MODES)}."
+        )
+
+    if request_body.get("req_fit_method", "nuts") not in FIT_METHODS:
+        raise BadRequestError(
+            f"Field 'req_fit_method' must be one of {', '.join(FIT_METHODS)}."
+        )
+
+    if request_body.get("req_init_method", "default") not in INIT_METHODS:
+        raise BadRequestError(
+            f"Field 'req_init_method' must be one of {', '.join(INIT_METHODS)}."
+        )
+
+    svi_steps = request_body.get("req_svi_steps") or None
+    if svi_steps is not None and (not str(svi_steps).isdigit() or int(svi_steps) < 1):
+        raise BadRequestError("Field 'req_svi_steps' must be a positive integer.")
+
+    # Optional convergence targets, req_number_samples then caps the samples
+    convergence_targets = {}
+    for field, minimum in (("req_target_rhat", 1.0), ("req_target_ess", 0.0)):
+        if request_body.get(field) in (None, ""):
+            convergence_targets[field] = None
+            continue
+        try:
+            target = float(request_body[field])
+        except (TypeError, ValueError):
+            raise BadRequestError(f"Field '{field}' must be a number.")
+        if target <= minimum:
+            raise BadRequestError(f"Field '{field}' must be greater than {minimum}.")
+        # DynamoDB does not take floats
+        convergence_targets[field] = str(target)
+
+    warm_start_job_id = request_body.get("req_warm_start_job_id") or None
+    if warm_start_job_id is not None:
+        get_sampler_state_job(warm_start_job_id, "req_warm_start_job_id")
+
     job_id = str(uuid.uuid4())[:8]
 
     job_data = JobRecord(
@@ -210,6 +339,17 @@ def put_job():
         req_compute_type=request_body["req_compute_type"],
         req_compute_cores=request_body["req_compute_cores"],
         req_memory_multp=request_body["req_memory_multp"],
+        req_data_source=request_body.get("req_data_source", "athena"),
+        req_chain_method=request_body.get("req_chain_method", "auto"),
+        req_warm_start_job_id=warm_start_job_id,
+        req_job_type=job_type,
+        req_source_job_id=source_job_id,
+        req_target_rhat=convergence_targets["req_target_rhat"],
+        req_target_ess=convergence_targets["req_target_ess"],
+        req_trace_sites=request_body.get("req_trace_sites", "all"),
+        req_fit_method=request_body.get("req_fit_method", "nuts"),
+        req_svi_steps=str(svi_steps) if svi_steps is not None else None,
+        req_init_method=request_body.get("req_init_method", "default"),
         job_status=JobStatus.PENDING.value, 
     )
 
@@ -0,0 +1,218 @@
+import json
+from dataclasses import dataclass
+from io import BytesIO
+from typing import List
+
+import jax.numpy as jnp
+import numpy as np
+from lightweight_mmm import optimize_media
+
+# Version of the surface archive written by BudgetSurface.serialize
+SURFACE_FORMAT_VERSION = 1
+
+# Seed used for every budget optimization so surfaces match exact solves
+BUDGET_SEED = 105
+
+
+@dataclass
+class BudgetSolution:
+    allocation: np.ndarray
+    previous_allocation: np.ndarray
+    predicted_kpi: float
+    previous_predicted_kpi: float
+
+
+def solve_budget(
+    model, budget, n_time_periods, target_scaler, media_scaler, seed=BUDGET_SEED
+) -> BudgetSolution:
+    """
+    Runs find_optimal_budgets with unit prices, so media units and budget are
+    the same thing, and returns budget allocations and predicted KPIs.
+    """
+    prices = jnp.ones(model.n_media_channels)
+
+    (
+        solution,
+        kpi_without_optim,
+        previous_media_allocation,
+    ) = optimize_media.find_optimal_budgets(
+        n_time_periods=n_time_periods,
+        media_mix_model=model,
+        budget=budget,
+        prices=prices,
+        media_scaler=media_scaler,
+        target_scaler=target_scaler,
+        seed=seed,
+    )
+
+    return BudgetSolution(
+        allocation=np.asarray(prices * solution.x),
+        previous_allocation=np.asarray(prices * previous_media_allocation),
+        predicted_kpi=float(solution["fun"]) * -1,
+        previous_predicted_kpi=float(kpi_without_optim) * -1,
+    )
+
+
+def default_budget_grid(model, n_time_periods, media_scaler, points) -> np.ndarray:
+    """
+    Evenly spaced budgets between the lowest and highest total spend the
+    optimizer accepts with its default bounds (+/-20% of historic spend).
+    """
+    n_channels = model.n_media_channels
+    bounds = optimize_media._get_lower_and_upper_bounds(
+        media=model.media,
+        n_time_periods=n_time_periods,
+        lower_pct=jnp.repeat(a=0.2, repeats=n_channels),
+        upper_pct=jnp.repeat(a=0.2, repeats=n_channels),
+        media_scaler=media_scaler,
+    )
+
+    return np.linspace(np.sum(bounds.lb), np.sum(bounds.ub), points)
+
+
+@dataclass
+class BudgetSurface:
+    """
+    Optimal allocations and predicted KPIs solved over a grid of budgets.
+    Budgets inside the grid are answered by linear interpolation, which keeps
+    interpolated allocations summing to the requested budget.
+    """
+
+    n_time_periods: int
+    channel_names: List[str]
+    budgets: np.ndarray
+    allocations: np.ndarray
+    previous_allocations: np.ndarray
+    predicted_kpis: np.ndarray
+    previous_predicted_kpis: np.ndarray
+    # Largest leave-one-out interpolation error relative to the exact solves
+    allocation_error: float = float("nan")
+    kpi_error: float = float("nan")
+
+    def covers(self, budget, n_time_periods) -> bool:
+        return (
+            n_time_periods == self.n_time_periods
+            and self.budgets[0] <= budget <= self.budgets[-1]
+        )
+
+    def interpolate(self, budget) -> BudgetSolution:
+        def interp(values):
+            return np.interp(budget, self.budgets, values)
+
+        return BudgetSolution(
+            allocation=np.array(
+                [interp(column) for column in self.allocations.T]
+            ),
+            previous_allocation=np.array(
+                [interp(column) for column in self.previous_allocations.T]
+            ),
+            predicted_kpi=float(interp(self.predicted_kpis)),
+            previous_predicted_kpi=float(interp(self.previous_predicted_kpis)),
+        )
+
+    def leave_one_out_errors(self):
+        """
+        Interpolates every interior grid point from its neighbours and compares
+        it with the exact solve. Returns the worst allocation error relative to
+        the budget and the worst KPI error relative to the exact KPI.
+        """
+        allocation_errors = []
+        kpi_errors = []
+
+        for i in range(1, len(self.budgets) - 1):
+            keep = np.arange(len(self.budgets)) != i
+            reduced = BudgetSurface(
+                n_time_periods=self.n_time_periods,
+                channel_names=self.channel_names,
+                budgets=self.budgets[keep],
+                allocations=self.allocations[keep],
+                previous_allocations=self.previous_allocations[keep],
+                predicted_kpis=self.predicted_kpis[keep],
+                previous_predicted_kpis=self.previous_predicted_kpis[keep],
+            )
+            estimate = reduced.interpolate(self.budgets[i])
+
+            allocation_errors.append(
+                np.max(np.abs(estimate.allocation - self.allocations[i]))
+                / self.budgets[i]
+            )
+            kpi_errors.append(
+                abs(estimate.predicted_kpi - self.predicted_kpis[i])
+                / max(abs(self.predicted_kpis[i]), 1e-12)
+            )
+
+        if not allocation_errors:
+            return float("nan"), float("nan")
+
+        return float(np.max(allocation_errors)), float(np.max(kpi_errors))
+
+    def serialize(self) -> BytesIO:
+        metadata = {
+            "version": SURFACE_FORMAT_VERSION,
+            "n_time_periods": self.n_time_periods,
+            "channel_names": list(self.channel_names),
+            "allocation_error": self.allocation_error,
+            "kpi_error": self.kpi_error,
+        }
+
+        bytes_ = BytesIO()
+        np.savez_compressed(
+            bytes_,
+            metadata=np.array(json.dumps(metadata)),
+            budgets=self.budgets,
+            allocations=self.allocations,
+            previous_allocations=self.previous_allocations,
+            predicted_kpis=self.predicted_kpis,
+            previous_predicted_kpis=self.previous_predicted_kpis,
+        )
+        bytes_.seek(0)
+
+        return bytes_
+
+    @staticmethod
+    def deserialize(surface_bytes) -> "BudgetSurface":
+        arrays = np.load(surface_bytes, allow_pickle=False)
+        metadata = json.loads(str(arrays["metadata"]))
+
+        if metadata.get("version") != SURFACE_FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported budget surface version {metadata.get('version')}, expected {SURFACE_FORMAT_VERSION}"
+            )
+
+        return BudgetSurface(
+            n_time_periods=metadata["n_time_periods"],
+            channel_names=metadata["channel_names"],
+            budgets=arrays["budgets"],
+            allocations=arrays["allocations"],
+            previous_allocations=arrays["previous_allocations"],
+            predicted_kpis=arrays["predicted_kpis"],
+            previous_predicted_kpis=arrays["previous_predicted_kpis"],
+            allocation_error=metadata["allocation_error"],
+            kpi_error=metadata["kpi_error"],
+        )
+
+
+def build_budget_surface(
+    model, budgets, n_time_periods, target_scaler, media_scaler
+) -> BudgetSurface:
+    solutions = [
+        solve_budget(model, budget, n_time_periods, target_scaler, media_scaler)
+        for budget in budgets
+    ]
+
+    surface = BudgetSurface(
+        n_time_periods=n_time_periods,
+        channel_names=list(model.media_names),
+        budgets=np.asarray(budgets, dtype=np.float64),
+        allocations=np.stack([solution.allocation for solution in solutions]),
+        previous_allocations=np.stack(
+            [solution.previous_allocation for solution in solutions]
+        ),
+        predicted_kpis=np.array([solution.predicted_kpi for solution in solutions]),
+        previous_predicted_kpis=np.array(
+            [solution.previous_predicted_kpi for solution in solutions]
+        ),
+    )
+    surface.allocation_error, surface.kpi_error = surface.leave_one_out_errors()
+
+    return surface
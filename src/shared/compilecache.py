@@ -0,0 +1,157 @@
+import os
+import threading
+from collections import defaultdict
+
+import jax
+from botocore.exceptions import ClientError
+from jax import monitoring
+
+# JAX 0.4.23 only reads and writes the persistent cache for CPU executables
+# built with the XLA runtime. Later jaxlib releases drop the flag and abort
+# on unknown XLA flags, so it is only added for the versions listed here.
+XLA_CPU_RUNTIME_FLAG = "--xla_cpu_use_xla_runtime=true"
+XLA_CPU_RUNTIME_JAX_VERSIONS = ("0.4.23",)
+
+CACHE_HIT_EVENT = "/jax/compilation_cache/cache_hits"
+CACHE_MISS_EVENT = "/jax/compilation_cache/cache_misses"
+COMPILE_TIME_SAVED_EVENT = "/jax/compilation_cache/compile_time_saved_sec"
+BACKEND_COMPILE_EVENT = "/jax/core/compile/backend_compile_duration"
+
+
+class CompileStats:
+    """
+    Counts persistent cache hits and misses and sums compile durations from
+    JAX's monitoring events. Backend compile time includes cache retrievals.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.events = defaultdict(int)
+            self.durations = defaultdict(float)
+
+    def on_event(self, event):
+        with self._lock:
+            self.events[event] += 1
+
+    def on_duration(self, event, duration):
+        with self._lock:
+            self.durations[event] += duration
+
+    def summary(self):
+        with self._lock:
+            return {
+                "cache_hits": self.events[CACHE_HIT_EVENT],
+                "cache_misses": self.events[CACHE_MISS_EVENT],
+                "compile_seconds": round(self.durations[BACKEND_COMPILE_EVENT], 3),
+                "compile_seconds_saved": round(
+                    self.durations[COMPILE_TIME_SAVED_EVENT], 3
+                ),
+            }
+
+
+compile_stats = CompileStats()
+monitoring.register_event_listener(compile_stats.on_event)
+monitoring.register_event_duration_secs_listener(compile_stats.on_duration)
+
+
+def configure_compilation_cache(cache_dir, min_compile_time_secs=0.0, cpu=True):
+    """
+    Enables JAX's persistent compilation cache in cache_dir. Must run before
+    the JAX backend is initialized, since cpu=True adds the XLA runtime flag
+    that CPU caching needs to XLA_FLAGS. The flag is skipped on JAX versions
+    outside XLA_CPU_RUNTIME_JAX_VERSIONS.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+
+    cpu = cpu and jax.__version__ in XLA_CPU_RUNTIME_JAX_VERSIONS
+    xla_flags = os.environ.get("XLA_FLAGS", "")
+    if cpu and XLA_CPU_RUNTIME_FLAG not in xla_flags:
+        os.environ["XLA_FLAGS"] = f"{xla_flags} {XLA_CPU_RUNTIME_FLAG}".strip()
+
+    jax.config.update("jax_compilation_cache_dir", cache_dir)
+    jax.config.update(
+        "jax_persistent_cache_min_compile_time_secs", min_compile_time_secs
+    )
+
+
+def cache_prefix(model_name, platform, prefix="jax_cache") -> str:
+    """
+    S3 prefix for cache entries. Entry names already hash the program, shapes
+    and compile options; the prefix keeps JAX versions, platforms and models
+    apart so a sync only downloads entries that can be hit.
+    """
+    return f"{prefix}/{jax.__version__}/{platform}/{model_name}"
+
+
+class CompilationCacheSync:
+    """
+    Mirrors a local compilation cache directory to an S3 prefix so fresh
+    containers start with the executables compiled by earlier runs.
+    """
+
+    def __init__(self, cache_dir, s3_client, bucket_name, prefix):
+        self.cache_dir = cache_dir
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self._remote = None
+
+    def entries(self):
+        return {
+            name
+            for name in os.listdir(self.cache_dir)
+            if os.path.isfile(os.path.join(self.cache_dir, name))
+        }
+
+    def remote_entries(self):
+        if self._remote is None:
+            self._remote = set()
+            paginator = self.s3_client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(
+                Bucket=self.bucket_name, Prefix=f"{self.prefix}/"
+            ):
+                for s3_object in page.get("Contents", []):
+                    self._remote.add(s3_object["Key"][len(self.prefix) + 1 :])
+        return self._remote
+
+    def download(self) -> int:
+        local = self.entries()
+        downloaded = 0
+
+        for name in self.remote_entries() - local:
+            path = os.path.join(self.cache_dir, name)
+            part_path = f"{path}.part"
+            try:
+                self.s3_client.download_file(
+                    Bucket=self.bucket_name,
+                    Key=f"{self.prefix}/{name}",
+                    Filename=part_path,
+                )
+            except ClientError as e:
+                if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                    raise
+                continue
+            os.replace(part_path, path)
+            downloaded += 1
+
+        return downloaded
+
+    def upload(self) -> int:
+        uploaded = 0
+
+        for name in self.entries() - self.remote_entries():
+            if name.endswith(".part"):
+                continue
+            self.s3_client.upload_file(
+                Filename=os.path.join(self.cache_dir, name),
+                Bucket=self.bucket_name,
+                Key=f"{self.prefix}/{name}",
+            )
+            self._remote.add(name)
+            uploaded += 1
+
+        return uploaded
@@ -24,6 +24,17 @@ class JobRecord:
     req_compute_cores: str
     job_status: str
     req_memory_multp: str = None
+    req_data_source: str = None
+    req_chain_method: str = None
+    req_warm_start_job_id: str = None
+    req_job_type: str = None
+    req_source_job_id: str = None
+    req_target_rhat: str = None
+    req_target_ess: str = None
+    req_trace_sites: str = None
+    req_fit_method: str = None
+    req_svi_steps: str = None
+    req_init_method: str = None
     batch_job_id: str = None
     batch_job_status: str = None
     batch_job_status_time: str = None
@@ -35,6 +46,14 @@ class JobRecord:
     proc_compute_cores: str = None
     proc_instance_type: str = None
     execution_time: str = None
+    proc_data_latency: str = None
+    proc_compile_stats: str = None
+    proc_chain_method: str = None
+    proc_samples_per_second: str = None
+    proc_number_samples: str = None
+    proc_convergence: str = None
+    proc_svi_loss: str = None
+    proc_approximate: str = None
 
     def dict(self):
         return {k: str(v) for k, v in asdict(self).items()}
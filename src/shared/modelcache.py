@@ -0,0 +1,107 @@
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from util import LazyTrace
+
+
+def model_nbytes(model) -> int:
+    """
+    Bytes held by a deserialized model. For a LazyTrace only the sites read so
+    far are counted, so the size grows as the model is used.
+    """
+    arrays = [model.media, model._media_prior, model._extra_features, model._target]
+
+    if isinstance(model.trace, LazyTrace):
+        arrays += [model.trace[site] for site in model.trace.touched]
+    else:
+        arrays += list(model.trace.values())
+
+    return sum(int(getattr(array, "nbytes", 0)) for array in arrays if array is not None)
+
+
+class ModelCache:
+    """
+    Byte-budgeted LRU cache of deserialized models. Every entry remembers the
+    ETag of the artifact it was loaded from so callers can revalidate it.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, etag) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != etag:
+                # A new ETag means the artifact was rewritten, drop the stale model
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, etag, model):
+        with self._lock:
+            self._entries[key] = (etag, model)
+            self._entries.move_to_end(key)
+        self.evict()
+
+    def etags(self) -> Dict[str, str]:
+        with self._lock:
+            return {key: etag for key, (etag, _) in self._entries.items()}
+
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(model_nbytes(model) for _, model in self._entries.values())
+
+    def evict(self):
+        with self._lock:
+            # Sizes are re-measured since lazily loaded traces grow after put
+            sizes = {key: model_nbytes(model) for key, (_, model) in self._entries.items()}
+            total_bytes = sum(sizes.values())
+
+            # The most recently used model is kept even if it alone exceeds the budget
+            while total_bytes > self.max_bytes and len(self._entries) > 1:
+                key, _ = self._entries.popitem(last=False)
+                total_bytes -= sizes[key]
+                self.evictions += 1
+
+
+def prune_model_dir(model_dir, max_bytes, keep=()):
+    """
+    Removes least recently used model directories under model_dir until it
+    fits max_bytes. Directories named in keep are still memory-mapped by
+    cached models and are never removed.
+    """
+    entries = []
+    for name in os.listdir(model_dir):
+        path = os.path.join(model_dir, name)
+        if name in keep or not os.path.isdir(path):
+            continue
+        size = sum(
+            os.path.getsize(os.path.join(root, file_name))
+            for root, _, file_names in os.walk(path)
+            for file_name in file_names
+        )
+        entries.append((os.path.getmtime(path), size, path))
+
+    total_bytes = sum(size for _, size, _ in entries)
+    removed = []
+
+    for _, size, path in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total_bytes -= size
+        removed.append(os.path.basename(path))
+
+    return removed
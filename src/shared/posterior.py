@@ -0,0 +1,107 @@
+from typing import Any, Dict
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+from lightweight_mmm import lightweight_mmm
+from numpyro.infer import Predictive
+
+from util import DETERMINISTIC_SITES
+
+# Posterior draws pushed through the model at once when recomputing
+# deterministic sites, bounds the device memory of the recomputation
+DETERMINISTIC_BATCH_SIZE = 256
+
+
+def model_kwargs(
+    mmm: lightweight_mmm.LightweightMMM,
+    media,
+    media_prior,
+    target,
+    extra_features=None,
+    degrees_seasonality=2,
+    seasonality_frequency=52,
+    weekday_seasonality=False,
+) -> Dict[str, Any]:
+    """
+    Arguments of the LightweightMMM model function, as LightweightMMM.fit
+    passes them to MCMC.run.
+    """
+    return {
+        "media_data": jnp.array(media),
+        "extra_features": jnp.array(extra_features) if extra_features is not None else None,
+        "target_data": jnp.array(target) if target is not None else None,
+        "media_prior": jnp.array(media_prior),
+        "degrees_seasonality": degrees_seasonality,
+        "frequency": seasonality_frequency,
+        "transform_function": mmm._model_transform_function,
+        "weekday_seasonality": weekday_seasonality,
+        "custom_priors": {},
+    }
+
+
+def recompute_deterministic_sites(
+    mmm: lightweight_mmm.LightweightMMM,
+    sites=DETERMINISTIC_SITES,
+    batch_size=DETERMINISTIC_BATCH_SIZE,
+) -> Dict[str, np.ndarray]:
+    """
+    Recomputes deterministic sites such as mu and media_transformed on the
+    training data from the latent draws of a fitted model. Draws go through
+    a jitted Predictive in fixed size batches, so every batch reuses one
+    compiled program and only one batch of intermediates is on the device.
+    """
+    kwargs = model_kwargs(
+        mmm,
+        mmm.media,
+        mmm._media_prior,
+        mmm._target,
+        mmm._extra_features,
+        degrees_seasonality=mmm._degrees_seasonality,
+        seasonality_frequency=mmm._seasonality_frequency,
+        weekday_seasonality=mmm._weekday_seasonality,
+    )
+    latent = {
+        site: jnp.asarray(mmm.trace[site])
+        for site in mmm.trace
+        if site not in DETERMINISTIC_SITES
+    }
+    number_draws = len(next(iter(latent.values())))
+    batch_size = min(batch_size, number_draws)
+
+    @jax.jit
+    def predict_batch(batch):
+        return Predictive(
+            mmm._model_function, posterior_samples=batch, return_sites=list(sites)
+        )(jax.random.PRNGKey(0), **kwargs)
+
+    batches = {site: [] for site in sites}
+    for start in range(0, number_draws, batch_size):
+        stop = min(start + batch_size, number_draws)
+        # The last batch is padded to the batch size to reuse the compiled program
+        batch = {
+            site: jnp.take(value, jnp.arange(start, start + batch_size), axis=0, mode="clip")
+            for site, value in latent.items()
+        }
+        values = predict_batch(batch)
+        for site in sites:
+            batches[site].append(np.asarray(values[site][: stop - start]))
+
+    return {site: np.concatenate(batches[site]) for site in sites}
+
+
+def ensure_deterministic_sites(
+    mmm: lightweight_mmm.LightweightMMM, batch_size=DETERMINISTIC_BATCH_SIZE
+):
+    """
+    Adds deterministic sites missing from the trace of a model fitted or
+    loaded without them, for code such as the contribution plots that reads
+    them from the trace.
+    """
+    missing = [site for site in DETERMINISTIC_SITES if site not in mmm.trace]
+    if not missing:
+        return
+
+    recomputed = recompute_deterministic_sites(mmm, missing, batch_size)
+    for site, value in recomputed.items():
+        mmm.trace[site] = value
@@ -0,0 +1,211 @@
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# S3 rejects multipart parts below 5 MiB, except for the last one
+MIN_PART_SIZE = 5 * 1024**2
+# The defaults of boto3's managed transfers, for uploads and downloads
+DEFAULT_PART_SIZE = 8 * 1024**2
+DEFAULT_MAX_CONCURRENCY = 10
+# Bytes of a downloading part held in memory before they are written out
+DOWNLOAD_CHUNK_SIZE = 1024**2
+
+
+class S3MultipartWriter(io.RawIOBase):
+    """
+    A write-only, unseekable file object that uploads what is written to it
+    as an S3 multipart upload. A part is uploaded in the background as soon
+    as part_size bytes are buffered, with at most max_concurrency parts in
+    flight, so writing and uploading overlap and memory stays below
+    (max_concurrency + 1) * part_size whatever the size of the object.
+
+    close() uploads the last part and completes the upload. A failed part or
+    an exception inside a with block aborts the upload instead.
+    """
+
+    def __init__(
+        self,
+        s3_client,
+        bucket_name,
+        key,
+        part_size=DEFAULT_PART_SIZE,
+        max_concurrency=DEFAULT_MAX_CONCURRENCY,
+    ):
+        if part_size < MIN_PART_SIZE:
+            raise ValueError(
+                f"Part size {part_size} is below the S3 minimum of {MIN_PART_SIZE} bytes"
+            )
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.part_size = part_size
+        self.size = 0
+
+        self._buffer = bytearray()
+        self._futures = []
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._upload_id = s3_client.create_multipart_upload(
+            Bucket=bucket_name, Key=key
+        )["UploadId"]
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.size
+
+    def _upload_part(self, part_number, body):
+        try:
+            response = self.s3_client.upload_part(
+                Bucket=self.bucket_name,
+                Key=self.key,
+                UploadId=self._upload_id,
+                PartNumber=part_number,
+                Body=body,
+            )
+            return {"PartNumber": part_number, "ETag": response["ETag"]}
+        finally:
+            self._slots.release()
+
+    def _submit_part(self, body):
+        # Fail the writer early rather than compressing the rest of the object
+        for future in self._futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+
+        # Blocks while max_concurrency parts are in flight
+        self._slots.acquire()
+        self._futures.append(
+            self._executor.submit(self._upload_part, len(self._futures) + 1, body)
+        )
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to closed file")
+
+        self._buffer += data
+        self.size += len(data)
+        while len(self._buffer) >= self.part_size:
+            body = bytes(self._buffer[: self.part_size])
+            del self._buffer[: self.part_size]
+            self._submit_part(body)
+
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+
+        try:
+            # A multipart upload needs at least one part, even an empty one
+            if self._buffer or not self._futures:
+                self._submit_part(bytes(self._buffer))
+                self._buffer = bytearray()
+
+            parts = [future.result() for future in self._futures]
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=self.key,
+                UploadId=self._upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            self.abort()
+            raise
+        finally:
+            self._executor.shutdown(wait=True)
+            super().close()
+
+    def abort(self):
+        """
+        Discards the upload and the parts uploaded so far.
+        """
+        if self.closed:
+            return
+
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._buffer = bytearray()
+        self.s3_client.abort_multipart_upload(
+            Bucket=self.bucket_name, Key=self.key, UploadId=self._upload_id
+        )
+        super().close()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def __del__(self):
+        # IOBase closes on collection, which must not complete a partial object.
+        # A writer whose __init__ failed has no upload to abort.
+        if not self.closed and hasattr(self, "_upload_id"):
+            self.abort()
+
+
+def _download_range(s3_client, bucket_name, key, etag, descriptor, start, end):
+    response = s3_client.get_object(
+        Bucket=bucket_name, Key=key, Range=f"bytes={start}-{end}", IfMatch=etag
+    )
+    for chunk in response["Body"].iter_chunks(DOWNLOAD_CHUNK_SIZE):
+        os.pwrite(descriptor, chunk, start)
+        start += len(chunk)
+
+
+def download_files(
+    s3_client,
+    bucket_name,
+    files,
+    part_size=DEFAULT_PART_SIZE,
+    max_concurrency=DEFAULT_MAX_CONCURRENCY,
+) -> int:
+    """
+    Downloads the objects in files, a mapping of keys to local paths, as
+    byte-range GETs of part_size bytes on one pool of max_concurrency
+    threads, so small objects download side by side and large ones in
+    parallel parts. Every part must match the ETag the object had when the
+    download started. Returns the bytes downloaded.
+    """
+    descriptors = []
+    executor = ThreadPoolExecutor(max_workers=max_concurrency)
+    try:
+        heads = {
+            executor.submit(s3_client.head_object, Bucket=bucket_name, Key=key): (key, path)
+            for key, path in files.items()
+        }
+        parts = []
+        total_size = 0
+        for future in as_completed(heads):
+            key, path = heads[future]
+            head = future.result()
+            size = head["ContentLength"]
+
+            descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            descriptors.append(descriptor)
+            os.ftruncate(descriptor, size)
+            total_size += size
+
+            for start in range(0, size, part_size):
+                parts.append(
+                    executor.submit(
+                        _download_range,
+                        s3_client,
+                        bucket_name,
+                        key,
+                        head["ETag"],
+                        descriptor,
+                        start,
+                        min(start + part_size, size) - 1,
+                    )
+                )
+
+        for future in as_completed(parts):
+            future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        for descriptor in descriptors:
+            os.close(descriptor)
+
+    return total_size
@@ -0,0 +1,110 @@
+import base64
+import json
+import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Sequence
+
+import jax.numpy as jnp
+import numpy as np
+from botocore.exceptions import ClientError
+from lightweight_mmm import preprocessing
+
+# Version of the JSON scaler document written by scaler_to_json
+SCALER_FORMAT_VERSION = 1
+
+
+def _encode_array(value):
+    array = np.ascontiguousarray(np.asarray(value))
+    return {
+        "dtype": array.dtype.str,
+        "shape": list(array.shape),
+        "data": base64.b64encode(array.tobytes()).decode("ascii"),
+    }
+
+
+def _decode_array(document):
+    array = np.frombuffer(
+        base64.b64decode(document["data"]), dtype=np.dtype(document["dtype"])
+    )
+    return jnp.asarray(array.reshape(document["shape"]))
+
+
+def scaler_to_json(scaler: preprocessing.CustomScaler) -> str:
+    """
+    Serializes the fitted state of a CustomScaler. Only divide_by and
+    multiply_by are kept, which is all transform and inverse_transform use.
+    """
+    return json.dumps(
+        {
+            "version": SCALER_FORMAT_VERSION,
+            "divide_by": _encode_array(scaler.divide_by),
+            "multiply_by": _encode_array(scaler.multiply_by),
+        }
+    )
+
+
+def scaler_from_json(document) -> preprocessing.CustomScaler:
+    scaler_data = json.loads(document)
+
+    if scaler_data.get("version") != SCALER_FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported scaler format version {scaler_data.get('version')}, expected {SCALER_FORMAT_VERSION}"
+        )
+
+    return preprocessing.CustomScaler(
+        divide_by=_decode_array(scaler_data["divide_by"]),
+        multiply_by=_decode_array(scaler_data["multiply_by"]),
+    )
+
+
+class ScalerStore:
+    """
+    Loads the scalers saved by the data generator, preferring the JSON format
+    and falling back to the pickle for older data sets. Scalers are cached in
+    process and revalidated against their S3 ETag on every get.
+    """
+
+    def __init__(self, s3_client, bucket_name, max_workers=4):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.max_workers = max_workers
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _fetch(self, key, loads):
+        with self._lock:
+            cached = self._cache.get(key)
+
+        request = {"Bucket": self.bucket_name, "Key": key}
+        if cached is not None:
+            request["IfNoneMatch"] = cached[0]
+
+        try:
+            response = self.s3_client.get_object(**request)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("304", "NotModified"):
+                return cached[1]
+            raise
+
+        scaler = loads(response["Body"].read())
+        with self._lock:
+            self._cache[key] = (response["ETag"], scaler)
+
+        return scaler
+
+    def get(self, table_name) -> preprocessing.CustomScaler:
+        try:
+            return self._fetch(f"saved_scaler/{table_name}_scaler.json", scaler_from_json)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                raise
+
+        return self._fetch(f"saved_scaler/{table_name}_scaler.pkl", pickle.loads)
+
+    def get_many(self, table_names: Sequence[str]) -> List[preprocessing.CustomScaler]:
+        """
+        Fetches the scalers of several tables concurrently, in the given order.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(self.get, table_names))
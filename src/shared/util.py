@@ -1,17 +1,137 @@
 import json
+import os
+import shutil
+import zipfile
+import jax
 import numpy as np
-from typing import Any, Dict
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Iterable, Optional
 from lightweight_mmm import lightweight_mmm
 from io import BytesIO
 
+# Posterior sites stored for the carryover model
+TRACE_SITES = (
+    "ad_effect_retention_rate",
+    "channel_coef_media",
+    "coef_extra_features",
+    "coef_media",
+    "coef_seasonality",
+    "coef_trend",
+    "expo_trend",
+    "exponent",
+    "gamma_seasonality",
+    "intercept",
+    "media_transformed",
+    "mu",
+    "peak_effect_delay",
+    "sigma",
+)
+
+# Deterministic sites, recomputable from the others and not needed by predict
+DETERMINISTIC_SITES = ("media_transformed", "mu")
+LATENT_SITES = tuple(site for site in TRACE_SITES if site not in DETERMINISTIC_SITES)
+
+# Version of the directory artifact layout written by serialize_to_directory
+MANIFEST_VERSION = 1
+MANIFEST_FILE_NAME = "manifest.json"
+
+
+class LazyTrace(MutableMapping):
+    """
+    Posterior trace that reads each site from the artifact the first time it
+    is accessed. `touched` lists the sites that have been read so far.
+    """
+
+    def __init__(self, loader: Callable[[str], Any], sites: Iterable[str]):
+        self._loader = loader
+        self._sites = list(sites)
+        self._loaded = {}
+
+    def __getitem__(self, site):
+        if site not in self._loaded:
+            if site not in self._sites:
+                raise KeyError(site)
+            self._loaded[site] = self._loader(site)
+        return self._loaded[site]
+
+    def __setitem__(self, site, value):
+        if site not in self._sites:
+            self._sites.append(site)
+        self._loaded[site] = value
+
+    def __delitem__(self, site):
+        self._sites.remove(site)
+        self._loaded.pop(site, None)
+
+    def __iter__(self):
+        return iter(self._sites)
+
+    def __len__(self):
+        return len(self._sites)
+
+    @property
+    def touched(self):
+        return [site for site in self._sites if site in self._loaded]
+
+
+# Lets a LazyTrace be passed straight into jitted code such as LightweightMMM._predict,
+# flattening reads every site it exposes
+jax.tree_util.register_pytree_node(
+    LazyTrace,
+    lambda trace: ([trace[site] for site in trace], tuple(trace)),
+    lambda sites, values: dict(zip(sites, values)),
+)
+
+
+def _npy_file(value) -> Optional[str]:
+    """
+    The .npy file value memory-maps in full, if any, which can be copied as
+    it is instead of being read into memory and written again.
+    """
+    if not isinstance(value, np.memmap) or value.filename is None:
+        return None
+
+    with open(value.filename, "rb") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    if (
+        shape == value.shape
+        and dtype == value.dtype
+        and not fortran_order
+        and offset == value.offset
+        and value.flags.c_contiguous
+    ):
+        return value.filename
+    return None
+
+
+def _write_npz(file, arrays: Dict[str, Any]):
+    """
+    Writes arrays to file like np.savez_compressed, copying the arrays that
+    memory-map a whole .npy file from the file in chunks.
+    """
+    with zipfile.ZipFile(
+        file, mode="w", compression=zipfile.ZIP_DEFLATED, allowZip64=True
+    ) as archive:
+        for name, value in arrays.items():
+            npy_file = _npy_file(value)
+            if npy_file is not None:
+                archive.write(npy_file, arcname=f"{name}.npy")
+                continue
+            with archive.open(f"{name}.npy", mode="w", force_zip64=True) as entry:
+                np.lib.format.write_array(entry, np.asanyarray(value), allow_pickle=True)
+
+
 # External serializer for the LightweightMMM class
 class LightweightMMMSerializer:
     @staticmethod
-    def serialize(obj: lightweight_mmm.LightweightMMM) -> BytesIO:
-        if not isinstance(obj, lightweight_mmm.LightweightMMM):
-            raise TypeError("Object is not an instance of LightweightMMM")
-
-        data = {
+    def _metadata(obj: lightweight_mmm.LightweightMMM) -> Dict[str, Any]:
+        return {
             "model_name": obj.model_name,
             "_weekday_seasonality": obj._weekday_seasonality,
             "custom_priors": obj.custom_priors,
@@ -28,40 +148,29 @@ class LightweightMMMSerializer:
             "_seasonality_frequency": obj._seasonality_frequency,
             "media_names": obj.media_names,
         }
-        json_data = json.dumps(data)
-        # write standard data
-        bytes_ = BytesIO()
-
-        np_obj = np.savez_compressed(
-            bytes_,
-            _extra_features=obj._extra_features,
-            _media_prior=obj._media_prior,
-            _target=obj._target,
-            media=obj.media,
-            trace_ad_effect_retention_rate=obj.trace["ad_effect_retention_rate"],
-            trace_channel_coef_media=obj.trace["channel_coef_media"],
-            trace_coef_extra_features=obj.trace["coef_extra_features"],
-            trace_coef_media=obj.trace["coef_media"],
-            trace_coef_seasonality=obj.trace["coef_seasonality"],
-            trace_coef_trend=obj.trace["coef_trend"],
-            trace_expo_trend=obj.trace["expo_trend"],
-            trace_exponent=obj.trace["exponent"],
-            trace_gamma_seasonality=obj.trace["gamma_seasonality"],
-            trace_intercept=obj.trace["intercept"],
-            trace_media_transformed=obj.trace["media_transformed"],
-            trace_mu=obj.trace["mu"],
-            trace_peak_effect_delay=obj.trace["peak_effect_delay"],
-            trace_sigma=obj.trace["sigma"],
-        )
-        bytes_.seek(0)
 
-        return json_data, bytes_
+    @staticmethod
+    def _arrays(obj: lightweight_mmm.LightweightMMM) -> Dict[str, Any]:
+        arrays = {
+            "_extra_features": obj._extra_features,
+            "_media_prior": obj._media_prior,
+            "_target": obj._target,
+            "media": obj.media,
+        }
+        # Models fitted without deterministic sites are stored without them
+        for site in TRACE_SITES:
+            if site in obj.trace:
+                arrays[f"trace_{site}"] = obj.trace[site]
+
+        return arrays
 
     @staticmethod
-    def deserialize(numpy_bytes, json_bytes) -> lightweight_mmm.LightweightMMM:
-        # Parse the JSON string back to a dictionary
-        json_data = json.load(json_bytes)
-        numpy_obj = np.load(numpy_bytes, allow_pickle=True)
+    def _restore(
+        json_data: Dict[str, Any],
+        load_array: Callable[[str], Any],
+        lazy: bool = False,
+        trace_sites: Iterable[str] = TRACE_SITES,
+    ) -> lightweight_mmm.LightweightMMM:
         # Create the instance of LightweightMMM with the non-underscored attributes
         loaded_mmm_model = lightweight_mmm.LightweightMMM(json_data["model_name"])
 
@@ -82,26 +191,205 @@ class LightweightMMMSerializer:
 
         # Manually set attributes from numpy binary
 
-        loaded_mmm_model._extra_features = numpy_obj["_extra_features"]
-        loaded_mmm_model._media_prior = numpy_obj["_media_prior"]
-        loaded_mmm_model._target = numpy_obj["_target"]
-        loaded_mmm_model.media = numpy_obj["media"]
-
-        loaded_mmm_model.trace = {
-            "ad_effect_retention_rate": numpy_obj["trace_ad_effect_retention_rate"],
-            "channel_coef_media": numpy_obj["trace_channel_coef_media"],
-            "coef_extra_features": numpy_obj["trace_coef_extra_features"],
-            "coef_media": numpy_obj["trace_coef_media"],
-            "coef_seasonality": numpy_obj["trace_coef_seasonality"],
-            "coef_trend": numpy_obj["trace_coef_trend"],
-            "expo_trend": numpy_obj["trace_expo_trend"],
-            "exponent": numpy_obj["trace_exponent"],
-            "gamma_seasonality": numpy_obj["trace_gamma_seasonality"],
-            "intercept": numpy_obj["trace_intercept"],
-            "media_transformed": numpy_obj["trace_media_transformed"],
-            "mu": numpy_obj["trace_mu"],
-            "peak_effect_delay": numpy_obj["trace_peak_effect_delay"],
-            "sigma": numpy_obj["trace_sigma"],
-        }
+        loaded_mmm_model._extra_features = load_array("_extra_features")
+        loaded_mmm_model._media_prior = load_array("_media_prior")
+        loaded_mmm_model._target = load_array("_target")
+        loaded_mmm_model.media = load_array("media")
+
+        if lazy:
+            loaded_mmm_model.trace = LazyTrace(
+                lambda site: load_array(f"trace_{site}"), trace_sites
+            )
+        else:
+            loaded_mmm_model.trace = {
+                site: load_array(f"trace_{site}") for site in trace_sites
+            }
 
         return loaded_mmm_model
+
+    @staticmethod
+    def serialize(obj: lightweight_mmm.LightweightMMM, numpy_file=None) -> BytesIO:
+        """
+        numpy_file, a path or a file object, receives the compressed arrays
+        instead of an in-memory buffer and is returned in its place. It may
+        be an unseekable stream.
+        """
+        if not isinstance(obj, lightweight_mmm.LightweightMMM):
+            raise TypeError("Object is not an instance of LightweightMMM")
+
+        json_data = json.dumps(LightweightMMMSerializer._metadata(obj))
+        # write standard data
+        bytes_ = BytesIO() if numpy_file is None else numpy_file
+
+        _write_npz(bytes_, LightweightMMMSerializer._arrays(obj))
+        if hasattr(bytes_, "seekable") and bytes_.seekable():
+            bytes_.seek(0)
+
+        return json_data, bytes_
+
+    @staticmethod
+    def deserialize(
+        numpy_bytes, json_bytes, lazy=False, trace_sites=None
+    ) -> lightweight_mmm.LightweightMMM:
+        """
+        With lazy=True the trace is a LazyTrace and each site is only
+        decompressed when first accessed, so numpy_bytes must stay open.
+        trace_sites limits which sites the model exposes and defaults to every
+        trace site in the archive.
+        """
+        # Parse the JSON string back to a dictionary
+        json_data = json.load(json_bytes)
+        numpy_obj = np.load(numpy_bytes, allow_pickle=True)
+
+        if trace_sites is None:
+            trace_sites = [
+                name[len("trace_") :]
+                for name in numpy_obj.files
+                if name.startswith("trace_")
+            ]
+
+        return LightweightMMMSerializer._restore(
+            json_data, numpy_obj.__getitem__, lazy, trace_sites
+        )
+
+    @staticmethod
+    def _write_directory(directory, metadata, arrays, **manifest_fields) -> str:
+        os.makedirs(directory, exist_ok=True)
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            **manifest_fields,
+            "metadata": metadata,
+            "arrays": {},
+        }
+
+        for name, value in arrays.items():
+            if value is None:
+                # Absent arrays (e.g. no extra features) are restored as None
+                manifest["arrays"][name] = None
+                continue
+
+            file_name = f"{name}.npy"
+            npy_file = _npy_file(value)
+            if npy_file is not None:
+                array = value
+                shutil.copyfile(npy_file, os.path.join(directory, file_name))
+            else:
+                array = np.ascontiguousarray(value)
+                np.save(os.path.join(directory, file_name), array, allow_pickle=False)
+            manifest["arrays"][name] = {
+                "file": file_name,
+                "dtype": array.dtype.str,
+                "shape": list(array.shape),
+            }
+
+        manifest_path = os.path.join(directory, MANIFEST_FILE_NAME)
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f)
+
+        return manifest_path
+
+    @staticmethod
+    def serialize_to_directory(obj: lightweight_mmm.LightweightMMM, directory) -> str:
+        """
+        Writes the model as a JSON manifest plus one uncompressed .npy file per
+        array, so a reader can memory-map the arrays and only page in what it
+        touches. Returns the manifest path.
+        """
+        if not isinstance(obj, lightweight_mmm.LightweightMMM):
+            raise TypeError("Object is not an instance of LightweightMMM")
+
+        return LightweightMMMSerializer._write_directory(
+            directory,
+            LightweightMMMSerializer._metadata(obj),
+            LightweightMMMSerializer._arrays(obj),
+        )
+
+    @staticmethod
+    def serialize_inference_bundle(
+        obj: lightweight_mmm.LightweightMMM,
+        directory,
+        num_draws: Optional[int] = None,
+        dtype: Optional[str] = None,
+        seed: int = 0,
+    ) -> str:
+        """
+        Writes the subset of the model that predict and find_optimal_budgets
+        need in the directory format: the media and cost inputs plus the latent
+        trace sites. The trace can be thinned to num_draws random draws and
+        down-cast to dtype (e.g. "float16"); readers cast float16 back to
+        float32. Returns the manifest path.
+        """
+        if not isinstance(obj, lightweight_mmm.LightweightMMM):
+            raise TypeError("Object is not an instance of LightweightMMM")
+
+        total_draws = len(obj.trace["sigma"])
+        draws = None
+        if num_draws and num_draws < total_draws:
+            draws = np.sort(
+                np.random.default_rng(seed).choice(
+                    total_draws, size=num_draws, replace=False
+                )
+            )
+
+        arrays = {
+            "_extra_features": obj._extra_features,
+            "_media_prior": obj._media_prior,
+            "_target": None,
+            "media": obj.media,
+        }
+        for site in LATENT_SITES:
+            values = np.asarray(obj.trace[site])
+            if draws is not None:
+                values = values[draws]
+            if dtype is not None:
+                values = values.astype(dtype)
+            arrays[f"trace_{site}"] = values
+
+        return LightweightMMMSerializer._write_directory(
+            directory,
+            LightweightMMMSerializer._metadata(obj),
+            arrays,
+            inference_only=True,
+            num_draws=total_draws if draws is None else int(num_draws),
+        )
+
+    @staticmethod
+    def deserialize_from_directory(
+        directory, mmap_mode="r", lazy=False, trace_sites=None
+    ) -> lightweight_mmm.LightweightMMM:
+        """
+        trace_sites defaults to every trace site present in the manifest.
+        """
+        with open(os.path.join(directory, MANIFEST_FILE_NAME)) as f:
+            manifest = json.load(f)
+
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise ValueError(
+                f"Unsupported model manifest version {manifest.get('version')}, expected {MANIFEST_VERSION}"
+            )
+
+        if trace_sites is None:
+            trace_sites = [
+                name[len("trace_") :]
+                for name in manifest["arrays"]
+                if name.startswith("trace_")
+            ]
+
+        def load_array(name):
+            entry = manifest["arrays"][name]
+            if entry is None:
+                return None
+            array = np.load(
+                os.path.join(directory, entry["file"]),
+                mmap_mode=mmap_mode,
+                allow_pickle=False,
+            )
+            if array.dtype == np.float16:
+                # Half precision is a storage format only, compute in float32
+                array = array.astype(np.float32)
+            return array
+
+        return LightweightMMMSerializer._restore(
+            manifest["metadata"], load_array, lazy, trace_sites
+        )
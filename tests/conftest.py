@@ -0,0 +1,54 @@
+import importlib.util
+import os
+import sys
+
+import boto3
+import pytest
+
+# The batch job and the Lambdas import their modules flat from these folders
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for folder in ("src/shared", "src/docker/application"):
+    sys.path.insert(0, os.path.join(ROOT, folder))
+
+BUCKET_NAME = "test-bucket"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    """
+    An S3 client against a moto bucket named BUCKET_NAME.
+    """
+    moto = pytest.importorskip("moto")
+    for name, value in (
+        ("AWS_ACCESS_KEY_ID", "testing"),
+        ("AWS_SECRET_ACCESS_KEY", "testing"),
+        ("AWS_DEFAULT_REGION", "us-east-1"),
+    ):
+        monkeypatch.setenv(name, value)
+
+    with moto.mock_aws():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket=BUCKET_NAME)
+        yield s3_client
+
+
+
+@pytest.fixture
+def backend(s3, monkeypatch, tmp_path):
+    """
+    A fresh import of the backend budget Lambda against the moto bucket, with
+    empty caches and its model directory under tmp_path.
+    """
+    monkeypatch.setenv("S3_BUCKET_NAME", BUCKET_NAME)
+    monkeypatch.setenv("DDB_TABLE_NAME", "test-table")
+    monkeypatch.setenv("MODEL_DIR", str(tmp_path / "models"))
+    monkeypatch.setenv("JAX_CACHE_DIR", "")
+    monkeypatch.setenv("POWERTOOLS_TRACE_DISABLED", "1")
+    monkeypatch.setenv("POWERTOOLS_METRICS_NAMESPACE", "test")
+
+    spec = importlib.util.spec_from_file_location(
+        "backend_handler", os.path.join(ROOT, "src/lambda/backend_api/lambda-handler.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
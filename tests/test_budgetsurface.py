@@ -0,0 +1,60 @@
+import jax.numpy as jnp
+import numpy as np
+import pytest
+from lightweight_mmm import lightweight_mmm, preprocessing
+
+from budgetsurface import build_budget_surface, default_budget_grid, solve_budget
+from test_checkpoint import small_inputs
+
+N_TIME_PERIODS = 4
+
+# Largest interpolation error accepted against an exact solve, relative to
+# the budget for allocations and to the exact KPI for predictions
+ALLOCATION_TOLERANCE = 1e-3
+KPI_TOLERANCE = 1e-3
+
+
+@pytest.fixture(scope="module")
+def fitted():
+    media, media_prior, target, extra_features = small_inputs(weeks=20, channels=3, geos=1)
+    media_scaler = preprocessing.CustomScaler(divide_operation=jnp.mean)
+    target_scaler = preprocessing.CustomScaler(divide_operation=jnp.mean)
+
+    mmm = lightweight_mmm.LightweightMMM("carryover")
+    mmm.fit(
+        media=media_scaler.fit_transform(100 * media[..., 0]),
+        media_prior=media_prior,
+        target=target_scaler.fit_transform(target[..., 0]),
+        extra_features=extra_features[..., 0],
+        number_warmup=20,
+        number_samples=20,
+        number_chains=1,
+        seed=1,
+    )
+    return mmm, target_scaler, media_scaler
+
+
+def test_interpolation_between_grid_points_matches_exact_solves(fitted):
+    mmm, target_scaler, media_scaler = fitted
+    budgets = default_budget_grid(mmm, N_TIME_PERIODS, media_scaler, points=5)
+    surface = build_budget_surface(
+        mmm, budgets, N_TIME_PERIODS, target_scaler, media_scaler
+    )
+
+    assert surface.allocation_error <= ALLOCATION_TOLERANCE
+    assert surface.kpi_error <= KPI_TOLERANCE
+
+    for budget in (budgets[:-1] + budgets[1:]) / 2:
+        assert surface.covers(budget, N_TIME_PERIODS)
+        estimate = surface.interpolate(budget)
+        exact = solve_budget(mmm, budget, N_TIME_PERIODS, target_scaler, media_scaler)
+
+        assert np.sum(estimate.allocation) == pytest.approx(budget, rel=1e-6)
+        assert (
+            np.max(np.abs(estimate.allocation - exact.allocation)) / budget
+            <= ALLOCATION_TOLERANCE
+        )
+        assert (
+            abs(estimate.predicted_kpi - exact.predicted_kpi) / abs(exact.predicted_kpi)
+            <= KPI_TOLERANCE
+        )
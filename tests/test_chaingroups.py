@@ -0,0 +1,92 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+from lightweight_mmm import lightweight_mmm
+
+from sampler import fit_mmm
+from test_checkpoint import NUMBER_SAMPLES, SEGMENT_SIZE, small_inputs
+
+# Runs a vectorized fit in a fresh process and prints its peak RSS growth
+# next to the planner's estimate for the same fit
+MEMORY_SCRIPT = """
+import resource, sys
+import jax, numpy as np
+from lightweight_mmm import lightweight_mmm
+import sampler
+from chainplan import estimate_chain_bytes
+
+geos, chains, samples = (int(arg) for arg in sys.argv[1:4])
+rng = np.random.default_rng(0)
+media = rng.uniform(0.5, 1.5, (52, 3, geos)).astype(np.float32)
+target = rng.uniform(0.5, 1.5, (52, geos)).astype(np.float32)
+extra_features = rng.uniform(0.5, 1.5, (52, 2, geos)).astype(np.float32)
+
+build_mcmc = sampler.build_mcmc
+sampler.build_mcmc = lambda *args, **kwargs: build_mcmc(
+    *args, **{**kwargs, "kernel_options": {"max_tree_depth": 3}}
+)
+peak = lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+jax.numpy.zeros(1).block_until_ready()
+base = peak()
+sampler.fit_mmm(
+    lightweight_mmm.LightweightMMM("carryover"), media, np.full(3, 0.15, np.float32),
+    target, extra_features, number_warmup=10, number_samples=samples,
+    number_chains=chains, seed=1, chain_method="vectorized", progress_bar=False,
+)
+estimated = chains * estimate_chain_bytes(samples, media.shape, number_extra_features=2)
+print(peak() - base, estimated)
+"""
+
+
+def measure(geos, chains, samples):
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)}
+    output = subprocess.run(
+        [sys.executable, "-c", MEMORY_SCRIPT, str(geos), str(chains), str(samples)],
+        capture_output=True,
+        check=True,
+        text=True,
+        env=env,
+    ).stdout
+    measured, estimated = output.split()[-2:]
+    return int(measured), int(estimated)
+
+
+def test_chain_estimate_tracks_measured_memory_per_chain():
+    # The growth per extra chain excludes the runtime and compilation
+    # overhead a process pays once, which the estimate leaves out. Enough
+    # samples that the traces outweigh allocator noise (measured 187 MiB
+    # against 170 MiB estimated per chain)
+    measured_one, estimated_one = measure(geos=100, chains=1, samples=1000)
+    measured_three, estimated_three = measure(geos=100, chains=3, samples=1000)
+
+    measured_chain = (measured_three - measured_one) / 2
+    estimated_chain = (estimated_three - estimated_one) / 2
+    assert 0.75 * measured_chain <= estimated_chain <= 1.33 * measured_chain
+
+
+def test_grouped_chains_are_judged_together_and_not_stopped_early():
+    calls = []
+
+    def on_segment(samples_done, segments):
+        calls.append((samples_done, segments[0]["sigma"].shape[0]))
+        return True
+
+    mmm = lightweight_mmm.LightweightMMM("carryover")
+    fit_mmm(
+        mmm,
+        *small_inputs(),
+        number_warmup=10,
+        number_samples=NUMBER_SAMPLES,
+        number_chains=2,
+        chain_method="sequential",
+        seed=1,
+        segment_size=SEGMENT_SIZE,
+        on_segment=on_segment,
+        chain_groups=[1, 1],
+    )
+
+    assert mmm._number_samples == NUMBER_SAMPLES
+    assert calls == [(NUMBER_SAMPLES, 2)]
+    assert np.shape(mmm.trace["sigma"])[0] == 2 * NUMBER_SAMPLES
@@ -0,0 +1,124 @@
+import json
+
+import numpy as np
+import pytest
+from lightweight_mmm import lightweight_mmm
+
+import sampler
+from checkpoint import MANIFEST_NAME, LocalCheckpointStore
+from sampler import fit_mmm
+
+NUMBER_SAMPLES = 12
+SEGMENT_SIZE = 4
+
+
+class Interrupted(Exception):
+    pass
+
+
+def small_inputs(weeks=20, channels=2, geos=2, seed=0):
+    rng = np.random.default_rng(seed)
+    media = rng.uniform(0.5, 1.5, (weeks, channels, geos)).astype(np.float32)
+    media_prior = np.full(channels, 0.15, dtype=np.float32)
+    target = rng.uniform(0.5, 1.5, (weeks, geos)).astype(np.float32)
+    extra_features = rng.uniform(0.5, 1.5, (weeks, 1, geos)).astype(np.float32)
+    return media, media_prior, target, extra_features
+
+
+def fit(checkpoint_store=None, interrupt_after=None, seed=1, map_init_steps=0):
+    """
+    Fits a small model in segments, raising Interrupted once interrupt_after
+    samples are drawn and checkpointed, as if the job had been stopped.
+    """
+
+    def on_segment(samples_done, segments):
+        if samples_done == interrupt_after:
+            raise Interrupted()
+        return False
+
+    mmm = lightweight_mmm.LightweightMMM("carryover")
+    fit_mmm(
+        mmm,
+        *small_inputs(),
+        number_warmup=10,
+        number_samples=NUMBER_SAMPLES,
+        number_chains=1,
+        chain_method="sequential",
+        seed=seed,
+        segment_size=SEGMENT_SIZE,
+        checkpoint_store=checkpoint_store,
+        on_segment=on_segment,
+        map_init_steps=map_init_steps,
+    )
+    return mmm
+
+
+@pytest.fixture(scope="module")
+def uninterrupted():
+    return fit()
+
+
+def assert_same_trace(mmm, expected):
+    assert mmm._number_samples == expected._number_samples == NUMBER_SAMPLES
+    assert sorted(mmm.trace) == sorted(expected.trace)
+    for site in expected.trace:
+        assert len(mmm.trace[site]) == NUMBER_SAMPLES
+        np.testing.assert_array_equal(mmm.trace[site], expected.trace[site])
+
+
+@pytest.mark.parametrize("interrupt_after", [SEGMENT_SIZE, 2 * SEGMENT_SIZE])
+def test_resume_continues_the_interrupted_chains(
+    tmp_path, capsys, uninterrupted, interrupt_after
+):
+    store = LocalCheckpointStore(str(tmp_path))
+    with pytest.raises(Interrupted):
+        fit(store, interrupt_after=interrupt_after)
+
+    manifest = json.loads(store.read(MANIFEST_NAME))
+    assert manifest["samples_done"] == interrupt_after
+
+    capsys.readouterr()
+    resumed = fit(store)
+    assert f"Resuming sampling from checkpoint after {interrupt_after} samples" in capsys.readouterr().out
+    assert_same_trace(resumed, uninterrupted)
+
+
+def test_checkpoint_of_another_config_is_ignored(tmp_path, capsys, uninterrupted):
+    store = LocalCheckpointStore(str(tmp_path))
+    with pytest.raises(Interrupted):
+        fit(store, interrupt_after=SEGMENT_SIZE, seed=2)
+
+    capsys.readouterr()
+    restarted = fit(store)
+    assert "Resuming" not in capsys.readouterr().out
+    assert_same_trace(restarted, uninterrupted)
+
+
+def test_checkpoint_of_another_version_is_ignored(tmp_path, capsys, uninterrupted):
+    store = LocalCheckpointStore(str(tmp_path))
+    with pytest.raises(Interrupted):
+        fit(store, interrupt_after=SEGMENT_SIZE)
+    manifest = json.loads(store.read(MANIFEST_NAME))
+    manifest["version"] += 1
+    # A stale checkpoint whose draws would not continue the chains
+    manifest["samples_done"] = 2 * SEGMENT_SIZE
+    store.write(MANIFEST_NAME, json.dumps(manifest).encode("utf-8"))
+
+    capsys.readouterr()
+    restarted = fit(store)
+    assert "Resuming" not in capsys.readouterr().out
+    assert_same_trace(restarted, uninterrupted)
+
+
+def test_resume_skips_the_map_search(tmp_path, monkeypatch):
+    store = LocalCheckpointStore(str(tmp_path))
+    with pytest.raises(Interrupted):
+        fit(store, interrupt_after=SEGMENT_SIZE, map_init_steps=20)
+
+    def map_init_params(*args, **kwargs):
+        raise AssertionError("MAP search ran for chains resuming from a checkpoint")
+
+    monkeypatch.setattr(sampler, "map_init_params", map_init_params)
+    resumed = fit(store, map_init_steps=20)
+
+    assert resumed._number_samples == NUMBER_SAMPLES
@@ -0,0 +1,91 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Compiles a function with the persistent cache on, syncs the cache to a moto
+# bucket, then empties the local cache and JAX's in-memory executables as in
+# a fresh container, restores the cache from S3 and compiles again
+SYNC_SCRIPT = """
+import json, os, shutil, sys
+import boto3, jax, jax.numpy as jnp, moto
+from compilecache import (
+    XLA_CPU_RUNTIME_FLAG, CompilationCacheSync, cache_prefix, compile_stats,
+    configure_compilation_cache,
+)
+
+cache_dir = sys.argv[1]
+configure_compilation_cache(cache_dir)
+
+def compile_and_run():
+    compile_stats.reset()
+    x = jnp.arange(64.0).reshape(8, 8)
+    jax.jit(lambda x: jnp.tanh(x @ x.T).sum())(x).block_until_ready()
+    return compile_stats.summary()
+
+with moto.mock_aws():
+    s3_client = boto3.client("s3")
+    s3_client.create_bucket(Bucket="cache-bucket")
+    prefix = cache_prefix("carryover", "cpu")
+
+    cold = compile_and_run()
+    uploaded = CompilationCacheSync(cache_dir, s3_client, "cache-bucket", prefix).upload()
+
+    shutil.rmtree(cache_dir)
+    os.makedirs(cache_dir)
+    jax.clear_caches()
+    downloaded = CompilationCacheSync(cache_dir, s3_client, "cache-bucket", prefix).download()
+    restored = compile_and_run()
+
+print(json.dumps({
+    "cpu_runtime_flag": XLA_CPU_RUNTIME_FLAG in os.environ.get("XLA_FLAGS", ""),
+    "cold": cold, "uploaded": uploaded, "downloaded": downloaded, "restored": restored,
+}))
+"""
+
+# configure_compilation_cache on a JAX version outside the gate
+GATE_SCRIPT = """
+import json, os, sys
+import jax
+jax.__version__ = "0.4.30"
+from compilecache import XLA_CPU_RUNTIME_FLAG, configure_compilation_cache
+
+configure_compilation_cache(sys.argv[1])
+print(json.dumps({"cpu_runtime_flag": XLA_CPU_RUNTIME_FLAG in os.environ.get("XLA_FLAGS", "")}))
+"""
+
+
+def run_script(script, tmp_path):
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(sys.path),
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "AWS_DEFAULT_REGION": "us-east-1",
+    }
+    env.pop("XLA_FLAGS", None)
+    output = subprocess.run(
+        [sys.executable, "-c", script, str(tmp_path / "jax_cache")],
+        capture_output=True,
+        check=True,
+        text=True,
+        env=env,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def test_cache_synced_to_s3_is_hit_after_restore(tmp_path):
+    pytest.importorskip("moto")
+    result = run_script(SYNC_SCRIPT, tmp_path)
+
+    assert result["cpu_runtime_flag"]
+    assert result["cold"]["cache_misses"] >= 1 and result["cold"]["cache_hits"] == 0
+    assert result["uploaded"] >= 1
+    assert result["downloaded"] == result["uploaded"]
+    assert result["restored"]["cache_hits"] >= 1 and result["restored"]["cache_misses"] == 0
+
+
+def test_cpu_runtime_flag_is_skipped_on_other_jax_versions(tmp_path):
+    assert run_script(GATE_SCRIPT, tmp_path) == {"cpu_runtime_flag": False}
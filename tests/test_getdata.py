@@ -0,0 +1,92 @@
+import importlib
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# Later tables answer first, so completion order differs from table order
+DELAYS = {"media": 0.8, "cost": 0.6, "kpi": 0.4, "features": 0.2}
+
+
+@pytest.fixture(scope="module")
+def mainathena():
+    pytest.importorskip("awswrangler")
+    pytest.importorskip("ec2_metadata")
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+        # Keeps the import from enabling a compilation cache for the test run
+        monkeypatch.setenv("JAX_CACHE_DIR", "")
+        yield importlib.import_module("mainathena")
+
+
+def table_frames(weeks=3, channels=("TikTok", "Facebook"), geos=2):
+    rng = np.random.default_rng(0)
+    index = pd.MultiIndex.from_product(
+        [[f"Week {week + 1}" for week in range(weeks)], list(channels), range(geos)],
+        names=["week_number", "media_channel", "geography"],
+    )
+    media = index.to_frame(index=False).assign(impressions=rng.random(len(index)))
+    cost = pd.DataFrame({"media_channel": list(channels), "avg_cost_per_unit": rng.random(len(channels))})
+    kpi = media[media["media_channel"] == channels[0]][["week_number", "geography"]].assign(
+        kpi=rng.random(weeks * geos)
+    )
+    features = media.rename(columns={"media_channel": "feature"}).drop(columns="impressions")
+    features = features.assign(feature_value=rng.random(len(features)))
+    return {"media": media, "cost": cost, "kpi": kpi, "features": features}
+
+
+def sleeping_query_fn(frames, calls):
+    def query_fn(glue_db, table_name, value_column):
+        calls.append(table_name)
+        time.sleep(DELAYS[table_name])
+        return frames[table_name].copy()
+
+    return query_fn
+
+
+@pytest.mark.parametrize("concurrent", [True, False])
+def test_get_data_fetches_tables_concurrently_in_order(mainathena, concurrent):
+    frames = table_frames()
+    calls = []
+
+    start_time = time.perf_counter()
+    media, costs, target, extra_features, latencies = mainathena.get_data(
+        "db",
+        "media",
+        "cost",
+        "kpi",
+        "features",
+        concurrent=concurrent,
+        query_fn=sleeping_query_fn(frames, calls),
+    )
+    elapsed = time.perf_counter() - start_time
+
+    if concurrent:
+        # About the slowest query, not the sum of all of them
+        assert elapsed < max(DELAYS.values()) + 0.3
+    else:
+        assert elapsed >= sum(DELAYS.values())
+    assert sorted(calls) == sorted(DELAYS)
+
+    # Each tensor comes from its own table whatever order the queries finished in
+    np.testing.assert_array_equal(
+        media, mainathena.create_multi_dim_array(frames["media"], "impressions")
+    )
+    np.testing.assert_array_equal(
+        costs, mainathena.create_multi_dim_array(frames["cost"], "avg_cost_per_unit")
+    )
+    np.testing.assert_array_equal(
+        target, mainathena.create_multi_dim_array(frames["kpi"], "kpi")
+    )
+    np.testing.assert_array_equal(
+        extra_features,
+        mainathena.create_multi_dim_array(frames["features"], "feature_value"),
+    )
+    assert media.shape == (3, 2, 2) and costs.shape == (2,) and target.shape == (3, 2)
+    assert [latencies[name]["table"] for name in ("media", "cost", "kpi", "extra_features")] == [
+        "media",
+        "cost",
+        "kpi",
+        "features",
+    ]
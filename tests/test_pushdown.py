@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from pushdown import build_pushdown_query, key_orders
+from tensorbuilder import build_dense_tensor, reshape_sorted_tensor, scatter_indexed_tensor
+
+duckdb = pytest.importorskip("duckdb")
+
+# The data generator's channel order, which its scalers follow
+CHANNELS = ["Facebook", "TikTok", "Amazon", "Instagram", "Google", "Youtube"]
+COLUMN_TYPES = {
+    "week_number": "string",
+    "media_channel": "string",
+    "geography": "bigint",
+    "impressions": "double",
+}
+KEY_COLUMNS = ["week_number", "media_channel", "geography"]
+
+
+def generated_media(weeks=12, geos=3, seed=0):
+    """
+    Media rows laid out the way the data generator writes them.
+    """
+    rng = np.random.default_rng(seed)
+    rows = [
+        (f"Week {week + 1}", channel, geo, rng.random())
+        for week in range(weeks)
+        for channel in CHANNELS
+        for geo in range(geos)
+    ]
+    return pd.DataFrame(rows, columns=list(COLUMN_TYPES))
+
+
+def run_pushdown(table, label_orders):
+    sql, index_columns = build_pushdown_query(
+        "media_data_train", "impressions", COLUMN_TYPES, label_orders
+    )
+    connection = duckdb.connect()
+    # Row order must not matter, Athena gives no guarantee about it
+    connection.register("media_data_train", table.sample(frac=1, random_state=1))
+    return connection.execute(sql).df(), index_columns
+
+
+def expected_tensor(df):
+    # The other sources index geos by value, weeks and channels by appearance
+    return build_dense_tensor(
+        df, "impressions", key_columns=KEY_COLUMNS, sorted_columns=["geography"]
+    )
+
+
+def test_pushdown_matches_dense_tensor_in_generator_order():
+    df = generated_media()
+    label_orders = key_orders(df, ["week_number", "media_channel"])
+
+    result, index_columns = run_pushdown(df, label_orders)
+    values = reshape_sorted_tensor(result, "impressions", index_columns)
+
+    expected = expected_tensor(df)
+    assert list(expected.labels[1]) == CHANNELS
+    np.testing.assert_array_equal(values, expected.values)
+
+
+def test_incomplete_pushdown_result_matches_dense_tensor():
+    df = generated_media()
+    label_orders = key_orders(df, ["week_number", "media_channel"])
+    # Week 1 has no Facebook rows
+    sparse = df[~((df["week_number"] == "Week 1") & (df["media_channel"] == "Facebook"))]
+
+    result, index_columns = run_pushdown(sparse, label_orders)
+    assert reshape_sorted_tensor(result, "impressions", index_columns) is None
+    tensor = scatter_indexed_tensor(result, "impressions", index_columns)
+
+    # Facebook keeps its position although it first appears in week 2
+    expected = expected_tensor(df).values
+    expected[0, 0] = 0
+    np.testing.assert_array_equal(tensor.values, expected)
+    assert tensor.missing_cells == 3
+
+
+def test_labels_without_a_position_are_rejected():
+    df = generated_media(weeks=2)
+    label_orders = key_orders(df, ["week_number", "media_channel"])
+    label_orders["media_channel"] = label_orders["media_channel"][:-1]
+
+    result, index_columns = run_pushdown(df, label_orders)
+
+    with pytest.raises(ValueError):
+        reshape_sorted_tensor(result, "impressions", index_columns)
+
+
+def test_labels_are_quoted():
+    df = generated_media(weeks=2)
+    df["media_channel"] = df["media_channel"].replace("TikTok", "Tik'Tok")
+    label_orders = key_orders(df, ["week_number", "media_channel"])
+
+    result, index_columns = run_pushdown(df, label_orders)
+
+    np.testing.assert_array_equal(
+        reshape_sorted_tensor(result, "impressions", index_columns),
+        expected_tensor(df).values,
+    )
@@ -0,0 +1,142 @@
+import io
+import os
+
+import numpy as np
+import pytest
+from botocore.exceptions import ClientError
+
+from conftest import BUCKET_NAME
+from s3stream import MIN_PART_SIZE, S3MultipartWriter, download_files
+from test_serializer import fitted_model
+from util import LightweightMMMSerializer
+
+
+def random_bytes(size, seed=0):
+    return np.random.default_rng(seed).integers(0, 256, size, dtype=np.uint8).tobytes()
+
+
+def test_writer_round_trips_objects_above_the_part_size(s3):
+    data = random_bytes(2 * MIN_PART_SIZE + 12345)
+
+    with S3MultipartWriter(s3, BUCKET_NAME, "model.bin", part_size=MIN_PART_SIZE) as writer:
+        # Writes straddle the part boundaries
+        for start in range(0, len(data), 1000003):
+            writer.write(data[start : start + 1000003])
+
+    assert writer.size == len(data)
+    head = s3.head_object(Bucket=BUCKET_NAME, Key="model.bin")
+    assert head["ContentLength"] == len(data)
+    assert head["ETag"].strip('"').endswith("-3")
+    assert s3.get_object(Bucket=BUCKET_NAME, Key="model.bin")["Body"].read() == data
+
+
+def test_writer_aborts_on_exception(s3):
+    with pytest.raises(RuntimeError):
+        with S3MultipartWriter(s3, BUCKET_NAME, "model.bin", part_size=MIN_PART_SIZE) as writer:
+            writer.write(random_bytes(MIN_PART_SIZE + 1))
+            raise RuntimeError("serialization failed")
+
+    assert writer.closed
+    assert "Uploads" not in s3.list_multipart_uploads(Bucket=BUCKET_NAME)
+    assert "Contents" not in s3.list_objects_v2(Bucket=BUCKET_NAME)
+
+
+def test_writer_rejects_parts_below_the_s3_minimum(s3):
+    with pytest.raises(ValueError):
+        S3MultipartWriter(s3, BUCKET_NAME, "model.bin", part_size=MIN_PART_SIZE - 1)
+
+
+def test_model_npz_streams_through_the_writer(s3):
+    model = fitted_model(samples=200, weeks=52, channels=6, geos=20)
+
+    with S3MultipartWriter(s3, BUCKET_NAME, "model.npz", part_size=MIN_PART_SIZE) as writer:
+        json_str, _ = LightweightMMMSerializer.serialize(model, writer)
+
+    numpy_bytes = io.BytesIO(s3.get_object(Bucket=BUCKET_NAME, Key="model.npz")["Body"].read())
+    assert numpy_bytes.getbuffer().nbytes == writer.size
+    loaded = LightweightMMMSerializer.deserialize(numpy_bytes, io.StringIO(json_str))
+
+    np.testing.assert_array_equal(loaded.media, model.media)
+    for site, value in model.trace.items():
+        np.testing.assert_array_equal(loaded.trace[site], value)
+
+
+def put_object(s3, key, data):
+    s3.put_object(Bucket=BUCKET_NAME, Key=key, Body=data)
+
+
+def test_download_files_reassembles_ranged_parts(s3, tmp_path):
+    files = {f"model/{name}.npy": tmp_path / f"{name}.npy" for name in ("a", "b", "empty")}
+    contents = {
+        "model/a.npy": random_bytes(10 * 1024 + 7, seed=1),
+        "model/b.npy": random_bytes(3 * 1024, seed=2),
+        "model/empty.npy": b"",
+    }
+    for key, data in contents.items():
+        put_object(s3, key, data)
+
+    downloaded = download_files(s3, BUCKET_NAME, files, part_size=1024, max_concurrency=4)
+
+    assert downloaded == sum(len(data) for data in contents.values())
+    for key, path in files.items():
+        assert path.read_bytes() == contents[key]
+
+
+def test_download_files_fails_when_the_object_changes(s3, tmp_path):
+    put_object(s3, "model.npy", random_bytes(8 * 1024, seed=1))
+    head_object = s3.head_object
+
+    def head_then_overwrite(**kwargs):
+        # The object is rewritten between the HEAD and the ranged GETs
+        head = head_object(**kwargs)
+        put_object(s3, kwargs["Key"], random_bytes(8 * 1024, seed=2))
+        return head
+
+    s3.head_object = head_then_overwrite
+
+    with pytest.raises(ClientError) as error:
+        download_files(
+            s3, BUCKET_NAME, {"model.npy": tmp_path / "model.npy"}, part_size=1024
+        )
+    assert error.value.response["Error"]["Code"] == "PreconditionFailed"
+
+
+def upload_model(s3, job_id, model):
+    json_str, numpy_bytes = LightweightMMMSerializer.serialize(model)
+    put_object(s3, f"saved_models/{job_id}_media_mix_model.npz", numpy_bytes.getvalue())
+    put_object(s3, f"saved_models/{job_id}_media_mix_model.json", json_str.encode("utf-8"))
+
+
+def test_get_model_reuses_memory_and_disk_copies_until_the_etag_changes(s3, backend):
+    downloads = []
+    backend_download_files = backend.download_files
+
+    def counting_download_files(*args, **kwargs):
+        downloads.append(sorted(args[2]))
+        return backend_download_files(*args, **kwargs)
+
+    backend.download_files = counting_download_files
+    model = fitted_model()
+    upload_model(s3, "job1", model)
+
+    first = backend.get_model("job1")
+    assert len(downloads) == 1
+    np.testing.assert_array_equal(first.media, model.media)
+
+    # Unchanged ETag: the deserialized model is served from memory
+    assert backend.get_model("job1") is first
+    assert backend.model_cache.hits == 1
+
+    # A cold container finds the downloaded files on disk
+    backend.model_cache = backend.ModelCache(max_bytes=2**30)
+    from_disk = backend.get_model("job1")
+    assert from_disk is not first
+    assert len(downloads) == 1
+    np.testing.assert_array_equal(from_disk.trace["sigma"], model.trace["sigma"])
+
+    # A rewritten artifact has a new ETag and is downloaded again
+    changed = fitted_model(seed=1)
+    upload_model(s3, "job1", changed)
+    reloaded = backend.get_model("job1")
+    assert len(downloads) == 2
+    np.testing.assert_array_equal(reloaded.trace["sigma"], changed.trace["sigma"])
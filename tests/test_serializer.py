@@ -0,0 +1,123 @@
+import io
+import json
+import os
+
+import numpy as np
+import pytest
+from lightweight_mmm import lightweight_mmm
+
+from util import MANIFEST_FILE_NAME, LazyTrace, LightweightMMMSerializer
+
+ARRAY_ATTRIBUTES = ("_extra_features", "_media_prior", "_target", "media")
+
+
+def fitted_model(samples=6, weeks=10, channels=3, geos=2, seed=0):
+    """
+    A LightweightMMM carrying the state a fit leaves behind, without fitting.
+    """
+    rng = np.random.default_rng(seed)
+    model = lightweight_mmm.LightweightMMM("carryover")
+    model._weekday_seasonality = False
+    model.custom_priors = {}
+    model._prior_names = frozenset(["intercept", "sigma"])
+    model.n_media_channels = channels
+    model.n_geos = geos
+    model._number_samples = samples
+    model._number_warmup = 4
+    model._number_chains = 1
+    model._train_media_size = weeks
+    model._degrees_seasonality = 2
+    model._seasonality_frequency = 52
+    model.media_names = [f"channel_{i}" for i in range(channels)]
+
+    model._extra_features = rng.random((weeks, 2, geos), dtype=np.float32)
+    model._media_prior = rng.random(channels, dtype=np.float32)
+    model._target = rng.random((weeks, geos), dtype=np.float32)
+    model.media = rng.random((weeks, channels, geos), dtype=np.float32)
+    model.trace = {
+        "intercept": rng.random((samples, geos), dtype=np.float32),
+        "sigma": rng.random((samples, geos), dtype=np.float32),
+        "coef_media": rng.random((samples, channels, geos), dtype=np.float32),
+        "mu": rng.random((samples, weeks, geos), dtype=np.float32),
+    }
+    return model
+
+
+def assert_same_model(loaded, model, trace_sites=None):
+    metadata = LightweightMMMSerializer._metadata(loaded)
+    expected = LightweightMMMSerializer._metadata(model)
+    # _prior_names is a frozenset, stored as a list in whatever order it iterates
+    assert set(metadata.pop("_prior_names")) == set(expected.pop("_prior_names"))
+    assert metadata == expected
+    assert loaded._prior_names == model._prior_names
+    for name in ARRAY_ATTRIBUTES:
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(model, name))
+
+    trace_sites = list(model.trace) if trace_sites is None else trace_sites
+    assert sorted(loaded.trace) == sorted(trace_sites)
+    for site in trace_sites:
+        np.testing.assert_array_equal(loaded.trace[site], model.trace[site])
+
+
+def load_npz(model, **options):
+    json_str, numpy_bytes = LightweightMMMSerializer.serialize(model)
+    return LightweightMMMSerializer.deserialize(
+        numpy_bytes, io.StringIO(json_str), **options
+    )
+
+
+def load_directory(model, directory, **options):
+    LightweightMMMSerializer.serialize_to_directory(model, directory)
+    return LightweightMMMSerializer.deserialize_from_directory(directory, **options)
+
+
+@pytest.fixture(params=["npz", "directory"])
+def load(request, tmp_path):
+    if request.param == "npz":
+        return load_npz
+    return lambda model, **options: load_directory(model, tmp_path / "model", **options)
+
+
+def test_eager_round_trip(load):
+    model = fitted_model()
+
+    loaded = load(model)
+
+    assert isinstance(loaded.trace, dict)
+    assert_same_model(loaded, model)
+
+
+def test_lazy_round_trip_reads_sites_on_access(load):
+    model = fitted_model()
+
+    loaded = load(model, lazy=True)
+
+    assert isinstance(loaded.trace, LazyTrace)
+    assert loaded.trace.touched == []
+    np.testing.assert_array_equal(loaded.trace["sigma"], model.trace["sigma"])
+    assert loaded.trace.touched == ["sigma"]
+    assert_same_model(loaded, model)
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_trace_sites_limit_the_restored_trace(load, lazy):
+    model = fitted_model()
+
+    loaded = load(model, lazy=lazy, trace_sites=["intercept", "coef_media"])
+
+    assert_same_model(loaded, model, trace_sites=["intercept", "coef_media"])
+    with pytest.raises(KeyError):
+        loaded.trace["mu"]
+
+
+def test_directory_rejects_unknown_manifest_version(tmp_path):
+    manifest_path = LightweightMMMSerializer.serialize_to_directory(fitted_model(), tmp_path)
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    manifest["version"] += 1
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f)
+
+    assert os.path.basename(manifest_path) == MANIFEST_FILE_NAME
+    with pytest.raises(ValueError, match="manifest version"):
+        LightweightMMMSerializer.deserialize_from_directory(tmp_path)
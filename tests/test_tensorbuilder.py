@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from tensorbuilder import build_dense_tensor, reshape_sorted_tensor, scatter_indexed_tensor
+
+
+def iterrows_tensor(df, value_column):
+    """
+    The loop create_multi_dim_array used before build_dense_tensor.
+    """
+    index_mapping = {}
+    for column in df.columns:
+        if column != value_column:
+            unique_values = df[column].unique()
+            index_mapping[column] = {label: idx for idx, label in enumerate(unique_values)}
+
+    shape = [len(index_mapping[column]) for column in df.columns if column != value_column]
+    multi_dim_array = np.zeros(shape, dtype=np.float32)
+
+    for _, row in df.iterrows():
+        indices = tuple(
+            index_mapping[column][row[column]] for column in df.columns if column != value_column
+        )
+        multi_dim_array[indices] = row[value_column]
+
+    return multi_dim_array
+
+
+def media_frame(weeks=4, channels=("TikTok", "Facebook", "Amazon"), geos=3, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = [
+        (f"Week {week + 1}", channel, geo)
+        for week in range(weeks)
+        for channel in channels
+        for geo in range(geos)
+    ]
+    df = pd.DataFrame(rows, columns=["week_number", "media_channel", "geography"])
+    df["impressions"] = rng.random(len(df))
+    # Rows arrive shuffled, as Athena does not guarantee an order
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def test_plain_keys_match_iterrows():
+    df = media_frame()
+
+    tensor = build_dense_tensor(df, "impressions")
+
+    np.testing.assert_array_equal(tensor.values, iterrows_tensor(df, "impressions"))
+    assert tensor.missing_cells == 0
+    assert tensor.duplicate_cells == 0
+
+
+def test_categorical_keys_match_iterrows():
+    df = media_frame()
+    for column in ("week_number", "media_channel"):
+        df[column] = df[column].astype("category")
+
+    tensor = build_dense_tensor(df, "impressions")
+
+    np.testing.assert_array_equal(tensor.values, iterrows_tensor(df, "impressions"))
+
+
+def test_duplicates_keep_the_last_row_like_iterrows():
+    df = media_frame()
+    duplicates = df.iloc[[0, 5, 5]].copy()
+    duplicates["impressions"] = [10.0, 20.0, 30.0]
+    df = pd.concat([df, duplicates], ignore_index=True)
+
+    tensor = build_dense_tensor(df, "impressions", duplicates="last")
+
+    np.testing.assert_array_equal(tensor.values, iterrows_tensor(df, "impressions"))
+    assert tensor.duplicate_cells == 2
+
+
+def test_duplicate_error_policy_raises():
+    df = media_frame()
+    df = pd.concat([df, df.iloc[[0]]], ignore_index=True)
+
+    with pytest.raises(ValueError):
+        build_dense_tensor(df, "impressions", duplicates="error")
+
+
+def test_sorted_columns_index_geos_by_value():
+    df = media_frame()
+
+    tensor = build_dense_tensor(
+        df,
+        "impressions",
+        key_columns=["week_number", "media_channel", "geography"],
+        sorted_columns=["geography"],
+    )
+
+    np.testing.assert_array_equal(tensor.labels[2], [0, 1, 2])
+    for row in df.itertuples():
+        week = list(tensor.labels[0]).index(row.week_number)
+        channel = list(tensor.labels[1]).index(row.media_channel)
+        assert tensor.values[week, channel, row.geography] == np.float32(row.impressions)
+
+
+def ranked_frame(dtype="int64"):
+    """
+    A pushed down result with week, channel and geo ranks, sorted by them.
+    """
+    weeks, channels, geos = np.meshgrid(
+        np.arange(3), np.arange(2), np.arange(2), indexing="ij"
+    )
+    df = pd.DataFrame(
+        {
+            "week_idx": weeks.ravel(),
+            "channel_idx": channels.ravel(),
+            "geo_idx": geos.ravel(),
+        }
+    ).astype(dtype)
+    df["impressions"] = np.arange(len(df), dtype=np.float64) + 1
+    return df
+
+
+def test_reshape_sorted_tensor_accepts_nullable_int64():
+    df = ranked_frame("Int64")
+
+    values = reshape_sorted_tensor(df, "impressions", ["week_idx", "channel_idx", "geo_idx"])
+
+    np.testing.assert_array_equal(values, np.arange(1, 13, dtype=np.float32).reshape(3, 2, 2))
+
+
+def test_scatter_indexed_tensor_places_rows_at_their_ranks():
+    expected = ranked_frame()["impressions"].to_numpy(dtype=np.float32).reshape(3, 2, 2)
+    df = ranked_frame("Int64")
+    # Week 0 has no rows for channel 0, which must not shift the channel axis
+    df = df[~((df["week_idx"] == 0) & (df["channel_idx"] == 0))]
+    expected[0, 0] = 0
+    index_columns = ["week_idx", "channel_idx", "geo_idx"]
+
+    assert reshape_sorted_tensor(df, "impressions", index_columns) is None
+    tensor = scatter_indexed_tensor(df.sample(frac=1, random_state=0), "impressions", index_columns)
+
+    np.testing.assert_array_equal(tensor.values, expected)
+    assert tensor.missing_cells == 2
+    np.testing.assert_array_equal(tensor.labels[1], [0, 1])
+
+
+def test_index_columns_with_nulls_raise():
+    df = ranked_frame("Int64")
+    df.loc[3, "channel_idx"] = pd.NA
+
+    with pytest.raises(ValueError):
+        reshape_sorted_tensor(df, "impressions", ["week_idx", "channel_idx", "geo_idx"])
+    with pytest.raises(ValueError):
+        scatter_indexed_tensor(df, "impressions", ["week_idx", "channel_idx", "geo_idx"])